@@ -0,0 +1,497 @@
+"""
+Micro-benchmarks for the AI API hot paths.
+
+    python benchmark.py                      # every suite
+    python benchmark.py encoding --rows 50000
+    python benchmark.py inference --model-dir ../models/layoutlmv3-onnx
+
+Each suite prints one line per variant so runs can be diffed over time.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+# The routes used below read and write the shared store: keep them off the
+# real one (removed when the process exits)
+_STATE_DIR = tempfile.TemporaryDirectory(prefix="ai-benchmark-")
+os.environ["AI_LEDGER_PATH"] = os.path.join(_STATE_DIR.name, "ledger.sqlite3")
+
+from fastapi.encoders import jsonable_encoder
+
+from routes.classifier import (
+    CATEGORY_RULES,
+    ClassificationResult,
+    SUGGESTED_CATEGORIES,
+    TransactionData,
+    _classify_rows,
+    classify_description,
+)
+from routes import predictions, suggestions
+from services import (
+    anomaly, dedup, documents, extractor, ledger, merchants, negotiation, ocr_engine, preprocess, singleflight,
+    statement, storage,
+)
+
+DESCRIPTIONS = [
+    "Pix - Enviado 06/01 11:48 Aroldo Pinheiro Pereira",
+    "POSTO COMBUSTIVEL XYZ",
+    "Compra com Cartão",
+    "RESTAURANTE DEF",
+    "PAGAMENTO SALARIO",
+    "Uber trip",
+    "Internet bill",
+]
+
+
+def timed(fn: Callable[[], bytes], repeat: int):
+    best = float("inf")
+    payload = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, len(payload)
+
+
+def report(suite: str, variant: str, seconds: float, extra: str = ""):
+    print(f"{suite:<10} {variant:<28} {seconds * 1000:>10.2f} ms  {extra}")
+
+
+def make_transactions(rows: int) -> List[TransactionData]:
+    rng = random.Random(42)
+    return [
+        TransactionData(
+            description=rng.choice(DESCRIPTIONS),
+            amount=round(rng.uniform(1, 5000), 2),
+            date=f"2025-01-{rng.randint(1, 28):02d}",
+            account_type=rng.choice([None, "checking", "credit"]),
+        )
+        for _ in range(rows)
+    ]
+
+
+def bench_encoding(args):
+    """
+    /classify/batch response encoding: the previous Pydantic + stdlib JSON
+    path against every format offered through content negotiation.
+    """
+    transactions = make_transactions(args.rows)
+
+    def legacy() -> bytes:
+        results = []
+        for transaction in transactions:
+            category, confidence = classify_description(transaction.description)
+            result = ClassificationResult(
+                category=category,
+                confidence=confidence,
+                suggested_categories=SUGGESTED_CATEGORIES
+            )
+            results.append({"transaction": transaction.model_dump(), "classification": result.model_dump()})
+        body = jsonable_encoder({"processed": len(results), "results": results})
+        return json.dumps(body).encode("utf-8")
+
+    def build_body() -> Dict:
+        results = _classify_rows(transactions)
+        return {"processed": len(results), "results": results}
+
+    seconds, size = timed(legacy, args.repeat)
+    report("encoding", "legacy pydantic+json", seconds, f"{size:>12,} bytes")
+
+    for media, encoder in negotiation.ENCODERS.items():
+        seconds, size = timed(lambda: encoder(build_body(), "results"), args.repeat)
+        report("encoding", media.split("/")[-1], seconds, f"{size:>12,} bytes")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def entities(tags: List[str]) -> Set[Tuple[str, int, int]]:
+    """
+    BIO tags -> {(field, start, end)}, the spans seqeval scores.
+    """
+    spans, field, start = set(), None, 0
+    for i, tag in enumerate(tags + ["O"]):
+        prefix, _, name = tag.partition("-")
+        if field and (prefix != "I" or name != field):
+            spans.add((field, start, i))
+            field = None
+        if prefix == "B" or (prefix == "I" and field is None):
+            field, start = name, i
+    return spans
+
+
+def entity_f1(reference: List[List[str]], predicted: List[List[str]]) -> float:
+    expected = {(n,) + e for n, tags in enumerate(reference) for e in entities(tags)}
+    found = {(n,) + e for n, tags in enumerate(predicted) for e in entities(tags)}
+    if not expected and not found:
+        return 1.0
+    hits = len(expected & found)
+    return 2 * hits / (len(expected) + len(found))
+
+
+def _session_rss(model_dir: str, model_file: str, threads: int, result):
+    # Runs in a fresh process: nothing but the interpreter is resident yet
+    before = rss_mb()
+    engine = extractor.LayoutExtractor(model_dir, model_file=model_file, threads=threads)
+    result.put(rss_mb() - before)
+    del engine
+
+
+def session_rss_mb(model_dir: str, model_file: str, threads: int) -> float:
+    """
+    Resident memory added by loading one session, measured in a spawned
+    process so the benchmark's rendered pages are not counted.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    result = context.Queue()
+    process = context.Process(target=_session_rss, args=(model_dir, model_file, threads, result))
+    process.start()
+    memory = result.get()
+    process.join()
+    return memory
+
+
+def bench_inference(args):
+    """
+    /ocr/extract model: int8 against fp32 ONNX on the sample statements.
+    Latency is per document and memory is the RSS of the loaded session
+    alone. There are no gold labels for the sample statements, so the last
+    column is agreement with fp32 (entity-level F1 of the int8 labels
+    against the fp32 labels), not accuracy.
+    """
+    pdfs = sorted(glob.glob(os.path.join(args.pdf_dir, "*.pdf")))
+    docs = []
+    for path in pdfs:
+        with open(path, "rb") as f:
+            docs.append(documents.pdf_pages(f.read(), documents.RENDER_DPI))
+    if not docs:
+        print(f"inference  no PDFs in {args.pdf_dir}")
+        return
+
+    reference = None
+    for model_file in ("model.onnx", "model.int8.onnx"):
+        path = os.path.join(args.model_dir, model_file)
+        if not os.path.exists(path):
+            print(f"inference  missing {path}")
+            continue
+        memory = session_rss_mb(args.model_dir, model_file, args.threads)
+        engine = extractor.LayoutExtractor(args.model_dir, model_file=model_file, threads=args.threads)
+        tags: List[List[str]] = []
+
+        def run() -> bytes:
+            tags.clear()
+            for pages in docs:
+                for page in engine.predict(pages):
+                    tags.append([label for label, _ in page])
+            return b""
+
+        seconds, _ = timed(run, args.repeat)
+        if reference is None:
+            reference = list(tags)
+        agreement = entity_f1(reference, tags)
+        size = os.path.getsize(path) / 1e6
+        report(
+            "inference",
+            model_file,
+            seconds / len(docs),
+            f"{size:>7.1f} MB file  {memory:>7.1f} MB session rss  agreement with fp32 {agreement:.4f}",
+        )
+        del engine
+
+
+def bench_dedup(args):
+    """
+    Duplicate flagging cost per row as the user's history grows: it should
+    stay flat, since each row is a fixed number of index probes.
+    """
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = dedup.DedupIndex(storage.Database(os.path.join(tmp, "state.sqlite3")))
+        recorded = 0
+        for history in (args.rows, args.rows * 4):
+            rows = [
+                (f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                 -round(rng.uniform(1, 5000), 2),
+                 rng.choice(DESCRIPTIONS))
+                for _ in range(history)
+            ]
+            index.check("bench", rows)
+            recorded += history
+            batch = rows[:1000]
+            seconds, _ = timed(lambda: bytes(len(index.check("bench", batch, record=False))), args.repeat)
+            report("dedup", f"1000 rows vs {recorded:,} entries", seconds,
+                   f"{seconds / len(batch) * 1e6:.2f} us/row")
+
+
+def bench_merchants(args):
+    """
+    Merchant lookup cost with a growing number of known merchants: the LSH
+    probes a fixed number of buckets, so it should not grow with the index.
+    New names are timed read-only (anonymous imports) and registered as one
+    batch (synced or trusted rows: one write transaction per request).
+    """
+    rng = random.Random(11)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    with tempfile.TemporaryDirectory() as tmp:
+        index = merchants.MerchantIndex(storage.Database(os.path.join(tmp, "state.sqlite3")))
+        known = 0
+        for size in (args.rows // 10, args.rows):
+            seeded = []
+            while known < size:
+                name = " ".join("".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(3))
+                seeded.append(f"Pix - Enviado 06/01 11:48 {name}")
+                known += 1
+            for start in range(0, len(seeded), 1000):
+                index.lookup_many(seeded[start:start + 1000], register=True)
+            queries = [
+                f"TRANSFERENCIA PIX DES: {rng.choice(letters)}{rng.randint(0, 99)} {rng.choice(DESCRIPTIONS)} {i}"
+                for i in range(1000)
+            ]
+            seconds, _ = timed(lambda: bytes(len(index.lookup_many(queries))), args.repeat)
+            report("merchants", f"1000 new vs {index.stats()['merchants']:,}", seconds,
+                   f"{seconds / len(queries) * 1e6:.1f} us/lookup  read-only")
+            seconds, _ = timed(lambda: bytes(len(index.lookup_many(queries, register=True))), 1)
+            report("merchants", "1000 new, registered", seconds,
+                   f"{seconds / len(queries) * 1e6:.1f} us/lookup  one transaction")
+            seconds, _ = timed(lambda: bytes(len(index.lookup_many(queries))), args.repeat)
+            report("merchants", "1000 known", seconds, f"{seconds / len(queries) * 1e6:.1f} us/lookup")
+
+
+def bench_anomaly(args):
+    """
+    Update and scoring cost per transaction for args.rows users with a few
+    categories each, and bytes stored per (user, category, direction).
+    """
+    rng = random.Random(5)
+    categories = [rule[1] for rule in CATEGORY_RULES]
+    users: Dict[str, List[Tuple[str, float]]] = {}
+    for _ in range(args.rows * 4):
+        users.setdefault(f"user{rng.randrange(args.rows)}", []).append(
+            (rng.choice(categories), -rng.lognormvariate(4, 0.6))
+        )
+    events = sum(len(items) for items in users.values())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        detector = anomaly.AnomalyDetector(storage.Database(os.path.join(tmp, "state.sqlite3")))
+
+        def observe() -> bytes:
+            for user_id, items in users.items():
+                detector.observe(user_id, items)
+            return b""
+
+        def score() -> bytes:
+            for user_id, items in users.items():
+                detector.score_many(user_id, items)
+            return b""
+
+        seconds, _ = timed(observe, 1)
+        with detector.db.read() as conn:
+            states, stored = conn.execute("SELECT COUNT(*), SUM(LENGTH(state)) FROM anomaly_baselines").fetchone()
+        report("anomaly", f"observe {events:,} events", seconds,
+               f"{seconds / events * 1e6:.2f} us/event  {states:,} baselines  {stored / states:.0f} B/baseline")
+        seconds, _ = timed(score, 1)
+        report("anomaly", f"score {events:,} events", seconds, f"{seconds / events * 1e6:.2f} us/event")
+
+
+def bench_singleflight(args):
+    """
+    Dashboard loads: every viewer of a family fires the six analytics routes
+    at once. Compares the coalesced routes with the undecorated ones over a
+    ledger holding args.rows transactions.
+    """
+    users, viewers = 20, 3
+    rng = random.Random(7)
+    categories = [rule[1] for rule in CATEGORY_RULES]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ledger.Ledger(storage.Database(os.path.join(tmp, "ledger.sqlite3")))
+        for u in range(users):
+            rows = [
+                (str(i), f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", -round(rng.uniform(5, 500), 2),
+                 f"row {i}", rng.choice(categories))
+                for i in range(args.rows // users)
+            ]
+            store.apply(f"user{u}", 0, 1, rows, [])
+        original, ledger.store = ledger.store, store
+        enabled = singleflight.group.enabled
+
+        endpoints = [
+            predictions.predict_expenses, predictions.forecast_budget_performance,
+            predictions.analyze_spending_trends, suggestions.get_savings_suggestions,
+            suggestions.get_budget_suggestions, suggestions.get_category_insights,
+        ]
+
+        async def load():
+            calls = []
+            for u in range(users):
+                for _ in range(viewers):
+                    for endpoint in endpoints:
+                        calls.append(endpoint(user_id=f"user{u}"))
+            await asyncio.gather(*calls)
+
+        try:
+            for coalesced in (False, True):
+                singleflight.group.enabled = coalesced
+                before = singleflight.group.stats()["executed"]
+                started = time.perf_counter()
+                asyncio.run(load())
+                seconds = time.perf_counter() - started
+                executed = singleflight.group.stats()["executed"] - before
+                report("singleflight", "coalesced" if coalesced else "independent", seconds,
+                       f"{users * viewers * len(endpoints)} requests  {executed} computations")
+        finally:
+            ledger.store = original
+            singleflight.group.enabled = enabled
+
+
+def scanned_pages(pdf_dir: str, limit: int = 8):
+    """
+    Statement pages made to look like phone photos: 150 DPI, slightly
+    rotated, with uneven lighting and sensor noise.
+    """
+    import numpy as np
+    import pymupdf
+    from PIL import Image
+
+    rng = np.random.default_rng(3)
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pdf_dir, "*.pdf"))):
+        with pymupdf.open(path) as doc:
+            for page in doc:
+                pix = page.get_pixmap(dpi=150, colorspace=pymupdf.csGRAY, alpha=False)
+                image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+                image = image.rotate(float(rng.uniform(-3, 3)), resample=Image.BICUBIC, fillcolor=255)
+                pixels = np.asarray(image, dtype=np.float32) * np.linspace(0.65, 1.0, image.width)[None, :]
+                pixels += rng.normal(0, 8, pixels.shape)
+                pages.append(Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)))
+                if len(pages) == limit:
+                    return pages
+    return pages
+
+
+def bench_ocr(args):
+    """
+    Scanned pages per second: the old path (one pytesseract subprocess on
+    the raw image) against preprocessing plus the worker's engine, with
+    both engine backends. Each variant also reports how many of the
+    transactions the PDF text layer yields it recovers (same date, amount
+    and type). Preprocessing is also timed alone, since it runs without
+    Tesseract.
+    """
+    pages = scanned_pages(args.pdf_dir)
+    if not pages:
+        print(f"ocr        no PDFs in {args.pdf_dir}")
+        return
+
+    expected = []
+    for path in sorted(glob.glob(os.path.join(args.pdf_dir, "*.pdf"))):
+        with open(path, "rb") as f:
+            expected.extend(documents.pdf_pages(f.read()))
+    expected = [_transaction_keys(page.words) for page in expected[:len(pages)]]
+    total = sum(len(keys) for keys in expected)
+
+    def prepare() -> bytes:
+        for image in pages:
+            preprocess.prepare(image, 150)
+        return b""
+
+    seconds, _ = timed(prepare, args.repeat)
+    prepared = [preprocess.prepare(image, 150) for image in pages]
+    rows = sum(len(p.regions) for p in prepared)
+    angles = sum(abs(p.angle) for p in prepared) / len(prepared)
+    report("ocr", "preprocess", seconds,
+           f"{len(pages) / seconds:.2f} pages/s  {rows / len(pages):.1f} rows/page  mean |skew| {angles:.1f} deg")
+
+    lang = ocr_engine.engine.lang
+
+    def raw(image):
+        import pytesseract
+
+        data = pytesseract.image_to_data(image, lang=lang, output_type=pytesseract.Output.DICT)
+        return [
+            (text.strip(), documents.normalize_box(left, top, left + w, top + h, image.width, image.height))
+            for text, left, top, w, h in zip(data["text"], data["left"], data["top"], data["width"], data["height"])
+            if text.strip()
+        ]
+
+    def engine_of(backend):
+        engine = ocr_engine.TesseractEngine(lang=lang, backend=backend)
+
+        def read(image):
+            page = preprocess.prepare(image, 150)
+            height, width = page.binary.shape
+            return [
+                (text, documents.normalize_box(x0, y0, x1, y1, width, height))
+                for text, (x0, y0, x1, y1), _ in engine.recognize(page.binary, page.regions)
+            ]
+        return read
+
+    variants = [("pytesseract raw (before)", raw)]
+    if ocr_engine.tesserocr is not None:
+        variants.append(("tesserocr engine", engine_of("tesserocr")))
+    variants.append(("pytesseract engine", engine_of("pytesseract")))
+    for variant, read in variants:
+        words = []
+
+        def run() -> bytes:
+            words[:] = [read(image) for image in pages]
+            return b""
+
+        try:
+            seconds, _ = timed(run, 1)
+        except Exception as e:
+            print(f"ocr        {variant:<28} skipped: {type(e).__name__}: {e}")
+            continue
+        found = sum(len(_transaction_keys(page) & keys) for page, keys in zip(words, expected))
+        report("ocr", variant, seconds, f"{len(pages) / seconds:.2f} pages/s  {found}/{total} transactions")
+
+
+def _transaction_keys(words) -> Set[Tuple[str, float, str]]:
+    records, _ = statement.assemble(words, None, None)
+    return {(r["date"], round(r["amount"], 2), r["type"]) for r in records}
+
+
+SUITES = {
+    "encoding": bench_encoding,
+    "inference": bench_inference,
+    "dedup": bench_dedup,
+    "merchants": bench_merchants,
+    "anomaly": bench_anomaly,
+    "singleflight": bench_singleflight,
+    "ocr": bench_ocr,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suites", nargs="*", help=f"suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--model-dir", default=extractor.DEFAULT_MODEL_DIR)
+    parser.add_argument("--pdf-dir", default=os.path.join("..", "datasets", "pdf"))
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+
+    for name in args.suites or SUITES:
+        SUITES[name](args)
+
+
+if __name__ == "__main__":
+    main()
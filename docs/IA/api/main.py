@@ -1,11 +1,13 @@
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 import uvicorn
 import os
 from typing import List, Dict, Any
 
-from routes import classifier, suggestions, predictions, ocr
+from routes import classifier, suggestions, predictions, ocr, ingest
+from services import admission, anomaly, dedup, ledger, merchants, ocr_engine, singleflight
 
 # Create FastAPI app
 app = FastAPI(
@@ -33,6 +35,17 @@ app.include_router(classifier.router, prefix="/classify", tags=["Classification"
 app.include_router(suggestions.router, prefix="/suggestions", tags=["Suggestions"])
 app.include_router(predictions.router, prefix="/predict", tags=["Predictions"])
 app.include_router(ocr.router, prefix="/ocr", tags=["OCR"])
+app.include_router(ingest.router, prefix="/ingest", tags=["Ingestion"])
+
+def preload_models():
+    """
+    Load every route's models up front. Called once by the production
+    runner in the master process, before the workers are forked.
+    """
+    for module in (classifier, suggestions, predictions, ocr, ingest):
+        warmup = getattr(module, "warmup", None)
+        if warmup is not None:
+            warmup()
 
 @app.get("/")
 async def root():
@@ -58,10 +71,23 @@ async def health_check():
             "suggestions": "operational", 
             "predictions": "operational",
             "ocr": "operational"
-        }
+        },
+        "admission": admission.controller.stats(),
+        "dedup": dedup.index.stats(),
+        "merchants": merchants.index.stats(),
+        "anomaly": anomaly.detector.stats(),
+        # SQLite read: off the event loop, it may wait on a writer
+        "ledger": await run_in_threadpool(ledger.store.stats),
+        "singleflight": singleflight.group.stats(),
+        "ocr_engine": ocr_engine.engine.stats()
     }
 
 if __name__ == "__main__":
+    if os.getenv("ENVIRONMENT") == "production":
+        from runner import run_from_env
+        run_from_env("main:app")
+        raise SystemExit(0)
+
     port = int(os.getenv("AI_API_PORT", 8001))
     uvicorn.run(
         "main:app",
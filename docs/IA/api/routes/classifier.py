@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import logging
 
+from services import admission, anomaly, dedup, merchants, negotiation
+
 router = APIRouter()
 
 class TransactionData(BaseModel):
@@ -15,77 +18,131 @@ class ClassificationResult(BaseModel):
     category: str
     confidence: float
     suggested_categories: List[Dict[str, float]]
+    merchant_id: Optional[str] = None  # canonical merchant, see services/merchants.py
+    merchant: Optional[str] = None
 
 class BatchClassificationRequest(BaseModel):
     transactions: List[TransactionData]
 
+# (keywords, category, confidence), checked in order
+CATEGORY_RULES = (
+    (('restaurant', 'food', 'meal', 'dining'), "Food & Dining", 0.85),
+    (('gas', 'fuel', 'transport', 'uber', 'taxi'), "Transportation", 0.90),
+    (('shop', 'store', 'market', 'purchase'), "Shopping", 0.75),
+    (('bill', 'electric', 'water', 'internet', 'phone'), "Bills & Utilities", 0.88),
+    (('salary', 'income', 'payroll', 'wage'), "Salary", 0.95),
+)
+
+SUGGESTED_CATEGORIES = [
+    {"Food & Dining": 0.25},
+    {"Transportation": 0.20},
+    {"Shopping": 0.15},
+    {"Bills & Utilities": 0.10}
+]
+
+def classify_description(description: str):
+    """
+    Return (category, confidence) for a transaction description.
+    """
+    # Simple rule-based classification for demo
+    # In a real implementation, this would use trained ML models
+    description_lower = description.lower()
+    for keywords, category, confidence in CATEGORY_RULES:
+        if any(word in description_lower for word in keywords):
+            return category, confidence
+    return "Other", 0.60
+
+def warmup():
+    """
+    Load the known merchants before the workers fork (see runner.py).
+    """
+    merchants.index.refresh()
+
 @router.post("/transaction", response_model=ClassificationResult)
 async def classify_transaction(transaction: TransactionData):
     """
     Classify a single transaction into a category.
     """
     try:
-        # Simulated AI classification logic
-        # In a real implementation, this would use trained ML models
-        
-        description_lower = transaction.description.lower()
-        
-        # Simple rule-based classification for demo
-        if any(word in description_lower for word in ['restaurant', 'food', 'meal', 'dining']):
-            category = "Food & Dining"
-            confidence = 0.85
-        elif any(word in description_lower for word in ['gas', 'fuel', 'transport', 'uber', 'taxi']):
-            category = "Transportation"
-            confidence = 0.90
-        elif any(word in description_lower for word in ['shop', 'store', 'market', 'purchase']):
-            category = "Shopping"
-            confidence = 0.75
-        elif any(word in description_lower for word in ['bill', 'electric', 'water', 'internet', 'phone']):
-            category = "Bills & Utilities"
-            confidence = 0.88
-        elif any(word in description_lower for word in ['salary', 'income', 'payroll', 'wage']):
-            category = "Salary"
-            confidence = 0.95
-        else:
-            category = "Other"
-            confidence = 0.60
-            
-        suggested_categories = [
-            {"Food & Dining": 0.25},
-            {"Transportation": 0.20},
-            {"Shopping": 0.15},
-            {"Bills & Utilities": 0.10}
-        ]
+        category, confidence = classify_description(transaction.description)
+        merchant_id, merchant = merchants.index.lookup(transaction.description)
         
         return ClassificationResult(
             category=category,
             confidence=confidence,
-            suggested_categories=suggested_categories
+            suggested_categories=SUGGESTED_CATEGORIES,
+            merchant_id=merchant_id,
+            merchant=merchant
         )
         
     except Exception as e:
         logging.error(f"Classification error: {str(e)}")
         raise HTTPException(status_code=500, detail="Classification failed")
 
+def _classify_rows(transactions: List[TransactionData], user_id: Optional[str] = None) -> List[Dict]:
+    """
+    Classify every row; with a user_id, also flag rows already imported
+    for that user (services/dedup.py) and score each amount against the
+    user's history for its category (services/anomaly.py). Without one,
+    "duplicate" and "anomaly" are None.
+    """
+    results = []
+    # Only the backend's rows may add merchants (see services/merchants.py)
+    found = merchants.index.lookup_many((t.description for t in transactions), register=user_id is not None)
+    for transaction, (merchant_id, merchant) in zip(transactions, found):
+        category, confidence = classify_description(transaction.description)
+        results.append({
+            "transaction": transaction.model_dump(),
+            "classification": {
+                "category": category,
+                "confidence": confidence,
+                "suggested_categories": SUGGESTED_CATEGORIES,
+                "merchant_id": merchant_id,
+                "merchant": merchant
+            },
+            "duplicate": None,
+            "anomaly": None
+        })
+    if user_id is not None:
+        flags = dedup.index.check(user_id, ((t.date, t.amount, t.description) for t in transactions))
+        scores = anomaly.detector.score_many(
+            user_id, ((r["classification"]["category"], r["transaction"]["amount"]) for r in results)
+        )
+        for result, flag, score in zip(results, flags, scores):
+            result["duplicate"] = flag
+            result["anomaly"] = score
+    return results
+
 @router.post("/batch")
-async def classify_batch(request: BatchClassificationRequest):
+async def classify_batch(
+    request: BatchClassificationRequest,
+    http_request: Request,
+    media: str = Depends(negotiation.accepted_media)
+):
     """
     Classify multiple transactions in batch.
+
+    Goes through admission control (cost grows with the number of rows) and
+    the response format follows the Accept header (JSON, NDJSON, msgpack,
+    Arrow or column-wise JSON), see services/negotiation.py. When the
+    backend identifies the user (see services/admission.py), rows seen in
+    an earlier import for that user are flagged under "duplicate".
     """
     try:
-        results = []
-        for transaction in request.transactions:
-            result = await classify_transaction(transaction)
-            results.append({
-                "transaction": transaction.dict(),
-                "classification": result.dict()
-            })
+        user_id = admission.trusted_user_id(http_request)
+        cost = admission.batch_cost(len(request.transactions))
+        async with admission.controller.admit(user_id or admission.resolve_user_id(http_request), cost):
+            results = await run_in_threadpool(_classify_rows, request.transactions, user_id)
         
-        return {
+        return negotiation.render(http_request, {
             "processed": len(results),
+            "duplicates": sum(1 for r in results if r["duplicate"] and r["duplicate"]["status"]),
+            "anomalies": sum(1 for r in results if r["anomaly"] and r["anomaly"]["flagged"]),
             "results": results
-        }
+        }, rows_key="results", media=media)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Batch classification error: {str(e)}")
         raise HTTPException(status_code=500, detail="Batch classification failed")
@@ -0,0 +1,143 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import List, Dict, Optional
+from datetime import date
+import logging
+
+from routes.classifier import CATEGORY_RULES, classify_description
+from services import admission, anomaly, dedup, ledger, merchants, singleflight, storage
+
+# Only the backend may write, read or wipe a user's synced copy
+router = APIRouter(dependencies=[Depends(admission.require_service)])
+
+class IngestTransaction(BaseModel):
+    id: str
+    date: str
+    amount: float  # expenses are negative
+    description: str
+    category: Optional[str] = None  # classified from the description when missing
+
+class IngestBatch(BaseModel):
+    user_id: str
+    base_watermark: int  # watermark the batch was built on (0 for the first batch)
+    watermark: int       # watermark after the batch
+    upserts: List[IngestTransaction] = []
+    deletes: List[str] = []
+
+def warmup():
+    """
+    Open the store (and create its schema) before the workers are forked,
+    and build the anomaly baselines of users synced before they existed.
+    """
+    ledger.store.stats()
+    anomaly.detector.seed(ledger.store, _rule_category, {rule[1] for rule in CATEGORY_RULES} | {"Other"})
+
+def _rule_category(description: str) -> str:
+    # Anomaly baselines are keyed on the same category imports are scored under
+    return classify_description(description)[0]
+
+def _apply_batch(batch: IngestBatch) -> Dict:
+    """
+    Normalize and store the batch, and keep the duplicate index and the
+    anomaly baselines in step with the ledger in the same transaction. New
+    rows are folded into the baselines; updates and deletes cannot be
+    taken out of a running statistic, so they rebuild the user's
+    baselines from the ledger. The rows' merchants are registered
+    afterwards, in one more transaction.
+    """
+    rows = []
+    for transaction in batch.upserts:
+        day = dedup.parse_day(transaction.date)
+        if day is None:
+            raise HTTPException(status_code=422, detail=f"Invalid date for transaction {transaction.id}: {transaction.date}")
+        category = transaction.category or classify_description(transaction.description)[0]
+        rows.append((transaction.id, date.fromordinal(day).isoformat(), transaction.amount, transaction.description, category))
+
+    with storage.db.write():
+        result = ledger.store.apply(batch.user_id, batch.base_watermark, batch.watermark, rows, batch.deletes)
+        inserted = set(result.pop("inserted"))
+        fresh = [row for row in rows if row[0] in inserted]
+        if not result["replayed"]:
+            dedup.index.sync(batch.user_id, (row[:4] for row in rows), result["deleted"])
+            if result["updated"] or result["deleted"]:
+                anomaly.detector.rebuild(
+                    batch.user_id, ((_rule_category(row[3]), row[2]) for row in ledger.store.rows(batch.user_id))
+                )
+            else:
+                anomaly.detector.observe(batch.user_id, ((_rule_category(row[3]), row[2]) for row in fresh))
+
+    if not result["replayed"] and rows:
+        # After the commit, so a rolled-back batch leaves no merchant behind
+        merchants.index.lookup_many((row[3] for row in rows), register=True)
+
+    return {
+        "user_id": batch.user_id,
+        **result,
+        "inserted": len(fresh),
+        "updated": len(result["updated"]),
+        "deleted": len(result["deleted"]),
+    }
+
+@router.post("/batch")
+async def ingest_batch(batch: IngestBatch):
+    """
+    Apply a batch of upserts and deletes to the user's local copy.
+
+    The batch must start at the store's current watermark for the user;
+    otherwise 409 is returned with the store's watermark, and the sender
+    resumes from there (see services/ledger.py). Re-sending the last applied
+    batch unchanged is acknowledged with "replayed": true.
+    """
+    try:
+        if batch.watermark <= batch.base_watermark:
+            raise HTTPException(status_code=422, detail="watermark must be greater than base_watermark")
+        cost = admission.batch_cost(len(batch.upserts) + len(batch.deletes))
+        async with admission.controller.admit(batch.user_id, cost):
+            result = await run_in_threadpool(_apply_batch, batch)
+        singleflight.group.forget(batch.user_id)
+        return result
+
+    except ledger.WatermarkMismatch as e:
+        raise HTTPException(status_code=409, detail={
+            "message": "Batch does not start at the stored watermark; resume from the returned watermark",
+            "watermark": e.current
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Ingestion error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to ingest batch")
+
+@router.get("/{user_id}/watermark")
+async def get_watermark(user_id: str):
+    """
+    Current watermark and row count for the user; the sender resumes from
+    here after a restart on either side (0 means nothing stored yet).
+    """
+    try:
+        return await run_in_threadpool(ledger.store.watermark, user_id)
+
+    except Exception as e:
+        logging.error(f"Watermark lookup error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to read watermark")
+
+def _reset_user(user_id: str):
+    with storage.db.write():
+        ledger.store.reset(user_id)
+        dedup.index.forget_synced(user_id)
+        anomaly.detector.reset(user_id)
+
+@router.delete("/{user_id}")
+async def reset_user(user_id: str):
+    """
+    Drop the user's local copy and watermark, for a full resync from 0.
+    """
+    try:
+        await run_in_threadpool(_reset_user, user_id)
+        singleflight.group.forget(user_id)
+        return {"user_id": user_id, "watermark": 0, "rows": 0}
+
+    except Exception as e:
+        logging.error(f"Ledger reset error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to reset user data")
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import logging
 
+from routes.classifier import classify_description
+from services import admission, anomaly, dedup, documents, negotiation, statement
+from services.extractor import get_extractor
+
 router = APIRouter()
 
 class ExtractedTransaction(BaseModel):
@@ -11,19 +16,70 @@ class ExtractedTransaction(BaseModel):
     amount: float
     type: str  # "debit" or "credit"
     confidence: float
+    duplicate: Optional[Dict] = None  # see services/dedup.py
+    anomaly: Optional[Dict] = None  # see services/anomaly.py
 
 class SupportedBank(BaseModel):
     bank_name: str
     formats_supported: List[str]
     features: List[str]
 
+def _extract(file_content: bytes, content_type: str) -> Tuple[List[ExtractedTransaction], str]:
+    """
+    Words from the text layer (PDF) or Tesseract (images), labelled by the
+    int8 LayoutLMv3 extractor when it is deployed, or by the rule-based
+    parser otherwise. Returns the transactions and the engine used.
+    """
+    extractor = get_extractor()
+    pages = documents.load_pages(
+        file_content,
+        content_type,
+        render_dpi=documents.RENDER_DPI if extractor else None,
+    )
+    labels = extractor.predict(pages) if extractor else [None] * len(pages)
+
+    transactions: List[ExtractedTransaction] = []
+    carry_date = None
+    for page, page_labels in zip(pages, labels):
+        records, carry_date = statement.assemble(page.words, page_labels, carry_date)
+        transactions.extend(ExtractedTransaction(**record) for record in records)
+    return transactions, "layoutlmv3-onnx" if extractor else "rules"
+
+def _flag(user_id: str, transactions: List[ExtractedTransaction]):
+    """
+    Duplicate and anomaly flags for the user, on signed amounts (debits
+    negative) like the rest of the API.
+    """
+    signed = [-t.amount if t.type == "debit" else t.amount for t in transactions]
+    flags = dedup.index.check(user_id, ((t.date, amount, t.description) for t, amount in zip(transactions, signed)))
+    scores = anomaly.detector.score_many(
+        user_id, ((classify_description(t.description)[0], amount) for t, amount in zip(transactions, signed))
+    )
+    for transaction, flag, score in zip(transactions, flags, scores):
+        transaction.duplicate = flag
+        transaction.anomaly = score
+
+def warmup():
+    """
+    Load the extractor before the workers fork (see runner.py).
+    """
+    get_extractor()
+
 @router.post("/extract")
 async def extract_transactions(
+    request: Request,
     file: UploadFile = File(...),
-    bank_name: Optional[str] = None
+    bank_name: Optional[str] = None,
+    media: str = Depends(negotiation.accepted_media)
 ):
     """
     Extract transaction data from bank statement files (PDF/images).
+
+    Goes through admission control (cost grows with the page count) and the
+    response format follows the Accept header, see services/negotiation.py.
+    When the backend identifies the user (see services/admission.py),
+    transactions already imported for that user are flagged under
+    "duplicate".
     """
     try:
         # Validate file type
@@ -36,66 +92,49 @@ async def extract_transactions(
         # Read file content
         file_content = await file.read()
         
-        # Simulated OCR processing
-        # In real implementation, this would use OCR libraries like Tesseract
-        # and specialized models for different bank statement formats
+        user_id = admission.trusted_user_id(request)
+        # Priced before admission, so the parse must not block the event loop
+        pages = await run_in_threadpool(documents.page_count, file_content, file.content_type)
+        async with admission.controller.admit(user_id or admission.resolve_user_id(request), admission.pages_cost(pages)):
+            extracted_transactions, engine = await run_in_threadpool(_extract, file_content, file.content_type)
         
-        extracted_transactions = [
-            ExtractedTransaction(
-                date="2024-01-15",
-                description="SUPERMERCADO ABC",
-                amount=127.50,
-                type="debit",
-                confidence=0.95
-            ),
-            ExtractedTransaction(
-                date="2024-01-14",
-                description="PAGAMENTO SALARIO",
-                amount=3500.00,
-                type="credit",
-                confidence=0.98
-            ),
-            ExtractedTransaction(
-                date="2024-01-13",
-                description="POSTO COMBUSTIVEL XYZ",
-                amount=89.90,
-                type="debit",
-                confidence=0.92
-            ),
-            ExtractedTransaction(
-                date="2024-01-12",
-                description="RESTAURANTE DEF",
-                amount=45.80,
-                type="debit",
-                confidence=0.88
-            )
-        ]
+        if user_id is not None:
+            await run_in_threadpool(_flag, user_id, extracted_transactions)
         
         # Summary statistics
         total_credits = sum(t.amount for t in extracted_transactions if t.type == "credit")
         total_debits = sum(t.amount for t in extracted_transactions if t.type == "debit")
-        avg_confidence = sum(t.confidence for t in extracted_transactions) / len(extracted_transactions)
+        avg_confidence = (
+            sum(t.confidence for t in extracted_transactions) / len(extracted_transactions)
+            if extracted_transactions else 0.0
+        )
         
-        return {
+        return negotiation.render(request, {
             "filename": file.filename,
             "bank_detected": bank_name or "Generic Bank",
             "extraction_summary": {
                 "total_transactions": len(extracted_transactions),
+                "duplicates": sum(1 for t in extracted_transactions if t.duplicate and t.duplicate["status"]),
+                "anomalies": sum(1 for t in extracted_transactions if t.anomaly and t.anomaly["flagged"]),
                 "total_credits": total_credits,
                 "total_debits": total_debits,
                 "net_amount": total_credits - total_debits,
                 "average_confidence": round(avg_confidence, 2)
             },
-            "transactions": extracted_transactions,
+            "transactions": [t.model_dump() for t in extracted_transactions],
             "processing_notes": [
-                "OCR processing completed successfully",
+                f"Extraction engine: {engine}",
                 "Date formats standardized to ISO format",
                 "Amounts converted to decimal format",
                 "Transaction types classified automatically"
             ],
             "extracted_at": "2024-01-01T00:00:00Z"
-        }
+        }, rows_key="transactions", media=media)
         
+    except documents.UnreadableDocument as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"OCR extraction error: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to extract transactions from file")
@@ -195,7 +234,7 @@ async def get_supported_formats():
                 "description": "PDF bank statements",
                 "max_size_mb": 10,
                 "requirements": [
-                    "Text-based PDF (not scanned images)",
+                    "Text-based or scanned PDF",
                     "Standard bank statement format",
                     "Portuguese or English language"
                 ]
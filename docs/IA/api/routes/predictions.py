@@ -1,8 +1,12 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import logging
 
+from routes.classifier import classify_description
+from services import anomaly, ledger, singleflight
+
 router = APIRouter()
 
 class ExpensePrediction(BaseModel):
@@ -24,7 +28,53 @@ class TrendAnalysis(BaseModel):
     change_percentage: float
     significance: str  # "high", "medium", "low"
 
+class AnomalyTransaction(BaseModel):
+    description: str
+    amount: float  # expenses are negative
+    date: str
+
+class AnomalyRequest(BaseModel):
+    user_id: str
+    transactions: List[AnomalyTransaction]
+
+class AnomalyResult(BaseModel):
+    transaction: AnomalyTransaction
+    category: str
+    score: float
+    reason: Optional[str] = None
+
+def _monthly_series(history: Dict[str, Dict[str, float]]) -> Dict[str, List[float]]:
+    """
+    Per-category monthly spending over the months present in the user's
+    synced history, oldest first; months without spending count as 0.
+    """
+    months = sorted({month for by_month in history.values() for month in by_month})
+    return {category: [by_month.get(month, 0.0) for month in months] for category, by_month in history.items()}
+
+def _trend(category: str, series: List[float]) -> TrendAnalysis:
+    """
+    Compare the recent half of the months with the earlier half.
+    """
+    half = len(series) // 2
+    earlier = sum(series[:half]) / half
+    recent = sum(series[half:]) / (len(series) - half)
+    change = (recent - earlier) / earlier * 100 if earlier else (100.0 if recent else 0.0)
+    if change > 5:
+        direction = "increasing"
+    elif change < -5:
+        direction = "decreasing"
+    else:
+        direction = "stable"
+    significance = "high" if abs(change) >= 15 else "medium" if abs(change) >= 5 else "low"
+    return TrendAnalysis(
+        category=category,
+        trend_direction=direction,
+        change_percentage=round(change, 1),
+        significance=significance
+    )
+
 @router.post("/expenses")
+@singleflight.group.coalesce("predict_expenses")
 async def predict_expenses(
     user_id: str,
     categories: Optional[List[str]] = None,
@@ -32,18 +82,27 @@ async def predict_expenses(
 ):
     """
     Predict future expenses for specific categories.
+
+    Categories with history synced through /ingest are predicted from their
+    monthly average; the others fall back to the simulated defaults.
     """
     try:
-        # Simulated ML prediction logic
-        # In real implementation, this would use time series forecasting models
-        
+        series = _monthly_series(await ledger.history(user_id))
+
         if not categories:
-            categories = ["Food & Dining", "Transportation", "Bills & Utilities", "Shopping"]
-        
+            categories = sorted(series) or ["Food & Dining", "Transportation", "Bills & Utilities", "Shopping"]
+
         predictions = []
-        
+
         for category in categories:
-            if category == "Food & Dining":
+            if category in series:
+                months = series[category]
+                predicted_amount = round(sum(months) / len(months), 2)
+                confidence = round(min(0.95, 0.5 + 0.075 * len(months)), 2)
+                factors = [f"Average of the last {len(months)} months", "Synced transaction history"]
+            # Simulated ML prediction logic
+            # In real implementation, this would use time series forecasting models
+            elif category == "Food & Dining":
                 predicted_amount = 750.0
                 confidence = 0.87
                 factors = ["Seasonal variation", "Historical average", "Recent trend"]
@@ -82,6 +141,7 @@ async def predict_expenses(
         raise HTTPException(status_code=500, detail="Failed to predict expenses")
 
 @router.post("/budget")
+@singleflight.group.coalesce("predict_budget")
 async def forecast_budget_performance(
     user_id: str,
     months_ahead: int = 6
@@ -134,12 +194,19 @@ async def forecast_budget_performance(
         raise HTTPException(status_code=500, detail="Failed to forecast budget")
 
 @router.get("/trends")
+@singleflight.group.coalesce("predict_trends")
 async def analyze_spending_trends(user_id: str):
     """
     Analyze spending trends across categories.
+
+    Uses the history synced through /ingest when the user has at least two
+    months of it; otherwise returns the simulated analysis.
     """
     try:
+        series = _monthly_series(await ledger.history(user_id))
         trends = [
+            _trend(category, months) for category, months in sorted(series.items()) if len(months) >= 2
+        ] or [
             TrendAnalysis(
                 category="Food & Dining",
                 trend_direction="increasing",
@@ -195,4 +262,42 @@ async def analyze_spending_trends(user_id: str):
         
     except Exception as e:
         logging.error(f"Trend analysis error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to analyze trends")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to analyze trends")
+
+@router.post("/anomalies")
+async def detect_anomalies(request: AnomalyRequest):
+    """
+    Score transactions against the user's running per-category statistics
+    and return the outliers. Each transaction costs O(1); see
+    services/anomaly.py. The statistics are learned from the history synced
+    through /ingest; scoring does not change them.
+    """
+    try:
+        # Baselines are keyed on the rule category (see services/anomaly.py)
+        categories = [classify_description(transaction.description)[0] for transaction in request.transactions]
+        scores = await run_in_threadpool(
+            anomaly.detector.score_many,
+            request.user_id,
+            [(category, t.amount) for category, t in zip(categories, request.transactions)],
+        )
+        flagged = [
+            AnomalyResult(transaction=transaction, category=category, score=result["score"], reason=result["reason"])
+            for transaction, category, result in zip(request.transactions, categories, scores)
+            if result["flagged"]
+        ]
+
+        return {
+            "user_id": request.user_id,
+            "scored": len(request.transactions),
+            "anomalies": sorted(flagged, key=lambda a: a.score, reverse=True),
+            "categories": await run_in_threadpool(
+                lambda: {
+                    category: anomaly.detector.summary(request.user_id, category)
+                    for category in sorted({a.category for a in flagged})
+                }
+            )
+        }
+
+    except Exception as e:
+        logging.error(f"Anomaly detection error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to detect anomalies")
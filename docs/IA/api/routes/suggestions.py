@@ -3,6 +3,8 @@ from pydantic import BaseModel
 from typing import List, Dict, Optional
 import logging
 
+from services import ledger, singleflight
+
 router = APIRouter()
 
 class SavingsSuggestion(BaseModel):
@@ -21,9 +23,14 @@ class BudgetSuggestion(BaseModel):
     impact: str
 
 @router.get("/savings")
+@singleflight.group.coalesce("suggestions_savings")
 async def get_savings_suggestions(user_id: str):
     """
     Get personalized savings suggestions based on spending patterns.
+
+    When the user's history has been synced through /ingest, current
+    spending is the category's monthly average and the suggested budget
+    keeps the same proportional cut.
     """
     try:
         # Simulated AI analysis for demo
@@ -68,6 +75,16 @@ async def get_savings_suggestions(user_id: str):
             )
         ]
         
+        history = await ledger.history(user_id)
+        for suggestion in suggestions:
+            by_month = history.get(suggestion.category)
+            if not by_month:
+                continue
+            ratio = suggestion.suggested_budget / suggestion.current_spending
+            suggestion.current_spending = round(sum(by_month.values()) / len(by_month), 2)
+            suggestion.suggested_budget = round(suggestion.current_spending * ratio, 2)
+            suggestion.potential_savings = round(suggestion.current_spending - suggestion.suggested_budget, 2)
+        
         total_potential_savings = sum(s.potential_savings for s in suggestions)
         
         return {
@@ -82,6 +99,7 @@ async def get_savings_suggestions(user_id: str):
         raise HTTPException(status_code=500, detail="Failed to generate savings suggestions")
 
 @router.get("/budget")
+@singleflight.group.coalesce("suggestions_budget")
 async def get_budget_suggestions(user_id: str):
     """
     Get budget optimization recommendations.
@@ -123,6 +141,7 @@ async def get_budget_suggestions(user_id: str):
         raise HTTPException(status_code=500, detail="Failed to generate budget suggestions")
 
 @router.get("/categories")
+@singleflight.group.coalesce("suggestions_categories")
 async def get_category_insights(user_id: str):
     """
     Get insights about spending patterns by category.
@@ -0,0 +1,273 @@
+"""
+Production pre-fork runner for the AI API.
+
+The master process imports the application and warms up every model once,
+freezes the garbage collector so the preloaded objects are moved to the
+permanent generation, and only then forks the workers. Pages holding model
+weights are therefore shared copy-on-write between workers: refcount updates
+are the only writes they see and a frozen heap is never traversed by the
+collector, so total RSS grows far slower than the number of workers.
+
+Workers share no memory after the fork, so nothing a response depends on
+is kept per worker: the synced ledger, the duplicate and merchant indexes
+and the anomaly baselines live in one SQLite file (services/storage.py)
+that every worker reads and writes. What stays per worker only shapes
+scheduling - the admission controller, which takes its 1/workers share of
+the configured limits, and request coalescing (services/singleflight.py) -
+so any number of workers returns the same results as one.
+
+Signals handled by the master:
+    SIGTERM / SIGINT  graceful shutdown of every worker
+    SIGHUP            rolling restart, one worker at a time
+    SIGTTIN / SIGTTOU add / remove one worker
+"""
+
+import gc
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+logger = logging.getLogger("will_finance.runner")
+
+
+class PreforkRunner:
+    """
+    Supervise a fixed pool of uvicorn workers forked from a preloaded master.
+    """
+
+    def __init__(
+        self,
+        app_path: str = "main:app",
+        host: str = "0.0.0.0",
+        port: int = 8001,
+        workers: int = 2,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: int = 30,
+        boot_timeout: float = 60.0,
+    ):
+        self.app_path = app_path
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.boot_timeout = boot_timeout
+
+        self.app = None
+        self.socket: Optional[socket.socket] = None
+        self.children: Dict[int, int] = {}  # pid -> readiness pipe read fd
+        self.shutting_down = False
+        self.pending_signals = []
+
+    # ------------------------------------------------------------------
+    # Master
+    # ------------------------------------------------------------------
+
+    def preload(self):
+        """
+        Import the app and load all models before any worker is forked.
+        """
+        module_name, attr = self.app_path.split(":", 1)
+        module = __import__(module_name)
+        self.app = getattr(module, attr)
+
+        # The app imported the admission controller before the worker count
+        # was known; give each worker its share of the limits
+        from services import admission
+
+        admission.configure(self.workers)
+
+        warmup = getattr(module, "preload_models", None)
+        if warmup is not None:
+            started = time.perf_counter()
+            warmup()
+            logger.info("Models preloaded in %.2fs", time.perf_counter() - started)
+
+        # Move everything allocated so far out of the collector's reach so
+        # that collections in the workers do not touch (and unshare) it.
+        gc.collect()
+        gc.freeze()
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        self.socket = sock
+
+    def run(self):
+        self.preload()
+        self.bind()
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(sig, self._queue_signal)
+        signal.signal(signal.SIGCHLD, lambda *_: None)
+
+        logger.info(
+            "Master %s listening on %s:%s with %s workers",
+            os.getpid(), self.host, self.port, self.workers
+        )
+        for _ in range(self.workers):
+            self.spawn_worker()
+
+        while not self.shutting_down:
+            self._handle_signals()
+            self._reap_workers()
+            if not self.shutting_down:
+                while len(self.children) < self.workers:
+                    self.spawn_worker()
+            time.sleep(0.5)
+
+        self._stop_all()
+
+    def spawn_worker(self) -> int:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            for fd in self.children.values():
+                os.close(fd)
+            try:
+                self._worker_main(ready_w)
+            finally:
+                os._exit(0)
+
+        os.close(ready_w)
+        self.children[pid] = ready_r
+        logger.info("Spawned worker %s", pid)
+        return pid
+
+    def wait_ready(self, pid: int) -> bool:
+        """
+        Block until the worker reports it is accepting connections.
+        """
+        fd = self.children.get(pid)
+        if fd is None:
+            return False
+        readable, _, _ = select.select([fd], [], [], self.boot_timeout)
+        return bool(readable) and os.read(fd, 1) == b"1"
+
+    def rolling_restart(self):
+        """
+        Replace workers one by one; each new worker must be ready before the
+        old one is asked to drain, so serving capacity never drops.
+        """
+        logger.info("Rolling restart of %s workers", len(self.children))
+        for old_pid in list(self.children):
+            new_pid = self.spawn_worker()
+            if not self.wait_ready(new_pid):
+                logger.error("Worker %s failed to boot, aborting rolling restart", new_pid)
+                return
+            self._terminate(old_pid)
+
+    def _queue_signal(self, signum, frame):
+        self.pending_signals.append(signum)
+
+    def _handle_signals(self):
+        while self.pending_signals:
+            signum = self.pending_signals.pop(0)
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                self.shutting_down = True
+            elif signum == signal.SIGHUP:
+                self.rolling_restart()
+            elif signum == signal.SIGTTIN:
+                self.workers += 1
+            elif signum == signal.SIGTTOU and self.workers > 1:
+                self.workers -= 1
+                if self.children:
+                    self._terminate(next(iter(self.children)))
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            fd = self.children.pop(pid, None)
+            if fd is not None:
+                os.close(fd)
+            logger.info("Worker %s exited with status %s", pid, os.waitstatus_to_exitcode(status))
+
+    def _terminate(self, pid: int, sig: int = signal.SIGTERM):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _stop_all(self):
+        for pid in list(self.children):
+            self._terminate(pid)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap_workers()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self._terminate(pid, signal.SIGKILL)
+        self._reap_workers()
+        logger.info("Master %s stopped", os.getpid())
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _worker_main(self, ready_fd: int):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        random.seed()
+
+        limit = None
+        if self.max_requests > 0:
+            # Jitter keeps the workers from all recycling at the same moment
+            limit = self.max_requests + random.randint(0, max(0, self.max_requests_jitter))
+
+        config = uvicorn.Config(
+            self.app,
+            limit_max_requests=limit,
+            timeout_graceful_shutdown=self.graceful_timeout,
+            log_level=os.getenv("LOG_LEVEL", "info").lower(),
+        )
+        server = uvicorn.Server(config)
+
+        def notify_ready():
+            while not server.started and not server.should_exit:
+                time.sleep(0.05)
+            os.write(ready_fd, b"1" if server.started else b"0")
+            os.close(ready_fd)
+
+        threading.Thread(target=notify_ready, daemon=True).start()
+        server.run(sockets=[self.socket])
+
+
+def run_from_env(app_path: str = "main:app"):
+    """
+    Build a runner from the AI_API_* environment variables and start it.
+    """
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+    workers = int(os.getenv("AI_API_WORKERS", os.cpu_count() or 1))
+    runner = PreforkRunner(
+        app_path=app_path,
+        host=os.getenv("AI_API_HOST", "0.0.0.0"),
+        port=int(os.getenv("AI_API_PORT", 8001)),
+        workers=workers,
+        max_requests=int(os.getenv("AI_API_MAX_REQUESTS", 0)),
+        max_requests_jitter=int(os.getenv("AI_API_MAX_REQUESTS_JITTER", 0)),
+        graceful_timeout=int(os.getenv("AI_API_GRACEFUL_TIMEOUT", 30)),
+    )
+    runner.run()
+
+
+if __name__ == "__main__":
+    run_from_env()
@@ -0,0 +1,357 @@
+"""
+Admission control for the CPU-heavy routes.
+
+Every expensive request is given a cost (OCR pages, classified rows) and
+goes through two gates before it may run:
+
+1. A per-user token bucket. A user that spends more than `user_rate` cost
+   units per second (after a `user_burst` allowance) gets 429 with a
+   Retry-After telling them when the bucket will hold enough tokens.
+
+2. A weighted fair queue shared by all users. At most `capacity` cost units
+   run at the same time; the rest wait ordered by their virtual finish time
+   (self-clocked fair queuing), so one user's backlog cannot starve the
+   others and a cheap request overtakes a queue of expensive ones. If the
+   work queued ahead of a request would keep it waiting longer than
+   `max_wait` seconds, it is rejected straight away with 503 + Retry-After
+   instead of tying up a connection.
+
+The controller lives in the worker's event loop, so no locking is needed.
+Each worker of the pre-fork runner has its own controller, so the
+configured capacity, per-user rate and burst are for the whole server and
+are divided by the worker count (runner.py calls configure() before it
+forks; AI_API_WORKERS otherwise).
+
+Callers are identified by the x-user-id header only when the request
+carries the backend's service token (Authorization: Bearer
+AI_SERVICE_TOKEN); anything else is keyed by its client address, so a
+client cannot dodge its bucket by inventing user ids.
+"""
+
+import asyncio
+import hmac
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request
+
+# Cost model, in "units" of roughly one classified batch of 500 rows
+ROWS_PER_UNIT = 500
+UNITS_PER_PAGE = 4
+
+
+def batch_cost(rows: int) -> float:
+    return 1.0 + rows / ROWS_PER_UNIT
+
+
+def pages_cost(pages: int) -> float:
+    return float(max(1, pages) * UNITS_PER_PAGE)
+
+
+def is_service(request: Request) -> bool:
+    """
+    True when the request carries the backend's service token.
+    """
+    token = os.getenv("AI_SERVICE_TOKEN")
+    if not token:
+        return False
+    authorization = request.headers.get("authorization", "")
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+def require_service(request: Request):
+    """
+    Route dependency for the backend-only routes (/ingest): 403 when no
+    service token is configured, 401 when the request does not carry it.
+    """
+    if not os.getenv("AI_SERVICE_TOKEN"):
+        raise HTTPException(status_code=403, detail="AI_SERVICE_TOKEN is not configured on this server")
+    if not is_service(request):
+        raise HTTPException(
+            status_code=401,
+            detail="Service token required",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+def trusted_user_id(request: Request) -> Optional[str]:
+    """
+    The x-user-id header of a request from the backend; None for any other
+    caller, or when no service token is configured.
+    """
+    if not is_service(request):
+        return None
+    return request.headers.get("x-user-id") or None
+
+
+def resolve_user_id(request: Request) -> str:
+    """
+    Admission key of the caller: the trusted user id, otherwise the client
+    address.
+    """
+    user_id = trusted_user_id(request)
+    if user_id:
+        return user_id
+    host = request.client.host if request.client else "anonymous"
+    return f"ip:{host}"
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+    def refill(self, rate: float, burst: float, now: float):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class _Waiter:
+    __slots__ = ("user_id", "cost", "finish", "future")
+
+    def __init__(self, user_id: str, cost: float, finish: float, future: asyncio.Future):
+        self.user_id = user_id
+        self.cost = cost
+        self.finish = finish
+        self.future = future
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        capacity: float,
+        user_rate: float,
+        user_burst: float,
+        max_wait: float = 10.0,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.capacity = capacity
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self.weights = weights or {}
+
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.last_finish: Dict[str, float] = {}
+        self.queue: List = []
+        self.counter = itertools.count()
+        self.virtual_time = 0.0
+        self.in_use = 0.0
+        self.queued_cost = 0.0
+        self.last_sweep = time.monotonic()
+
+        # Cost units completed per second while busy, smoothed; used to turn
+        # queued cost into an expected wait
+        self.throughput = capacity
+        self.window_start = self.last_sweep
+        self.completed = 0.0
+        self.rejected = {"rate_limited": 0, "overloaded": 0}
+
+    # ------------------------------------------------------------------
+    # Token buckets
+    # ------------------------------------------------------------------
+
+    def _take_tokens(self, user_id: str, cost: float, now: float):
+        # A request larger than the burst could never be admitted otherwise
+        cost = min(cost, self.user_burst)
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.user_burst, now)
+        else:
+            bucket.refill(self.user_rate, self.user_burst, now)
+
+        if bucket.tokens < cost:
+            self.rejected["rate_limited"] += 1
+            retry_after = (cost - bucket.tokens) / self.user_rate
+            raise _reject(429, "Per-user rate limit exceeded", retry_after)
+        bucket.tokens -= cost
+
+    def _sweep(self, now: float):
+        # Idle buckets are full again and fair-queue tags fall behind the
+        # virtual clock, so both can be forgotten without changing behavior
+        if now - self.last_sweep < 60 or len(self.buckets) < 1024:
+            return
+        self.last_sweep = now
+        idle = self.user_burst / self.user_rate
+        for user_id in [u for u, b in self.buckets.items() if now - b.updated > idle]:
+            del self.buckets[user_id]
+        for user_id in [u for u, f in self.last_finish.items() if f <= self.virtual_time]:
+            del self.last_finish[user_id]
+
+    # ------------------------------------------------------------------
+    # Fair queue
+    # ------------------------------------------------------------------
+
+    def _finish_tag(self, user_id: str, cost: float) -> float:
+        start = max(self.virtual_time, self.last_finish.get(user_id, 0.0))
+        return start + cost / self.weights.get(user_id, 1.0)
+
+    def _estimated_wait(self, finish: float) -> float:
+        ahead = sum(w.cost for _, _, w in self.queue if w.finish <= finish and not w.future.done())
+        backlog = ahead + max(0.0, self.in_use - self.capacity)
+        return backlog / max(self.throughput, 1e-6)
+
+    def _start(self, user_id: str, cost: float, finish: float, now: float):
+        if self.in_use == 0:
+            # Throughput is measured over busy periods only
+            self.window_start = now
+            self.completed = 0.0
+        self.in_use += cost
+        self.virtual_time = max(self.virtual_time, finish - cost / self.weights.get(user_id, 1.0))
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.queue:
+            _, _, waiter = self.queue[0]
+            if waiter.future.done():
+                heapq.heappop(self.queue)
+                self.queued_cost -= waiter.cost
+                continue
+            # An oversized request still runs, alone, once the pool drains
+            if self.in_use > 0 and self.in_use + waiter.cost > self.capacity:
+                return
+            heapq.heappop(self.queue)
+            self.queued_cost -= waiter.cost
+            self._start(waiter.user_id, waiter.cost, waiter.finish, now)
+            waiter.future.set_result(None)
+
+    async def acquire(self, user_id: str, cost: float):
+        now = time.monotonic()
+        self._sweep(now)
+        self._take_tokens(user_id, cost, now)
+
+        finish = self._finish_tag(user_id, cost)
+        while self.queue and self.queue[0][2].future.done():
+            self.queued_cost -= heapq.heappop(self.queue)[2].cost
+        if not self.queue and (self.in_use == 0 or self.in_use + cost <= self.capacity):
+            self.last_finish[user_id] = finish
+            self._start(user_id, cost, finish, now)
+            return
+
+        wait = self._estimated_wait(finish)
+        if wait > self.max_wait:
+            self._refund(user_id, cost)
+            self.rejected["overloaded"] += 1
+            raise _reject(503, "Server busy, try again later", wait)
+
+        previous = self.last_finish.get(user_id)
+        self.last_finish[user_id] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (finish, next(self.counter), _Waiter(user_id, cost, finish, future)))
+        self.queued_cost += cost
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done():
+                return  # granted while the timeout was being delivered
+            future.cancel()
+            self._forget_finish(user_id, finish, previous)
+            self._refund(user_id, cost)
+            self.rejected["overloaded"] += 1
+            raise _reject(503, "Server busy, try again later", self._estimated_wait(finish))
+        except asyncio.CancelledError:
+            # Client went away: give the slot back if it was already granted
+            if future.done() and not future.cancelled():
+                self.release(cost)
+            else:
+                future.cancel()
+                self._forget_finish(user_id, finish, previous)
+            raise
+
+    def _forget_finish(self, user_id: str, finish: float, previous: Optional[float]):
+        # A request that never ran must not push back the user's next finish
+        # tag; later requests of the same user may have moved it on already
+        if self.last_finish.get(user_id) != finish:
+            return
+        if previous is None:
+            del self.last_finish[user_id]
+        else:
+            self.last_finish[user_id] = previous
+
+    def _refund(self, user_id: str, cost: float):
+        bucket = self.buckets.get(user_id)
+        if bucket is not None:
+            bucket.tokens = min(self.user_burst, bucket.tokens + min(cost, self.user_burst))
+
+    def release(self, cost: float):
+        now = time.monotonic()
+        self.in_use = max(0.0, self.in_use - cost)
+        self.completed += cost
+        elapsed = now - self.window_start
+        if elapsed >= 1.0:
+            self.throughput = 0.7 * self.throughput + 0.3 * (self.completed / elapsed)
+            self.window_start = now
+            self.completed = 0.0
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, cost: float):
+        """
+        Run the enclosed block once the request is admitted; raises
+        HTTPException(429/503) with a Retry-After header otherwise.
+        """
+        await self.acquire(user_id, cost)
+        try:
+            yield
+        finally:
+            self.release(cost)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queued": len(self.queue),
+            "queued_cost": round(self.queued_cost, 2),
+            "throughput": round(self.throughput, 2),
+            "tracked_users": len(self.buckets),
+            **self.rejected,
+        }
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.getenv("AI_API_WORKERS", 1)))
+    except ValueError:
+        return 1
+
+
+def build_controller(workers: Optional[int] = None) -> AdmissionController:
+    """
+    A controller holding one worker's share of the server-wide limits.
+    """
+    workers = workers or _workers()
+    return AdmissionController(
+        capacity=float(os.getenv("AI_ADMISSION_CAPACITY", 4 * (os.cpu_count() or 1))) / workers,
+        user_rate=float(os.getenv("AI_ADMISSION_USER_RATE", 4)) / workers,
+        user_burst=float(os.getenv("AI_ADMISSION_USER_BURST", 40)) / workers,
+        max_wait=float(os.getenv("AI_ADMISSION_MAX_WAIT", 10)),
+    )
+
+
+def configure(workers: int):
+    """
+    Re-split the limits for `workers` processes. Called by the pre-fork
+    runner once it knows the worker count, since the app (and this module)
+    may have been imported before it did.
+    """
+    global controller
+    controller = build_controller(workers)
+
+
+controller = build_controller()
@@ -0,0 +1,268 @@
+"""
+Streaming per-user, per-category anomaly detection.
+
+Each (user, category, direction) keeps a fixed 13-slot float64 row, stored
+as a 104-byte blob; debits and credits of a category have separate
+baselines, so a refund or a salary never blends into the spending:
+
+    count, mean, M2                  Welford running mean / variance
+    q0..q4, n0..n4                   P² sketch of the 95th percentile
+
+A transaction's size is scored against its baseline in O(1). It is
+flagged when it is at least AI_ANOMALY_Z standard deviations above the
+mean *and* above the running p95 - the quantile guard keeps heavy-tailed
+categories (rent, travel) from flagging every large but ordinary payment.
+Nothing is scored until a baseline has AI_ANOMALY_MIN_SAMPLES observations.
+
+The baselines are learned from the synced ledger only: /ingest folds new
+rows in, and a batch that updates or deletes rows rebuilds the user's
+baselines from the ledger. Imports and /predict/anomalies only score.
+Baselines and scores are both keyed on the rule category of the
+description (routes/classifier.py), never on a category the backend or a
+client sent, so the two sides always meet. The
+rows live in the shared SQLite store (services/storage.py), so every
+worker and restart scores against the same history, and users synced
+before the baselines existed are seeded from the ledger at preload.
+"""
+
+import math
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from services import storage
+
+QUANTILE = 0.95
+_COUNT, _MEAN, _M2 = 0, 1, 2
+_Q = slice(3, 8)
+_N = slice(8, 13)
+WIDTH = 13
+_INCREMENTS = (0.0, QUANTILE / 2, QUANTILE, (1 + QUANTILE) / 2, 1.0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anomaly_baselines (
+    user_id   TEXT NOT NULL,
+    category  TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    state     BLOB NOT NULL,
+    PRIMARY KEY (user_id, category, direction)
+) WITHOUT ROWID;
+"""
+
+# (category, signed amount); expenses are negative
+Item = Tuple[str, float]
+
+
+def direction(amount: float) -> str:
+    return "debit" if amount < 0 else "credit"
+
+
+def _p2_update(q: List[float], n: List[float], count: int, x: float):
+    """
+    One step of the P² algorithm (Jain & Chlamtac, 1985) on marker heights
+    q and positions n; count already includes x.
+    """
+    if x < q[0]:
+        q[0] = x
+        k = 0
+    elif x >= q[4]:
+        q[4] = max(q[4], x)
+        k = 3
+    else:
+        k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+    for i in range(k + 1, 5):
+        n[i] += 1
+
+    for i in (1, 2, 3):
+        desired = 1 + (count - 1) * _INCREMENTS[i]
+        d = desired - n[i]
+        if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+            # Parabolic prediction, linear if it would break monotonicity
+            candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+            )
+            if not q[i - 1] < candidate < q[i + 1]:
+                j = i + d
+                candidate = q[i] + d * (q[j] - q[i]) / (n[j] - n[i])
+            q[i] = candidate
+            n[i] += d
+
+
+class AnomalyDetector:
+    def __init__(self, db: storage.Database, z_threshold: float = 3.0, min_samples: int = 8):
+        self.db = db
+        db.register(SCHEMA)
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self._stats = {"scored": 0, "observed": 0, "rebuilt": 0, "seeded": 0}
+
+    @staticmethod
+    def _load(conn, user_id: str, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], np.ndarray]:
+        rows = {}
+        for category, side in set(keys):
+            found = conn.execute(
+                "SELECT state FROM anomaly_baselines WHERE user_id = ? AND category = ? AND direction = ?",
+                (user_id, category, side),
+            ).fetchone()
+            rows[(category, side)] = (
+                np.frombuffer(found[0], dtype=np.float64).copy() if found else np.zeros(WIDTH, dtype=np.float64)
+            )
+        return rows
+
+    @staticmethod
+    def _quantile(row: np.ndarray) -> Optional[float]:
+        count = int(row[_COUNT])
+        if count == 0:
+            return None
+        if count < 5:
+            values = sorted(row[_Q][:count])
+            return float(values[min(count - 1, int(QUANTILE * count))])
+        return float(row[_Q][2])
+
+    def _score(self, row: np.ndarray, label: str, amount: float) -> Dict:
+        count = int(row[_COUNT])
+        result = {"flagged": False, "score": 0.0, "reason": None}
+        if count < self.min_samples:
+            return result
+        mean = float(row[_MEAN])
+        std = math.sqrt(row[_M2] / (count - 1)) if count > 1 else 0.0
+        p95 = self._quantile(row)
+        z = (amount - mean) / std if std > 0 else (math.inf if amount > mean else 0.0)
+        result["score"] = round(min(z, 1e6), 2)
+        if z >= self.z_threshold and amount > p95:
+            result["flagged"] = True
+            result["reason"] = (
+                f"{amount:.2f} is {min(z, 1e6):.1f} standard deviations above the usual "
+                f"{label} amount ({mean:.2f}) and above its 95th percentile ({p95:.2f})"
+            )
+        return result
+
+    def _observe(self, row: np.ndarray, amount: float):
+        count = int(row[_COUNT]) + 1
+        delta = amount - row[_MEAN]
+        row[_COUNT] = count
+        row[_MEAN] += delta / count
+        row[_M2] += delta * (amount - row[_MEAN])
+
+        q = row[_Q].tolist()
+        n = row[_N].tolist()
+        if count <= 5:
+            q[count - 1] = amount
+            if count == 5:
+                q.sort()
+                n = [1.0, 2.0, 3.0, 4.0, 5.0]
+        else:
+            _p2_update(q, n, count, amount)
+        row[_Q] = q
+        row[_N] = n
+
+    def score_many(self, user_id: str, items: Iterable[Item]) -> List[Dict]:
+        """
+        Score each (category, signed amount) against the user's baseline
+        for that category and direction, without changing it.
+        """
+        items = [(category, float(amount)) for category, amount in items]
+        with self.db.read() as conn:
+            rows = self._load(conn, user_id, ((category, direction(amount)) for category, amount in items))
+        self._stats["scored"] += len(items)
+        return [
+            self._score(rows[(category, direction(amount))], f"{category} {direction(amount)}", abs(amount))
+            for category, amount in items
+        ]
+
+    def score(self, user_id: str, category: str, amount: float) -> Dict:
+        return self.score_many(user_id, [(category, amount)])[0]
+
+    def observe(self, user_id: str, items: Iterable[Item]):
+        """
+        Fold (category, signed amount) pairs into the user's baselines.
+        """
+        items = [(category, float(amount)) for category, amount in items]
+        if not items:
+            return
+        with self.db.write() as conn:
+            rows = self._load(conn, user_id, ((category, direction(amount)) for category, amount in items))
+            for category, amount in items:
+                self._observe(rows[(category, direction(amount))], abs(amount))
+            self._save(conn, user_id, rows)
+            self.db.after_commit(lambda: self._count(observed=len(items)))
+
+    @staticmethod
+    def _save(conn, user_id: str, rows: Dict[Tuple[str, str], np.ndarray]):
+        conn.executemany(
+            "INSERT INTO anomaly_baselines (user_id, category, direction, state) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id, category, direction) DO UPDATE SET state = excluded.state",
+            [(user_id, category, side, row.tobytes()) for (category, side), row in rows.items()],
+        )
+
+    def rebuild(self, user_id: str, items: Iterable[Item]):
+        """
+        Replace the user's baselines with the ones learned from `items`, in
+        order (the user's ledger rows, oldest first).
+        """
+        rows: Dict[Tuple[str, str], np.ndarray] = {}
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM anomaly_baselines WHERE user_id = ?", (user_id,))
+            for category, amount in items:
+                row = rows.get((category, direction(amount)))
+                if row is None:
+                    row = rows[(category, direction(amount))] = np.zeros(WIDTH, dtype=np.float64)
+                self._observe(row, abs(float(amount)))
+            self._save(conn, user_id, rows)
+            self.db.after_commit(lambda: self._count(rebuilt=1))
+
+    def _count(self, **counts: int):
+        for key, value in counts.items():
+            self._stats[key] += value
+
+    def reset(self, user_id: str):
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM anomaly_baselines WHERE user_id = ?", (user_id,))
+
+    def seed(self, store, category_of: Callable[[str], str], categories: Set[str]):
+        """
+        Build the baselines of ledger users that have none yet (synced
+        before the baselines existed) or that are keyed on anything but
+        `categories`; `store` is a services.ledger.Ledger and
+        `category_of` maps a description to its category.
+        """
+        for user_id in store.users():
+            with self.db.read() as conn:
+                known = {
+                    category for (category,) in conn.execute(
+                        "SELECT DISTINCT category FROM anomaly_baselines WHERE user_id = ?", (user_id,)
+                    )
+                }
+            if not known or not known <= categories:
+                self.rebuild(user_id, ((category_of(row[3]), row[2]) for row in store.rows(user_id)))
+                self._stats["seeded"] += 1
+
+    def summary(self, user_id: str, category: str) -> Dict[str, Optional[Dict]]:
+        """
+        Debit and credit baselines of a category (None when empty).
+        """
+        with self.db.read() as conn:
+            rows = self._load(conn, user_id, [(category, "debit"), (category, "credit")])
+        result = {}
+        for (_, side), row in sorted(rows.items()):
+            count = int(row[_COUNT])
+            result[side] = {
+                "count": count,
+                "mean": round(float(row[_MEAN]), 2),
+                "std": round(math.sqrt(row[_M2] / (count - 1)), 2) if count > 1 else 0.0,
+                "p95": round(self._quantile(row), 2),
+            } if count else None
+        return result
+
+    def stats(self) -> Dict:
+        return dict(self._stats)
+
+
+detector = AnomalyDetector(
+    storage.db,
+    z_threshold=float(os.getenv("AI_ANOMALY_Z", 3.0)),
+    min_samples=int(os.getenv("AI_ANOMALY_MIN_SAMPLES", 8)),
+)
@@ -0,0 +1,278 @@
+"""
+Duplicate-transaction detection across imports.
+
+Every transaction recorded for a user is kept as an entry with a 64-bit
+fingerprint of (day, signed amount in cents, normalized description); a
+refund and the charge it reverses never collide. An imported row is an
+exact duplicate when the user has at least as many entries with its
+fingerprint as the row's occurrence among identical rows of the same
+import, so two real R$ 5,00 coffees on the same statement stay distinct
+while re-importing that statement flags both.
+
+Near-duplicates (the same transaction printed differently by two
+statements covering the same period) are looked up among the entries with
+the same amount on the row's day and the days around it
+(AI_DEDUP_FUZZY_DAYS), comparing character-trigram similarity of the
+descriptions without digits. The digits (document numbers, times) decide
+between look-alikes: rows whose digits differ are different transactions,
+and a match on another day needs the same digits - otherwise a recurring
+purchase of the same amount at the same merchant on consecutive days would
+look like a duplicate. A fuzzy match scores at most FUZZY_CAP, below an
+exact one. Each row costs a few index probes, never a scan of the user's
+history.
+
+Entries live in the shared SQLite store (services/storage.py), so every
+worker and restart sees the same history. Rows synced through /ingest are
+recorded with their ledger id and are removed or replaced when the backend
+deletes or updates them.
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from services import storage
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_DIGITS = re.compile(r"\d+")
+
+# Best score of a fuzzy match; 1.0 is kept for exact duplicates
+FUZZY_CAP = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dedup_entries (
+    user_id     TEXT NOT NULL,
+    fingerprint INTEGER NOT NULL,
+    day         INTEGER NOT NULL,
+    cents       INTEGER NOT NULL,
+    loose       TEXT NOT NULL,
+    digits      TEXT NOT NULL,
+    source_id   TEXT
+);
+CREATE INDEX IF NOT EXISTS dedup_by_fingerprint ON dedup_entries (user_id, fingerprint);
+CREATE INDEX IF NOT EXISTS dedup_by_amount ON dedup_entries (user_id, cents, day);
+CREATE INDEX IF NOT EXISTS dedup_by_source ON dedup_entries (user_id, source_id) WHERE source_id IS NOT NULL;
+"""
+
+
+def normalize_description(description: str) -> str:
+    """
+    Lowercase, strip accents and punctuation, collapse whitespace.
+    """
+    text = unicodedata.normalize("NFKD", description.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def parse_day(value: str) -> Optional[int]:
+    """
+    Day ordinal of an ISO (2025-01-31, optionally with time) or Brazilian
+    (31/01/2025) date; None when it cannot be parsed.
+    """
+    value = (value or "").strip()
+    try:
+        if "/" in value:
+            return datetime.strptime(value[:10], "%d/%m/%Y").toordinal()
+        return date.fromisoformat(value[:10]).toordinal()
+    except ValueError:
+        return None
+
+
+def to_cents(amount: float) -> int:
+    """
+    Signed amount in cents; expenses are negative.
+    """
+    return int(round(amount * 100))
+
+
+def _hash64(*parts) -> int:
+    # Signed, to fit an SQLite INTEGER
+    data = "\x1f".join(str(p) for p in parts).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big", signed=True)
+
+
+def _trigrams(text: str) -> Set[str]:
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Jaccard similarity of character trigrams.
+    """
+    ta, tb = _trigrams(a), _trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+Row = Tuple[str, float, str]  # (date, signed amount, description)
+SyncedRow = Tuple[str, str, float, str]  # (ledger id, date, signed amount, description)
+
+
+class _Entry(NamedTuple):
+    fingerprint: int
+    day: int
+    cents: int
+    loose: str
+    digits: str
+
+
+def _entry(row_date: str, amount: float, description: str) -> Optional[_Entry]:
+    day = parse_day(row_date)
+    if day is None:
+        return None
+    cents = to_cents(amount)
+    text = normalize_description(description)
+    return _Entry(
+        _hash64(day, cents, text),
+        day,
+        cents,
+        " ".join(_DIGITS.sub(" ", text).split()),
+        " ".join(_DIGITS.findall(text)),
+    )
+
+
+def no_match() -> Dict:
+    return {"status": None, "score": 0.0, "matched_date": None}
+
+
+class DedupIndex:
+    def __init__(self, db: storage.Database, fuzzy_days: int = 1, fuzzy_threshold: float = 0.6):
+        self.db = db
+        db.register(SCHEMA)
+        self.fuzzy_days = fuzzy_days
+        self.fuzzy_threshold = fuzzy_threshold
+        self._stats = {"checked": 0, "exact": 0, "fuzzy": 0, "synced": 0, "removed": 0}
+
+    @staticmethod
+    def _score(entry: _Entry, seen_day: int, seen_loose: str, seen_digits: str) -> float:
+        if entry.digits and seen_digits and entry.digits != seen_digits:
+            return 0.0  # another document number or time: another transaction
+        if seen_day != entry.day and not (entry.digits and entry.digits == seen_digits):
+            return 0.0  # across days only a shared reference ties two rows
+        return FUZZY_CAP * (1.0 if seen_loose == entry.loose else similarity(seen_loose, entry.loose))
+
+    def _fuzzy_match(self, conn, user_id: str, entry: _Entry) -> Optional[Tuple[float, int]]:
+        best = None
+        for seen_fingerprint, seen_day, seen_loose, seen_digits in conn.execute(
+            "SELECT fingerprint, day, loose, digits FROM dedup_entries "
+            "WHERE user_id = ? AND cents = ? AND day BETWEEN ? AND ?",
+            (user_id, entry.cents, entry.day - self.fuzzy_days, entry.day + self.fuzzy_days),
+        ):
+            if seen_fingerprint == entry.fingerprint:
+                continue  # identical entries are all taken by the row's earlier occurrences
+            score = self._score(entry, seen_day, seen_loose, seen_digits)
+            if score >= self.fuzzy_threshold and (best is None or score > best[0]):
+                best = (score, seen_day)
+        return best
+
+    def check(self, user_id: str, rows: Iterable[Row], record: bool = True) -> List[Dict]:
+        """
+        Flag each row as an exact or fuzzy duplicate of something already
+        recorded for the user (status None otherwise), then record the rows
+        that are not exact duplicates. Rows of the same call are only
+        compared through their occurrence, never fuzzily against each other.
+        """
+        entries = [_entry(*row) for row in rows]
+        occurrences: Counter = Counter()
+        flags = []
+        with (self.db.write() if record else self.db.read()) as conn:
+            counts: Dict[int, int] = {}
+            for entry in entries:
+                self._stats["checked"] += 1
+                if entry is None:
+                    flags.append(no_match())
+                    continue
+                occurrences[entry.fingerprint] += 1
+                if entry.fingerprint not in counts:
+                    counts[entry.fingerprint] = conn.execute(
+                        "SELECT COUNT(*) FROM dedup_entries WHERE user_id = ? AND fingerprint = ?",
+                        (user_id, entry.fingerprint),
+                    ).fetchone()[0]
+                if occurrences[entry.fingerprint] <= counts[entry.fingerprint]:
+                    self._stats["exact"] += 1
+                    flags.append({"status": "exact", "score": 1.0, "matched_date": date.fromordinal(entry.day).isoformat()})
+                    continue
+
+                match = self._fuzzy_match(conn, user_id, entry)
+                if match:
+                    self._stats["fuzzy"] += 1
+                    flags.append({
+                        "status": "fuzzy",
+                        "score": round(match[0], 3),
+                        "matched_date": date.fromordinal(match[1]).isoformat(),
+                    })
+                else:
+                    flags.append(no_match())
+
+            if record:
+                conn.executemany(
+                    "INSERT INTO dedup_entries (user_id, fingerprint, day, cents, loose, digits) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (user_id, *entry)
+                        for entry, flag in zip(entries, flags)
+                        if entry is not None and flag["status"] != "exact"
+                    ],
+                )
+        return flags
+
+    def sync(self, user_id: str, upserts: Iterable[SyncedRow], removed: Iterable[str] = ()):
+        """
+        Mirror a ledger batch: entries of updated and deleted ledger rows are
+        dropped, and every upserted row is recorded under its ledger id,
+        taking over an identical entry left by an earlier import if there is
+        one.
+        """
+        upserts = list(upserts)
+        stale = list(dict.fromkeys([row[0] for row in upserts] + list(removed)))
+        removed_count = synced = 0
+        with self.db.write() as conn:
+            for start in range(0, len(stale), 500):
+                chunk = stale[start:start + 500]
+                removed_count += conn.execute(
+                    f"DELETE FROM dedup_entries WHERE user_id = ? AND source_id IN ({','.join('?' * len(chunk))})",
+                    (user_id, *chunk),
+                ).rowcount
+            for source_id, row_date, amount, description in upserts:
+                entry = _entry(row_date, amount, description)
+                if entry is None:
+                    continue
+                claimed = conn.execute(
+                    "UPDATE dedup_entries SET source_id = ? WHERE rowid = ("
+                    "SELECT rowid FROM dedup_entries WHERE user_id = ? AND fingerprint = ? AND source_id IS NULL LIMIT 1)",
+                    (source_id, user_id, entry.fingerprint),
+                ).rowcount
+                if not claimed:
+                    conn.execute(
+                        "INSERT INTO dedup_entries (user_id, fingerprint, day, cents, loose, digits, source_id) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, *entry, source_id),
+                    )
+                synced += 1
+            self.db.after_commit(lambda: self._count(removed=removed_count, synced=synced))
+
+    def _count(self, **counts: int):
+        for key, value in counts.items():
+            self._stats[key] += value
+
+    def forget_synced(self, user_id: str):
+        """
+        Drop the entries of a user's synced rows, e.g. before a full resync.
+        """
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM dedup_entries WHERE user_id = ? AND source_id IS NOT NULL", (user_id,))
+
+    def stats(self) -> Dict:
+        return dict(self._stats)
+
+
+index = DedupIndex(
+    storage.db,
+    fuzzy_days=int(os.getenv("AI_DEDUP_FUZZY_DAYS", 1)),
+    fuzzy_threshold=float(os.getenv("AI_DEDUP_FUZZY_THRESHOLD", 0.6)),
+)
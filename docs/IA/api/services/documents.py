@@ -0,0 +1,128 @@
+"""
+Words and page images from uploaded statements.
+
+PDFs are read from their text layer with PyMuPDF (real word boxes, no OCR).
+Images, and PDF pages without a text layer (scans), are cleaned up with
+OpenCV (services/preprocess.py) and read by the worker's persistent
+Tesseract engine (services/ocr_engine.py). Boxes are normalized to the
+0-1000 scale used by LayoutLMv3 and by services/statement.py.
+"""
+
+import io
+from typing import List, Optional
+
+from services import preprocess
+from services.extractor import Page
+from services.ocr_engine import engine
+
+try:
+    import pymupdf
+except ImportError:  # pragma: no cover - optional at import time
+    pymupdf = None
+
+# Same resolution the training set was rendered at (src/extrato_dataset.py)
+RENDER_DPI = 72
+
+
+class UnreadableDocument(ValueError):
+    """
+    The upload is not a PDF or image we can open (wrong type, corrupt).
+    """
+
+
+def normalize_box(x0: float, y0: float, x1: float, y1: float, width: float, height: float) -> List[int]:
+    return [
+        max(0, min(1000, int(1000 * x0 / width))),
+        max(0, min(1000, int(1000 * y0 / height))),
+        max(0, min(1000, int(1000 * x1 / width))),
+        max(0, min(1000, int(1000 * y1 / height))),
+    ]
+
+
+def ocr_page(image, dpi: Optional[float] = None) -> Page:
+    """
+    OCR one page image. The page image returned is the deskewed one, so it
+    lines up with the word boxes.
+    """
+    from PIL import Image
+
+    prepared = preprocess.prepare(image, dpi)
+    height, width = prepared.binary.shape
+    words = [
+        (text, normalize_box(x0, y0, x1, y1, width, height))
+        for text, (x0, y0, x1, y1), _ in engine.recognize(prepared.binary, prepared.regions)
+    ]
+    return Page(words, Image.fromarray(prepared.gray).convert("RGB"))
+
+
+def page_count(file_content: bytes, content_type: str) -> int:
+    """
+    Number of pages in an upload (1 for images and unreadable files). Only
+    the PDF's page tree is read, not its content.
+    """
+    if content_type != "application/pdf":
+        return 1
+    try:
+        with pymupdf.open(stream=file_content, filetype="pdf") as doc:
+            return max(1, doc.page_count)
+    except (pymupdf.FileDataError, RuntimeError, ValueError):
+        return 1
+
+
+def pdf_pages(file_content: bytes, render_dpi: Optional[int] = None) -> List[Page]:
+    from PIL import Image
+
+    try:
+        doc = pymupdf.open(stream=file_content, filetype="pdf")
+    except (pymupdf.FileDataError, RuntimeError, ValueError) as e:
+        raise UnreadableDocument("The file is not a readable PDF") from e
+
+    pages = []
+    with doc:
+        for page in doc:
+            width, height = page.rect.width, page.rect.height
+            words = [
+                (w[4], normalize_box(w[0], w[1], w[2], w[3], width, height))
+                for w in page.get_text("words", sort=True)
+                if w[4].strip()
+            ]
+            image = None
+            if not words and engine.available():
+                # Scanned page: no text layer to read
+                pix = page.get_pixmap(dpi=preprocess.OCR_DPI, colorspace=pymupdf.csGRAY, alpha=False)
+                scanned = ocr_page(Image.frombytes("L", (pix.width, pix.height), pix.samples), preprocess.OCR_DPI)
+                words = scanned.words
+                if render_dpi:
+                    image = scanned.image.resize((round(width * render_dpi / 72), round(height * render_dpi / 72)))
+            elif render_dpi:
+                pix = page.get_pixmap(dpi=render_dpi, colorspace=pymupdf.csRGB, alpha=False)
+                image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            pages.append(Page(words, image))
+    return pages
+
+
+def image_pages(file_content: bytes) -> List[Page]:
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(io.BytesIO(file_content))
+        image.load()
+    except (OSError, SyntaxError, ValueError) as e:
+        raise UnreadableDocument("The file is not a readable image") from e
+    dpi = preprocess.source_dpi(image)
+    # Phone photos are often stored sideways with an EXIF orientation tag
+    return [ocr_page(ImageOps.exif_transpose(image), dpi)]
+
+
+def load_pages(file_content: bytes, content_type: str, render_dpi: Optional[int] = None) -> List[Page]:
+    """
+    Pages of an upload; page images are only rendered for PDFs when
+    render_dpi is given (the extractor needs them, the rule parser does not).
+    """
+    if content_type == "application/pdf":
+        if pymupdf is None:
+            raise RuntimeError("PyMuPDF is required to read PDF statements")
+        return pdf_pages(file_content, render_dpi)
+    if not engine.available():
+        raise RuntimeError("tesserocr or pytesseract is required to read statement images")
+    return image_pages(file_content)
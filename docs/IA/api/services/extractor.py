@@ -0,0 +1,201 @@
+"""
+Batched CPU inference for the LayoutLMv3 statement extractor.
+
+Loads the int8 ONNX artifact written by src/export_extrato_onnx.py and
+labels every word of a page with one of the BIO tags the model was trained
+on (data, descricao, valor, ...). Only onnxruntime, tokenizers, numpy and
+Pillow are needed at serving time: tokenization and image preprocessing are
+reimplemented here instead of pulling transformers into the API image.
+
+Pages are split into windows of at most `max_length` tokens, windows are
+sorted by length and packed into batches of up to `batch_size`, and each
+batch is padded only to its own longest window. Intra-op threads are capped
+per worker (AI_EXTRACTOR_THREADS) so N forked workers do not oversubscribe
+the CPU.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+except ImportError:  # pragma: no cover - optional at import time
+    ort = None
+    Tokenizer = None
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "models", "layoutlmv3-onnx")
+
+# (text, [x0, y0, x1, y1] normalized to 0-1000)
+Word = Tuple[str, Sequence[int]]
+
+
+class Page:
+    __slots__ = ("words", "image")
+
+    def __init__(self, words: List[Word], image=None):
+        self.words = words
+        self.image = image
+
+
+class LayoutExtractor:
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = "model.int8.onnx",
+        threads: int = 1,
+        batch_size: int = 8,
+    ):
+        with open(os.path.join(model_dir, "extractor.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.labels: List[str] = self.config["labels"]
+        self.max_length: int = self.config["max_length"]
+        self.pad_token_id: int = self.config["pad_token_id"]
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.no_truncation()
+        self.cls_id = self.tokenizer.token_to_id("<s>")
+        self.sep_id = self.tokenizer.token_to_id("</s>")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        height, width = self.config["image_size"]
+        self.image_size = (width, height)
+        self.image_mean = np.asarray(self.config["image_mean"], dtype=np.float32).reshape(3, 1, 1)
+        self.image_std = np.asarray(self.config["image_std"], dtype=np.float32).reshape(3, 1, 1)
+        self.blank_image = np.zeros((3, height, width), dtype=np.float32)
+
+    # ------------------------------------------------------------------
+    # Preprocessing
+    # ------------------------------------------------------------------
+
+    def _pixel_values(self, image) -> np.ndarray:
+        if image is None:
+            return self.blank_image
+        from PIL import Image
+
+        image = image.convert("RGB").resize(self.image_size, Image.BILINEAR)
+        pixels = np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return (pixels - self.image_mean) / self.image_std
+
+    def _windows(self, page_index: int, page: Page):
+        """
+        Tokenize a page and cut it into windows of at most max_length tokens
+        (specials included). Yields (page index, token ids, boxes, word ids).
+        """
+        words = [w[0] for w in page.words]
+        encoding = self.tokenizer.encode(words, is_pretokenized=True, add_special_tokens=False)
+        ids = encoding.ids
+        word_ids = encoding.word_ids
+        step = self.max_length - 2
+        for start in range(0, max(1, len(ids)), step):
+            chunk_ids = ids[start:start + step]
+            chunk_words = word_ids[start:start + step]
+            boxes = [[0, 0, 0, 0]] + [list(page.words[w][1]) for w in chunk_words] + [[0, 0, 0, 0]]
+            yield (
+                page_index,
+                [self.cls_id] + chunk_ids + [self.sep_id],
+                boxes,
+                [None] + list(chunk_words) + [None],
+            )
+
+    # ------------------------------------------------------------------
+    # Inference
+    # ------------------------------------------------------------------
+
+    def _run_batch(self, batch, pixel_values: Dict[int, np.ndarray]) -> List[np.ndarray]:
+        longest = max(len(ids) for _, ids, _, _ in batch)
+        input_ids = np.full((len(batch), longest), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch), longest), dtype=np.int64)
+        bbox = np.zeros((len(batch), longest, 4), dtype=np.int64)
+        for i, (_, ids, boxes, _) in enumerate(batch):
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+            bbox[i, :len(ids)] = boxes
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "bbox": bbox}
+        if "pixel_values" in self.input_names:
+            feeds["pixel_values"] = np.stack([pixel_values[page] for page, _, _, _ in batch])
+        logits = self.session.run(["logits"], feeds)[0]
+        return [logits[i, :len(ids)] for i, (_, ids, _, _) in enumerate(batch)]
+
+    def predict(self, pages: List[Page]) -> List[List[Tuple[str, float]]]:
+        """
+        Return, for every page, one (label, confidence) pair per word.
+        Windows from all pages are packed together, so a multi-page
+        statement takes ceil(windows / batch_size) forward passes.
+        """
+        windows = [w for index, page in enumerate(pages) for w in self._windows(index, page)]
+        pixel_values = {index: self._pixel_values(page.image) for index, page in enumerate(pages)}
+        results: List[List[Tuple[str, float]]] = [[("O", 0.0)] * len(page.words) for page in pages]
+
+        windows.sort(key=lambda w: len(w[1]))
+        for start in range(0, len(windows), self.batch_size):
+            batch = windows[start:start + self.batch_size]
+            for (page, _, _, word_ids), logits in zip(batch, self._run_batch(batch, pixel_values)):
+                probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+                probs /= probs.sum(axis=-1, keepdims=True)
+                best = probs.argmax(axis=-1)
+                previous = None
+                for position, word in enumerate(word_ids):
+                    # The label of a word is the label of its first sub-token
+                    if word is None or word == previous:
+                        previous = word
+                        continue
+                    previous = word
+                    label = best[position]
+                    results[page][word] = (self.labels[label], float(probs[position, label]))
+        return results
+
+
+_extractor: Optional[LayoutExtractor] = None
+_extractor_pid = 0
+_lock = threading.Lock()
+
+
+def get_extractor() -> Optional[LayoutExtractor]:
+    """
+    Per-process extractor, loaded on first use or by the runner's preload.
+    Returns None when onnxruntime or the exported model is not available.
+
+    A single-threaded session holds no thread pool, so one created in the
+    master is safe to use after fork and its weights stay shared. With
+    more threads the pool does not survive fork and each worker builds its
+    own session.
+    """
+    global _extractor, _extractor_pid
+    threads = int(os.getenv("AI_EXTRACTOR_THREADS", 1))
+    if _extractor is not None and (threads == 1 or _extractor_pid == os.getpid()):
+        return _extractor
+
+    model_dir = os.getenv("AI_EXTRACTOR_PATH", DEFAULT_MODEL_DIR)
+    if ort is None or not os.path.exists(os.path.join(model_dir, "extractor.json")):
+        return None
+    with _lock:
+        if _extractor is None or (threads > 1 and _extractor_pid != os.getpid()):
+            _extractor = LayoutExtractor(
+                model_dir,
+                model_file=os.getenv("AI_EXTRACTOR_MODEL", "model.int8.onnx"),
+                threads=threads,
+                batch_size=int(os.getenv("AI_EXTRACTOR_BATCH_SIZE", 8)),
+            )
+            _extractor_pid = os.getpid()
+            logging.info(f"LayoutLMv3 extractor loaded from {model_dir}")
+    return _extractor
@@ -0,0 +1,253 @@
+"""
+Local copy of each user's transactions, kept in sync with the main backend
+through deltas.
+
+The backend pushes batches of upserts and deletes to /ingest, each batch
+stamped with the user's watermark before it (base_watermark) and after it
+(watermark) - typically the id of the last change-log entry it contains.
+A batch is applied only on top of the watermark it was built from, in one
+SQLite transaction together with the new watermark, so after a crash or
+restart the store is always at some batch boundary and the backend
+resumes by asking for the current watermark and sending what came after
+it. Re-sending the last batch that was applied (the response was lost) is
+acknowledged without applying it twice; it is recognized by its base,
+target and a digest of its content, so any other batch that does not
+start at the store's watermark is refused.
+
+The ledger lives in the shared SQLite store (services/storage.py), so all
+workers of a host see the same copy. Rows are compact: one WITHOUT ROWID
+table keyed by (user_id, id), amounts in cents.
+
+The analytics routes read through history(), which coalesces concurrent
+loads for the same user (services/singleflight.py).
+"""
+
+import hashlib
+import json
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from services import singleflight, storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    user_id     TEXT NOT NULL,
+    id          TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    cents       INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    category    TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS transactions_by_date ON transactions (user_id, date);
+CREATE TABLE IF NOT EXISTS watermarks (
+    user_id    TEXT PRIMARY KEY,
+    watermark  INTEGER NOT NULL,
+    rows       INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS last_batches (
+    user_id         TEXT PRIMARY KEY,
+    base_watermark  INTEGER NOT NULL,
+    watermark       INTEGER NOT NULL,
+    digest          BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+# (id, date, amount, description, category); expenses are negative
+Row = Tuple[str, str, float, str, str]
+
+
+class WatermarkMismatch(Exception):
+    def __init__(self, user_id: str, expected: int, current: int):
+        super().__init__(f"{user_id}: batch built on watermark {expected}, store is at {current}")
+        self.expected = expected
+        self.current = current
+
+
+def batch_digest(upserts: List[Row], deletes: List[str]) -> bytes:
+    payload = json.dumps(
+        [[[r[0], r[1], int(round(r[2] * 100)), r[3], r[4]] for r in upserts], deletes],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+class Ledger:
+    def __init__(self, db: storage.Database):
+        self.db = db
+        db.register(SCHEMA)
+        self._stats = {"batches": 0, "replayed": 0, "rejected": 0, "upserts": 0, "deletes": 0}
+
+    def watermark(self, user_id: str) -> Dict:
+        with self.db.read() as conn:
+            found = conn.execute(
+                "SELECT watermark, rows FROM watermarks WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        watermark, rows = found or (0, 0)
+        return {"user_id": user_id, "watermark": watermark, "rows": rows}
+
+    def apply(
+        self,
+        user_id: str,
+        base_watermark: int,
+        watermark: int,
+        upserts: Iterable[Row],
+        deletes: Iterable[str],
+    ) -> Dict:
+        """
+        Apply one delta batch atomically. Returns the new watermark, the row
+        count, whether the batch was a replay, and the ids that were
+        inserted, updated and deleted (so callers can keep the derived
+        indexes in step).
+        Raises WatermarkMismatch when the batch does not start where the
+        store is.
+        """
+        upserts = list(upserts)
+        deletes = list(deletes)
+        with self.db.write() as conn:
+            found = conn.execute(
+                "SELECT watermark, rows FROM watermarks WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            current, rows = found or (0, 0)
+            digest = batch_digest(upserts, deletes)
+            if current != base_watermark:
+                last = conn.execute(
+                    "SELECT base_watermark, watermark, digest FROM last_batches WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if last is not None and tuple(last) == (base_watermark, watermark, digest) and current == watermark:
+                    self.db.after_commit(lambda: self._count(replayed=1))
+                    return {"watermark": current, "rows": rows, "replayed": True, "inserted": [], "updated": [], "deleted": []}
+                # Counted right away: the rollback does not undo a refusal
+                self._stats["rejected"] += 1
+                raise WatermarkMismatch(user_id, base_watermark, current)
+
+            ids = [row[0] for row in upserts]
+            existing = set(self._existing(conn, user_id, ids))
+            conn.executemany(
+                "INSERT INTO transactions (user_id, id, date, cents, description, category) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, id) DO UPDATE SET date = excluded.date, cents = excluded.cents, "
+                "description = excluded.description, category = excluded.category",
+                [
+                    (user_id, row_id, row_date, int(round(amount * 100)), description, category)
+                    for row_id, row_date, amount, description, category in upserts
+                ],
+            )
+            deleted = list(self._existing(conn, user_id, deletes))
+            for start in range(0, len(deleted), 500):
+                chunk = deleted[start:start + 500]
+                conn.execute(
+                    f"DELETE FROM transactions WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                    (user_id, *chunk),
+                )
+            inserted = [row_id for row_id in dict.fromkeys(ids) if row_id not in existing]
+            rows = rows + len(inserted) - len(deleted)
+            conn.execute(
+                "INSERT INTO watermarks (user_id, watermark, rows) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET watermark = excluded.watermark, rows = excluded.rows",
+                (user_id, watermark, rows),
+            )
+            conn.execute(
+                "INSERT INTO last_batches (user_id, base_watermark, watermark, digest) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET base_watermark = excluded.base_watermark, "
+                "watermark = excluded.watermark, digest = excluded.digest",
+                (user_id, base_watermark, watermark, digest),
+            )
+            # Counted only once the batch is committed, which may be in a
+            # caller's outer write()
+            self.db.after_commit(lambda: self._count(batches=1, upserts=len(upserts), deletes=len(deleted)))
+        return {
+            "watermark": watermark,
+            "rows": rows,
+            "replayed": False,
+            "inserted": inserted,
+            "updated": sorted(existing),
+            "deleted": deleted,
+        }
+
+    def _count(self, **counts: int):
+        for key, value in counts.items():
+            self._stats[key] += value
+
+    @staticmethod
+    def _existing(conn, user_id: str, ids: List[str]) -> Iterator[str]:
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for (row_id,) in conn.execute(
+                f"SELECT id FROM transactions WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                (user_id, *chunk),
+            ):
+                yield row_id
+
+    def reset(self, user_id: str):
+        """
+        Drop a user's copy, e.g. before a full resync.
+        """
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM watermarks WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM last_batches WHERE user_id = ?", (user_id,))
+
+    def rows(self, user_id: str) -> Iterator[Row]:
+        """
+        All of a user's rows, oldest first.
+        """
+        with self.db.read() as conn:
+            found = conn.execute(
+                "SELECT id, date, cents, description, category FROM transactions "
+                "WHERE user_id = ? ORDER BY date, id",
+                (user_id,),
+            ).fetchall()
+        for row_id, row_date, cents, description, category in found:
+            yield row_id, row_date, cents / 100, description, category
+
+    def users(self) -> List[str]:
+        with self.db.read() as conn:
+            return [user_id for (user_id,) in conn.execute("SELECT user_id FROM watermarks")]
+
+    def monthly_by_category(self, user_id: str, months: int = 12) -> Dict[str, Dict[str, float]]:
+        """
+        {category: {"YYYY-MM": spent}} over the user's last `months` months
+        with data, expenses only, as positive amounts.
+        """
+        with self.db.read() as conn:
+            found = conn.execute(
+                """
+                WITH recent AS (
+                    SELECT DISTINCT substr(date, 1, 7) AS month FROM transactions
+                    WHERE user_id = ? ORDER BY month DESC LIMIT ?
+                )
+                SELECT category, substr(date, 1, 7) AS month, -SUM(cents)
+                FROM transactions
+                WHERE user_id = ? AND cents < 0 AND substr(date, 1, 7) IN (SELECT month FROM recent)
+                GROUP BY category, month ORDER BY month
+                """,
+                (user_id, months, user_id),
+            ).fetchall()
+        history: Dict[str, Dict[str, float]] = {}
+        for category, month, cents in found:
+            history.setdefault(category, {})[month] = cents / 100
+        return history
+
+    def stats(self) -> Dict:
+        with self.db.read() as conn:
+            users, rows = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM watermarks"
+            ).fetchone()
+        return {**self._stats, "users": users, "rows": rows}
+
+
+store = Ledger(storage.db)
+
+
+async def history(user_id: str, months: int = 6) -> Dict[str, Dict[str, float]]:
+    """
+    monthly_by_category() shared by every route computing for the user at
+    the same time. Callers must not modify the returned dict.
+    """
+    return await singleflight.group.do(
+        ("history", user_id, months),
+        lambda: run_in_threadpool(store.monthly_by_category, user_id, months),
+    )
@@ -0,0 +1,273 @@
+"""
+Merchant canonicalization.
+
+Statement descriptions embed dates, times, document numbers and channel
+prefixes ("Pix - Enviado 06/01 11:48 Aroldo Pinheiro Pereira",
+"TRANSFERENCIA PIX DES: Aroldo Pinheiro Perei 01/02"). canonical_name()
+strips the volatile parts; the remaining name is then mapped to a merchant
+id through a MinHash LSH index over character trigrams, so spelling and
+truncation variants of the same counterparty share one id.
+
+Lookups hash the name into NUM_PERM minima (numpy, vectorized), probe BANDS
+hash tables and verify only the handful of candidates that collide, so the
+cost does not grow with the number of known merchants. Exact repeats of a
+canonical name are answered from a dict before any hashing.
+
+Merchants and the names mapped to them are kept in the shared SQLite
+store (services/storage.py), so an id is the same in every worker and
+after a restart. A merchant's id is a hash of the canonical name that
+created it. Names are registered only from rows the backend vouches for
+(synced through /ingest, or imported with the service token), a whole
+batch in one write transaction, after catching up with merchants other
+workers added, so two workers never create two ids for the same name.
+Anonymous lookups only read: an unknown merchant gets the id it would be
+founded with, but nothing is stored. Each process keeps the LSH tables and
+a name cache in memory, loaded at preload and topped up on a miss.
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from services import storage
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+
+# Channel / transaction-type prefixes that say how, not with whom
+CHANNEL_PREFIXES = (
+    "pix enviado", "pix recebido", "pix qr code dinamico", "pix qr code estatico",
+    "transferencia pix", "transferencia enviada", "transferencia recebida",
+    "transferido para", "compra com cartao", "compra elo debito vista",
+    "compra elo debito", "compra cartao", "compra debito", "compra credito",
+    "pagamento de boleto", "pagamento", "pgto", "ted", "doc", "debito automatico",
+    "saque dinheiro banco 24h", "saque",
+)
+# Counterparty markers printed before the name (REM: sender, DES: recipient)
+COUNTERPARTY_MARKERS = re.compile(r"\b(rem|des|favorecido|estab|loja)\b\s*")
+VOLATILE = re.compile(
+    r"\b\d{1,2}/\d{1,2}(/\d{2,4})?\b"  # 06/01, 06/01/2025
+    r"|\b\d{1,2}[:h]\d{2}\b"           # 11:48, 17h08
+    r"|\*+\d+"                         # ****1234
+    r"|\b\d{5,}\b"                     # document / authorization numbers
+)
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS merchants (
+    seq         INTEGER PRIMARY KEY,
+    merchant_id TEXT NOT NULL UNIQUE,
+    name        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS merchant_names (
+    name        TEXT PRIMARY KEY,
+    merchant_id TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def canonical_name(description: str) -> str:
+    """
+    "Pix - Enviado 06/01 11:48 Aroldo Pinheiro Pereira" -> "aroldo pinheiro pereira".
+    A description that is only a channel ("Compra com Cartão") keeps it.
+    """
+    text = _strip_accents(description)
+    text = VOLATILE.sub(" ", text)
+    text = " ".join(_NON_WORD.sub(" ", text).split())
+    channel = text
+    for prefix in CHANNEL_PREFIXES:
+        if text.startswith(prefix + " ") or text == prefix:
+            text = text[len(prefix):].strip()
+            break
+    text = " ".join(COUNTERPARTY_MARKERS.sub(" ", text).split())
+    return text or channel
+
+
+def _shingles(name: str) -> Set[str]:
+    padded = f" {name} "
+    return {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+
+
+def _shingle_hashes(shingles: Set[str]) -> np.ndarray:
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") & _PRIME for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+_rng = np.random.default_rng(20250101)
+_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+
+def minhash(shingles: Set[str]) -> np.ndarray:
+    """
+    NUM_PERM minima of (a * h + b) mod 2^64 over the shingle hashes. The
+    wrapping multiply is a universal hash family, good enough for LSH.
+    """
+    hashes = _shingle_hashes(shingles)
+    with np.errstate(over="ignore"):
+        values = _A[:, None] * hashes[None, :] + _B[:, None]
+    return values.min(axis=1)
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def merchant_id_for(name: str) -> str:
+    """
+    Id of the merchant founded by a canonical name.
+    """
+    return "m_" + hashlib.blake2b(name.encode(), digest_size=6).hexdigest()
+
+
+class MerchantIndex:
+    def __init__(self, db: storage.Database, threshold: float = 0.5, max_merchants: int = 200_000):
+        self.db = db
+        db.register(SCHEMA)
+        self.threshold = threshold
+        self.max_merchants = max_merchants
+        self._by_name: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}          # merchant id -> canonical name
+        self._shingles: Dict[str, Set[str]] = {}  # merchant id -> shingles
+        self._bands: List[Dict[bytes, List[str]]] = [{} for _ in range(BANDS)]
+        self._loaded = 0  # last merchants.seq in the LSH tables
+
+    def _candidates(self, signature: np.ndarray) -> Set[str]:
+        found: Set[str] = set()
+        for band, table in enumerate(self._bands):
+            found.update(table.get(signature[band * ROWS:(band + 1) * ROWS].tobytes(), ()))
+        return found
+
+    def _add(self, merchant_id: str, name: str, shingles: Set[str], signature: np.ndarray):
+        self._names[merchant_id] = name
+        self._shingles[merchant_id] = shingles
+        for band, table in enumerate(self._bands):
+            table.setdefault(signature[band * ROWS:(band + 1) * ROWS].tobytes(), []).append(merchant_id)
+
+    def _catch_up(self, conn):
+        for seq, merchant_id, name in conn.execute(
+            "SELECT seq, merchant_id, name FROM merchants WHERE seq > ? ORDER BY seq", (self._loaded,)
+        ):
+            shingles = _shingles(name)
+            self._add(merchant_id, name, shingles, minhash(shingles))
+            self._loaded = seq
+
+    def _remember(self, name: str, merchant_id: str) -> Tuple[str, str]:
+        if len(self._by_name) < self.max_merchants * 4:
+            self._by_name[name] = merchant_id
+        return merchant_id, self._names[merchant_id]
+
+    def refresh(self):
+        """
+        Load the merchants added since the last call (all of them the first
+        time); called at preload so the workers inherit the tables.
+        """
+        with self.db.read() as conn:
+            self._catch_up(conn)
+
+    def lookup(self, description: str, register: bool = False) -> Tuple[str, str]:
+        """
+        (merchant id, canonical merchant name) for a description; see
+        lookup_many().
+        """
+        return self.lookup_many([description], register)[0]
+
+    def lookup_many(self, descriptions: Iterable[str], register: bool = False) -> List[Tuple[str, str]]:
+        """
+        (merchant id, canonical merchant name) for each description. Known
+        names and variants of known merchants get the merchant's id; an
+        unknown merchant gets the id it would be founded with. Only with
+        `register` (synced rows, trusted imports) are new names and
+        merchants stored, all of them in one write transaction; otherwise
+        the store is only read.
+        """
+        names = [canonical_name(description) for description in descriptions]
+        resolved: Dict[str, Tuple[str, str]] = {}
+        missing = []
+        for name in dict.fromkeys(names):
+            merchant_id = self._by_name.get(name)
+            if merchant_id is not None:
+                resolved[name] = merchant_id, self._names[merchant_id]
+            else:
+                missing.append(name)
+        if missing:
+            if register:
+                with self.db.write() as conn:
+                    self._resolve(conn, missing, resolved, register)
+            else:
+                with self.db.read() as conn:
+                    self._resolve(conn, missing, resolved, register)
+        return [resolved[name] for name in names]
+
+    def _resolve(self, conn, names: List[str], resolved: Dict[str, Tuple[str, str]], register: bool):
+        # Another worker may have registered the names or variants of them
+        self._catch_up(conn)
+        stored: Dict[str, str] = {}
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            stored.update(conn.execute(
+                f"SELECT name, merchant_id FROM merchant_names WHERE name IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        if any(merchant_id not in self._names for merchant_id in stored.values()):
+            self._catch_up(conn)  # registered between the two reads (read-only lookups)
+
+        new_names = []
+        for name in names:
+            if name in stored:
+                resolved[name] = self._remember(name, stored[name])
+                continue
+            shingles = _shingles(name)
+            signature = minhash(shingles)
+            best: Optional[Tuple[float, str]] = None
+            for candidate in self._candidates(signature):
+                score = jaccard(shingles, self._shingles[candidate])
+                if score >= self.threshold and (best is None or score > best[0]):
+                    best = (score, candidate)
+            if best is not None:
+                merchant_id = best[1]
+            elif not register or len(self._names) >= self.max_merchants:
+                # Not stored: a stable id, just not shared with variants
+                resolved[name] = merchant_id_for(name), name
+                continue
+            else:
+                merchant_id = merchant_id_for(name)
+                cursor = conn.execute(
+                    "INSERT INTO merchants (merchant_id, name) VALUES (?, ?) ON CONFLICT (merchant_id) DO NOTHING",
+                    (merchant_id, name),
+                )
+                if cursor.rowcount:
+                    self._add(merchant_id, name, shingles, signature)
+                    self._loaded = cursor.lastrowid
+            if register:
+                new_names.append((name, merchant_id))
+                resolved[name] = self._remember(name, merchant_id)
+            else:
+                resolved[name] = merchant_id, self._names[merchant_id]
+        conn.executemany(
+            "INSERT INTO merchant_names (name, merchant_id) VALUES (?, ?) ON CONFLICT (name) DO NOTHING",
+            new_names,
+        )
+
+    def stats(self) -> Dict:
+        return {"merchants": len(self._names), "names": len(self._by_name)}
+
+
+index = MerchantIndex(
+    storage.db,
+    threshold=float(os.getenv("AI_MERCHANT_THRESHOLD", 0.5)),
+    max_merchants=int(os.getenv("AI_MERCHANT_MAX", 200_000)),
+)
@@ -0,0 +1,208 @@
+"""
+Content negotiation for the row-heavy endpoints.
+
+`/classify/batch` and `/ocr/extract` can return tens of thousands of rows.
+Instead of always going through Pydantic + the stdlib JSON encoder, those
+routes hand a plain dict to `render` and the client picks the wire format
+with the Accept header:
+
+    application/json                          (default, encoded with orjson)
+    application/x-ndjson                      one row per line
+    application/msgpack                       same document as JSON, binary
+    application/vnd.apache.arrow.stream       Arrow IPC stream, one column per field
+    application/vnd.willfinance.columns+json  column-wise JSON
+
+msgpack and pyarrow are optional: when they are not installed their media
+types are simply not offered.
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+COLUMNS_JSON = "application/vnd.willfinance.columns+json"
+
+# Aliases clients commonly send for the same formats
+ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/jsonlines": NDJSON,
+    "application/vnd.apache.arrow.file": ARROW,
+}
+
+META_HEADER = "X-Response-Meta"
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+def dumps_json(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def flatten_row(row: Dict[str, Any], prefix: str = "", sep: str = ".") -> Dict[str, Any]:
+    """
+    Flatten nested dicts into dotted keys so every field becomes one column.
+    """
+    flat = {}
+    for key, value in row.items():
+        name = f"{prefix}{sep}{key}" if prefix else key
+        if isinstance(value, BaseModel):
+            value = value.model_dump()
+        if isinstance(value, dict):
+            flat.update(flatten_row(value, name, sep))
+        else:
+            flat[name] = value
+    return flat
+
+
+def to_columns(rows: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    flat_rows = [flatten_row(row) for row in rows]
+    names: Dict[str, None] = {}
+    for row in flat_rows:
+        for name in row:
+            names.setdefault(name)
+    return {name: [row.get(name) for row in flat_rows] for name in names}
+
+
+def encode_json(body: Dict[str, Any], rows_key: str) -> bytes:
+    return dumps_json(body)
+
+
+def encode_ndjson(body: Dict[str, Any], rows_key: str) -> bytes:
+    lines = [dumps_json(row) for row in body[rows_key]]
+    lines.append(b"")
+    return b"\n".join(lines)
+
+
+def encode_msgpack(body: Dict[str, Any], rows_key: str) -> bytes:
+    return msgpack.packb(body, default=_default, use_bin_type=True)
+
+
+def encode_columns_json(body: Dict[str, Any], rows_key: str) -> bytes:
+    return dumps_json({"meta": _meta(body, rows_key), "columns": to_columns(body[rows_key])})
+
+
+def encode_arrow(body: Dict[str, Any], rows_key: str) -> bytes:
+    table = pa.table(to_columns(body[rows_key]))
+    table = table.replace_schema_metadata({"meta": dumps_json(_meta(body, rows_key))})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _meta(body: Dict[str, Any], rows_key: str) -> Dict[str, Any]:
+    return {key: value for key, value in body.items() if key != rows_key}
+
+
+ENCODERS: Dict[str, Callable[[Dict[str, Any], str], bytes]] = {
+    JSON: encode_json,
+    NDJSON: encode_ndjson,
+    COLUMNS_JSON: encode_columns_json,
+}
+if msgpack is not None:
+    ENCODERS[MSGPACK] = encode_msgpack
+if pa is not None:
+    ENCODERS[ARROW] = encode_arrow
+
+
+def parse_accept(header: Optional[str]) -> List[Tuple[str, float]]:
+    """
+    Parse an Accept header into (media type, q) pairs, best first.
+    """
+    if not header:
+        return [("*/*", 1.0)]
+    ranges = []
+    for position, part in enumerate(header.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media = fields[0].lower()
+        if not media:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        ranges.append((ALIASES.get(media, media), q, position))
+    ranges.sort(key=lambda item: (-item[1], item[2]))
+    return [(media, q) for media, q, _ in ranges]
+
+
+def negotiate(header: Optional[str]) -> str:
+    """
+    Pick the best media type we can produce, or raise 406. A type the
+    client excluded with q=0 is never chosen, even through a wildcard.
+    """
+    ranges = parse_accept(header)
+    excluded = {media for media, q in ranges if q <= 0}
+    for media, q in ranges:
+        if q <= 0:
+            continue
+        if media in ENCODERS:
+            return media
+        if media in ("*/*", "application/*"):
+            # ENCODERS is in order of preference, JSON first
+            for candidate in ENCODERS:
+                if candidate not in excluded:
+                    return candidate
+    raise HTTPException(
+        status_code=406,
+        detail={"error": "Not Acceptable", "supported": sorted(ENCODERS)}
+    )
+
+
+def accepted_media(request: Request) -> str:
+    """
+    Route dependency: resolve the response format before the route runs,
+    so an unacceptable Accept header is refused (406) before any work or
+    state change happens.
+    """
+    return negotiate(request.headers.get("accept"))
+
+
+def render(request: Request, body: Dict[str, Any], rows_key: str, media: Optional[str] = None) -> Response:
+    """
+    Encode `body` in the format requested by the client; `media` is the
+    type already resolved by accepted_media().
+
+    `body[rows_key]` holds the row list; the other keys are metadata that is
+    kept in the document (JSON, msgpack), moved to a `meta` object (columnar)
+    or sent in the X-Response-Meta header (NDJSON).
+    """
+    media = media or negotiate(request.headers.get("accept"))
+
+    headers = {"Vary": "Accept"}
+    if media == NDJSON:
+        # Header values must be latin-1, so keep this one ASCII-escaped
+        headers[META_HEADER] = json.dumps(_meta(body, rows_key), default=_default, separators=(",", ":"))
+
+    return Response(content=ENCODERS[media](body, rows_key), media_type=media, headers=headers)
@@ -0,0 +1,132 @@
+"""
+Long-lived Tesseract engine for scanned statements and photos.
+
+With tesserocr installed, each worker process keeps one TessBaseAPI with
+the language data loaded once (created lazily after the fork). A page then
+costs one SetImage plus a SetRectangle/Recognize per statement row found
+by services/preprocess.py, with no process spawn and no re-reading of the
+traineddata. Without tesserocr, pytesseract is used: one `tesseract`
+subprocess per page - never per row - on the page with everything outside
+the rows blanked out.
+
+AI_OCR_ENGINE forces "tesserocr" or "pytesseract"; AI_OCR_LANG sets the
+languages (default por+eng).
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.preprocess import OCR_DPI, Region
+
+try:
+    import tesserocr
+except ImportError:  # pragma: no cover - optional at import time
+    tesserocr = None
+
+try:
+    import pytesseract
+except ImportError:  # pragma: no cover - optional at import time
+    pytesseract = None
+
+# A column of text of varying sizes, same as SetPageSegMode(PSM.SINGLE_COLUMN):
+# unlike a single block it copes with a row whose amount sits between lines
+PSM_SINGLE_COLUMN = 4
+
+# (text, (x0, y0, x1, y1) in pixels, confidence 0-100)
+Word = Tuple[str, Tuple[int, int, int, int], float]
+
+
+class TesseractEngine:
+    def __init__(self, lang: str = "por+eng", backend: Optional[str] = None):
+        self.lang = lang
+        if backend is None:
+            backend = "tesserocr" if tesserocr is not None else "pytesseract" if pytesseract is not None else None
+        self.backend = backend
+        self._api = None
+        self._pid: Optional[int] = None
+        # A TessBaseAPI is not thread-safe; pages of one worker take turns
+        self._lock = threading.Lock()
+        self._stats = {"pages": 0, "rows": 0, "words": 0}
+
+    def available(self) -> bool:
+        return self.backend is not None
+
+    def _tess_api(self):
+        if self._api is None or self._pid != os.getpid():
+            self._api = tesserocr.PyTessBaseAPI(lang=self.lang, psm=tesserocr.PSM.SINGLE_COLUMN)
+            self._pid = os.getpid()
+        return self._api
+
+    def _recognize_tesserocr(self, image, regions: List[Region]) -> List[Word]:
+        from tesserocr import RIL, iterate_level
+
+        words = []
+        with self._lock:
+            api = self._tess_api()
+            api.SetImage(image)
+            api.SetSourceResolution(OCR_DPI)
+            for x, y, width, height in regions:
+                api.SetRectangle(x, y, width, height)
+                api.Recognize()
+                iterator = api.GetIterator()
+                if iterator is None:
+                    continue
+                for word in iterate_level(iterator, RIL.WORD):
+                    try:
+                        text = word.GetUTF8Text(RIL.WORD)
+                    except RuntimeError:  # tesserocr raises on an empty word
+                        continue
+                    box = word.BoundingBox(RIL.WORD)
+                    if text and text.strip() and box:
+                        words.append((text.strip(), tuple(box), word.Confidence(RIL.WORD)))
+            api.Clear()
+        return words
+
+    def _recognize_pytesseract(self, binary: np.ndarray, regions: List[Region]) -> List[Word]:
+        from PIL import Image
+
+        masked = np.full_like(binary, 255)
+        for x, y, width, height in regions:
+            masked[y:y + height, x:x + width] = binary[y:y + height, x:x + width]
+        data = pytesseract.image_to_data(
+            Image.fromarray(masked),
+            lang=self.lang,
+            config=f"--psm {PSM_SINGLE_COLUMN} --dpi {OCR_DPI}",
+            output_type=pytesseract.Output.DICT,
+        )
+        return [
+            (text.strip(), (left, top, left + w, top + h), float(conf))
+            for text, left, top, w, h, conf in zip(
+                data["text"], data["left"], data["top"], data["width"], data["height"], data["conf"]
+            )
+            if text.strip() and float(conf) >= 0
+        ]
+
+    def recognize(self, binary: np.ndarray, regions: List[Region]) -> List[Word]:
+        """
+        Words inside the given regions of a prepared (binarized) page.
+        """
+        if not regions:
+            return []
+        if self.backend == "tesserocr":
+            from PIL import Image
+
+            words = self._recognize_tesserocr(Image.fromarray(binary), regions)
+        else:
+            words = self._recognize_pytesseract(binary, regions)
+        self._stats["pages"] += 1
+        self._stats["rows"] += len(regions)
+        self._stats["words"] += len(words)
+        return words
+
+    def stats(self) -> Dict:
+        return {"backend": self.backend, "lang": self.lang, **self._stats}
+
+
+engine = TesseractEngine(
+    lang=os.getenv("AI_OCR_LANG", "por+eng"),
+    backend=os.getenv("AI_OCR_ENGINE") or None,
+)
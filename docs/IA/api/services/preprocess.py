@@ -0,0 +1,230 @@
+"""
+Page clean-up before OCR, for phone photos and scanned statements.
+
+prepare() turns a page image into what Tesseract reads best:
+
+1. Resample to OCR_DPI. The source resolution comes from the file's DPI tag
+   or, without one, from the page's short side assuming an A4 page.
+2. Deskew by the angle (within MAX_SKEW degrees) that makes the horizontal
+   ink profile sharpest, searched on a small copy, coarse then fine.
+3. Adaptive (local mean) binarization, which survives the shadows and
+   uneven lighting of photos where one global threshold does not.
+4. Row segmentation. Ruling lines and specks are removed, the words of a
+   line are joined into fragments, and fragments that are not text
+   (leftovers of dotted rules, solid bars, photos: thinner or denser than a
+   line) are dropped. Statement rows are anchored on the leftmost text
+   column (the date): each fragment there starts a row, and every other
+   fragment belongs to the row it sits in, so a transaction's history,
+   detail line and amount - staggered over two or three lines - are read
+   together. Only the rows, holding only the ink of the kept fragments, go
+   to OCR; blank space, margins and rule leftovers never reach Tesseract.
+
+Deciding which of the rows are transactions is left to
+services/statement.py, which needs the recognized words.
+"""
+
+import bisect
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # pragma: no cover - optional at import time
+    cv2 = None
+
+OCR_DPI = 300
+MAX_SKEW = 5.0
+A4_SHORT_SIDE_INCHES = 8.27
+SKEW_SEARCH_WIDTH = 800
+
+Region = Tuple[int, int, int, int]  # x, y, width, height
+
+
+class Prepared(NamedTuple):
+    gray: np.ndarray    # resampled and deskewed page
+    binary: np.ndarray  # cleaned text, black on white, same geometry as gray
+    regions: List[Region]
+    angle: float
+    scale: float
+
+
+def source_dpi(image) -> float:
+    """
+    Resolution of a PIL image: its DPI tag when plausible, otherwise
+    estimated from the page size.
+    """
+    dpi = image.info.get("dpi")
+    if dpi and 50 <= float(dpi[0]) <= 1200:
+        return float(dpi[0])
+    return min(image.size) / A4_SHORT_SIDE_INCHES
+
+
+def resample(gray: np.ndarray, dpi: float, target_dpi: int = OCR_DPI) -> Tuple[np.ndarray, float]:
+    scale = max(0.25, min(4.0, target_dpi / dpi))
+    if abs(scale - 1) < 0.05:
+        return gray, 1.0
+    interpolation = cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation), scale
+
+
+def _rotate(image: np.ndarray, angle: float, interpolation: int, border_mode: int) -> np.ndarray:
+    height, width = image.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (width, height), flags=interpolation, borderMode=border_mode, borderValue=0)
+
+
+def skew_angle(gray: np.ndarray) -> float:
+    """
+    Rotation (degrees, counter-clockwise) that straightens the text lines.
+    """
+    factor = SKEW_SEARCH_WIDTH / gray.shape[1]
+    small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1 else gray
+    ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+    def sharpness(angle: float) -> float:
+        profile = _rotate(ink, angle, cv2.INTER_NEAREST, cv2.BORDER_CONSTANT).sum(axis=1, dtype=np.float64)
+        return float(np.square(np.diff(profile)).sum())
+
+    best = max(np.arange(-MAX_SKEW, MAX_SKEW + 1e-6, 0.5), key=sharpness)
+    best = max(np.arange(best - 0.4, best + 0.41, 0.1), key=sharpness)
+    return round(float(best), 1)
+
+
+def binarize(gray: np.ndarray, dpi: int = OCR_DPI) -> np.ndarray:
+    block = (dpi // 10) | 1  # about a character wide
+    # Mean rather than Gaussian weights: same result on text, a quarter of the time
+    return cv2.adaptiveThreshold(
+        cv2.medianBlur(gray, 3), 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, 15
+    )
+
+
+def text_ink(binary: np.ndarray, dpi: int = OCR_DPI) -> np.ndarray:
+    """
+    Text pixels (255) of a binarized page, without ruling lines, specks
+    and whatever touches the page edge (scanner margins, the table or
+    desk around a photographed page).
+    """
+    height, width = binary.shape
+    ink = cv2.bitwise_not(binary)
+    # Ruling lines are long, so half resolution finds them at a quarter of the cost
+    half = cv2.resize(ink, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+    half = cv2.threshold(half, 0, 255, cv2.THRESH_BINARY)[1]
+    rules = cv2.bitwise_or(
+        cv2.morphologyEx(half, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, width // 16), 1))),
+        cv2.morphologyEx(half, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, height // 40)))),
+    )
+    rules = cv2.dilate(cv2.resize(rules, (width, height), interpolation=cv2.INTER_NEAREST), np.ones((3, 3), np.uint8))
+    ink = cv2.subtract(ink, rules)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    left, top = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    right, bottom = left + stats[:, cv2.CC_STAT_WIDTH], top + stats[:, cv2.CC_STAT_HEIGHT]
+    margin = dpi // 100  # a quarter of a millimetre: no text is printed there
+    keep = (
+        (stats[:, cv2.CC_STAT_AREA] >= max(4, (dpi // 100) ** 2))
+        & (left > margin) & (top > margin) & (right < width - margin) & (bottom < height - margin)
+    )
+    keep[0] = False
+    return (keep.astype(np.uint8) * 255)[labels]
+
+
+def text_fragments(ink: np.ndarray, dpi: int = OCR_DPI) -> List[List[int]]:
+    """
+    Pieces of text lines (words closer than a few characters run together),
+    top to bottom, as [x0, y0, x1, y1]. The page is at a known resolution by
+    now, so the thresholds are in points.
+    """
+    joined = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (dpi // 12, 1)))
+    _, _, stats, _ = cv2.connectedComponentsWithStats(joined, connectivity=8)
+    fragments = []
+    for x, y, width, height, _ in stats[1:]:
+        # Thinner than 3pt: accents, leftovers of dotted rules; taller than a few lines: not text
+        if height < dpi * 3 // 72 or height > dpi // 2:
+            continue
+        # Denser than text: bars, photos
+        if np.count_nonzero(ink[y:y + height, x:x + width]) > 0.35 * width * height:
+            continue
+        fragments.append([int(x), int(y), int(x + width), int(y + height)])
+    fragments.sort(key=lambda f: (f[1], f[0]))
+    return fragments
+
+
+def text_rows(fragments: List[List[int]], dpi: int = OCR_DPI) -> List[List[int]]:
+    """
+    Group fragments into statement rows, as [x0, y0, x1, y1]. The anchor
+    column is the leftmost one at least two fragments start at; a fragment
+    there starts a row, a little above its own middle, and the others join
+    the row their middle falls in. Text above the first anchor is one row,
+    and a fragment more than a line below the rest of its row starts a new
+    one (footers, stray marks).
+    """
+    if not fragments:
+        return []
+    tolerance = dpi // 8
+    starts = sorted(f[0] for f in fragments)
+    left = next((x for x, following in zip(starts, starts[1:]) if following - x <= tolerance), starts[0])
+
+    cuts: List[int] = []
+    bottom = -1
+    for x0, y0, _, y1 in fragments:
+        if abs(x0 - left) <= tolerance and y0 >= bottom:
+            cuts.append(y0 - (y1 - y0) // 2)
+            bottom = y1
+
+    bands: List[List[List[int]]] = [[] for _ in range(len(cuts) + 1)]
+    for fragment in fragments:
+        band = bands[bisect.bisect_right(cuts, (fragment[1] + fragment[3]) // 2)]
+        row = band[-1] if band else None
+        if row is None or fragment[1] - row[3] > dpi // 6:
+            band.append(list(fragment))
+        else:
+            row[0], row[1] = min(row[0], fragment[0]), min(row[1], fragment[1])
+            row[2], row[3] = max(row[2], fragment[2]), max(row[3], fragment[3])
+    return sorted((row for band in bands for row in band), key=lambda r: (r[1], r[0]))
+
+
+def text_regions(shape: Tuple[int, int], rows: List[List[int]], dpi: int = OCR_DPI) -> List[Region]:
+    """
+    Rows padded and clipped to the page, as (x, y, width, height).
+    """
+    height, width = shape
+    pad = dpi // 50
+    regions = []
+    for x0, y0, x1, y1 in rows:
+        x0, y0 = max(0, x0 - pad), max(0, y0 - pad)
+        x1, y1 = min(width, x1 + pad), min(height, y1 + pad)
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+
+def keep_text(ink: np.ndarray, fragments: List[List[int]], dpi: int = OCR_DPI) -> np.ndarray:
+    """
+    The ink of the text fragments (and the accents just above them) only:
+    leftovers of dotted rules between rows would otherwise be read as
+    characters.
+    """
+    mask = np.zeros_like(ink)
+    pad = dpi // 50
+    for x0, y0, x1, y1 in fragments:
+        mask[max(0, y0 - 2 * pad):y1 + pad, max(0, x0 - pad):x1 + pad] = 255
+    return cv2.bitwise_and(ink, mask)
+
+
+def prepare(image, dpi: Optional[float] = None) -> Prepared:
+    """
+    Clean up a PIL page image for OCR. Without OpenCV the page is passed
+    through as a single region.
+    """
+    gray = np.asarray(image.convert("L"))
+    if cv2 is None:
+        return Prepared(gray, gray, [(0, 0, gray.shape[1], gray.shape[0])], 0.0, 1.0)
+
+    gray, scale = resample(gray, dpi or source_dpi(image))
+    angle = skew_angle(gray)
+    if abs(angle) >= 0.1:
+        # Replicate the edges: a constant fill would binarize into a frame
+        gray = _rotate(gray, angle, cv2.INTER_LINEAR, cv2.BORDER_REPLICATE)
+    ink = text_ink(binarize(gray))
+    fragments = text_fragments(ink)
+    regions = text_regions(ink.shape, text_rows(fragments))
+    return Prepared(gray, cv2.bitwise_not(keep_text(ink, fragments)), regions, angle, scale)
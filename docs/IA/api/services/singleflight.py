@@ -0,0 +1,107 @@
+"""
+Request coalescing ("single flight") for the analytics routes.
+
+A dashboard load fires /predict/expenses, /predict/budget, /predict/trends
+and /suggestions/* for the same user at nearly the same time, and family
+views repeat them per member. Concurrent calls with the same key (route,
+user and parameters) share one computation: the first caller starts it as
+a task, later callers await the same task, and everyone receives its
+result or its exception. The task is shielded, so a client disconnecting
+does not cancel the work the other waiters are waiting on.
+
+Keys are forgotten as soon as the computation finishes, unless a window
+(AI_SINGLEFLIGHT_WINDOW, seconds) is configured; then a finished result is
+also served to identical calls that arrive within the window. The history
+loads behind the routes are coalesced the same way, so the routes of one
+dashboard load read a single snapshot of the user's synced history.
+
+AI_SINGLEFLIGHT=0 turns coalescing off. Like the admission controller,
+the group lives in the worker's event loop and needs no locking.
+"""
+
+import asyncio
+import functools
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class SingleFlight:
+    def __init__(self, window: float = 0.0, enabled: bool = True):
+        self.window = window
+        self.enabled = enabled
+        self._calls: Dict[Hashable, Tuple[asyncio.Future, float]] = {}
+        self._stats = {"calls": 0, "shared": 0, "executed": 0}
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        entry = self._calls.get(key)
+        if entry is None or entry[0] is not task:
+            return
+        if self.window > 0 and not task.cancelled() and task.exception() is None:
+            self._calls[key] = (task, time.monotonic() + self.window)
+        else:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn() once for every concurrent caller with the same key.
+        """
+        self._stats["calls"] += 1
+        if not self.enabled:
+            self._stats["executed"] += 1
+            return await fn()
+        entry = self._calls.get(key)
+        if entry is not None and (not entry[0].done() or entry[1] > time.monotonic()):
+            self._stats["shared"] += 1
+            task = entry[0]
+        else:
+            self._stats["executed"] += 1
+            if self.window > 0:
+                self._prune()
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = (task, 0.0)
+            task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (task, expires) in self._calls.items() if task.done() and expires <= now]:
+            del self._calls[key]
+
+    def forget(self, user_id: str):
+        """
+        Drop finished results kept for a user (their data just changed);
+        calls still in flight are left to finish.
+        """
+        for key in [k for k, (task, _) in self._calls.items() if k[1] == user_id and task.done()]:
+            del self._calls[key]
+
+    def coalesce(self, name: str):
+        """
+        Decorator for an async route taking keyword arguments, one of them
+        user_id. The route's signature is kept for FastAPI.
+        """
+        def decorator(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapper(**kwargs):
+                key = (name, kwargs.get("user_id"), _freeze(kwargs))
+                return await self.do(key, lambda: endpoint(**kwargs))
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict:
+        return {**self._stats, "in_flight": sum(1 for task, _ in self._calls.values() if not task.done())}
+
+
+group = SingleFlight(
+    window=float(os.getenv("AI_SINGLEFLIGHT_WINDOW", 0.0)),
+    enabled=os.getenv("AI_SINGLEFLIGHT", "1").lower() not in ("0", "false", "no"),
+)
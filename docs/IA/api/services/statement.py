@@ -0,0 +1,249 @@
+"""
+Turns the words of a bank statement page into transaction records.
+
+Words come with boxes normalized to 0-1000 (see services/extractor.py).
+Rows are found geometrically: every line holding a monetary amount anchors
+one transaction, and the remaining words are attached to the nearest anchor
+within one line height. This covers both layouts we have samples of - one
+line per field with a "(-)"/"(+)" marker, and column layouts with
+Crédito/Débito/Saldo headers and a multi-line description.
+
+Inside a row, fields are picked either from the LayoutLMv3 labels (when the
+extractor ran) or from regular expressions (rule-based fallback).
+"""
+
+import re
+from bisect import bisect_left
+import unicodedata
+from statistics import median
+from typing import Dict, List, Optional, Sequence, Tuple
+
+AMOUNT_RE = re.compile(r"^-?R?\$?\d{1,3}(?:\.\d{3})*,\d{2}-?$|^-?\d+,\d{2}-?$")
+DATE_RE = re.compile(r"^(\d{2})/(\d{2})/(\d{4})$")
+SIGN_RE = re.compile(r"^\(([+-])\)$")
+DOCUMENT_RE = re.compile(r"^\d{5,}$")
+
+AMOUNT_FIELDS = ("valor", "credito", "debito")
+RULE_CONFIDENCE = 0.7
+SKIPPED_DESCRIPTIONS = ("saldo anterior", "saldo do dia", "saldo final", "saldo total", "total")
+
+Word = Tuple[str, Sequence[int]]
+Labels = Optional[List[Tuple[str, float]]]
+
+
+def _norm(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def parse_amount(text: str) -> Optional[float]:
+    """
+    "1.234,56" -> 1234.56; None when the token is not an amount.
+    """
+    text = text.strip()
+    if not AMOUNT_RE.match(text):
+        return None
+    negative = text.startswith("-") or text.endswith("-")
+    digits = text.strip("-").lstrip("R$").replace(".", "").replace(",", ".")
+    value = float(digits)
+    return -value if negative else value
+
+
+def parse_date(text: str) -> Optional[str]:
+    """
+    "05/03/2025" -> "2025-03-05"; None when the token is not a date.
+    """
+    match = DATE_RE.match(text.strip())
+    if not match:
+        return None
+    day, month, year = match.groups()
+    if not (1 <= int(day) <= 31 and 1 <= int(month) <= 12):
+        return None
+    return f"{year}-{month}-{day}"
+
+
+def _center_y(box: Sequence[int]) -> float:
+    return (box[1] + box[3]) / 2
+
+
+def _center_x(box: Sequence[int]) -> float:
+    return (box[0] + box[2]) / 2
+
+
+def _column_headers(words: List[Word]) -> Dict[str, float]:
+    """
+    x centers of the Crédito/Débito/Saldo headers, when the layout has them.
+    Only words above the first amount are looked at, so descriptions such as
+    "Saldo Anterior" are not taken for a header.
+    """
+    amounts = [_center_y(box) for text, box in words if parse_amount(text) is not None]
+    if not amounts:
+        return {}
+    top = min(amounts)
+    headers: Dict[str, float] = {}
+    for text, box in words:
+        if _center_y(box) >= top:
+            continue
+        key = _norm(text).strip(".:")
+        if key in ("credito", "debito", "saldo") and key not in headers:
+            headers[key] = _center_x(box)
+    return headers if "credito" in headers or "debito" in headers else {}
+
+
+def group_rows(words: List[Word], is_anchor) -> List[List[int]]:
+    """
+    Group word indices into transaction rows around anchor words.
+    Words farther than one line height from every anchor are dropped
+    (headers, footers, page numbers).
+    """
+    if not words:
+        return []
+    line_height = median(box[3] - box[1] for _, box in words) or 1
+
+    anchors: List[float] = []
+    for i in sorted(range(len(words)), key=lambda i: _center_y(words[i][1])):
+        if is_anchor(i):
+            y = _center_y(words[i][1])
+            if not anchors or y - anchors[-1] > line_height / 2:
+                anchors.append(y)
+    if not anchors:
+        return []
+
+    rows: List[List[int]] = [[] for _ in anchors]
+    for i, (_, box) in enumerate(words):
+        y = _center_y(box)
+        position = bisect_left(anchors, y)
+        nearest = min(
+            (n for n in (position - 1, position) if 0 <= n < len(anchors)),
+            key=lambda n: abs(y - anchors[n]),
+        )
+        if abs(y - anchors[nearest]) <= line_height:
+            rows[nearest].append(i)
+    for row in rows:
+        row.sort(key=lambda i: (round(_center_y(words[i][1]) / (line_height / 2)), words[i][1][0]))
+    return [row for row in rows if row]
+
+
+def _field(label: str) -> str:
+    return label.split("-", 1)[1].lower() if "-" in label else ""
+
+
+def _kind(text: str) -> Optional[str]:
+    """
+    "(+)", "entrada", "C" -> credit; "(-)", "saida", "D" -> debit.
+    """
+    match = SIGN_RE.match(text.strip())
+    if match:
+        return "credit" if match.group(1) == "+" else "debit"
+    key = _norm(text).strip(" .:")
+    if key in ("entrada", "credito", "c"):
+        return "credit"
+    if key in ("saida", "debito", "d"):
+        return "debit"
+    return None
+
+
+def parse_rows(words: List[Word], labels: Labels = None) -> List[Dict[str, List[int]]]:
+    """
+    One dict per transaction row mapping each field (data, descricao,
+    valor/credito/debito, tipo, docto, saldo) to the indices of its words,
+    in reading order. Only the first valid date, amount and balance of a row
+    are kept.
+    """
+    if labels is not None:
+
+        def is_anchor(i):
+            return _field(labels[i][0]) in AMOUNT_FIELDS and parse_amount(words[i][0]) is not None
+
+        headers: Dict[str, float] = {}
+    else:
+
+        def is_anchor(i):
+            return parse_amount(words[i][0]) is not None
+
+        headers = _column_headers(words)
+
+    rows = []
+    for row in group_rows(words, is_anchor):
+        fields: Dict[str, List[int]] = {}
+        for i in row:
+            text = words[i][0]
+            field = _field(labels[i][0]) if labels is not None else _rule_field(text, words[i][1], headers)
+            if not field:
+                continue
+            if field == "data" and ("data" in fields or not parse_date(text)):
+                continue
+            if field in AMOUNT_FIELDS and (fields.keys() & set(AMOUNT_FIELDS) or parse_amount(text) is None):
+                continue
+            if field == "saldo" and ("saldo" in fields or parse_amount(text) is None):
+                continue
+            if field == "tipo" and ("tipo" in fields or _kind(text) is None):
+                continue
+            fields.setdefault(field, []).append(i)
+        rows.append(fields)
+    return rows
+
+
+def row_transaction(words: List[Word], fields: Dict[str, List[int]], labels: Labels, date: Optional[str]) -> Optional[Dict]:
+    """
+    Transaction dict (date, description, amount, type, confidence) for one
+    row from parse_rows, or None for balance/total lines and rows missing
+    an amount, a date or a description. `date` is the row's own date or the
+    one inherited from the rows above.
+    """
+    amount_field = next((f for f in AMOUNT_FIELDS if f in fields), None)
+    text = " ".join(words[i][0] for i in fields.get("descricao", [])).strip()
+    if amount_field is None or not date or not text or _norm(text).startswith(SKIPPED_DESCRIPTIONS):
+        return None
+    amount = parse_amount(words[fields[amount_field][0]][0])
+    if not amount:
+        return None
+
+    if amount_field != "valor":
+        kind = "credit" if amount_field == "credito" else "debit"
+    elif "tipo" in fields:
+        kind = _kind(words[fields["tipo"][0]][0])
+    else:
+        # No marker and no column: statements print bare amounts for debits
+        kind = "debit"
+
+    used = [i for name in ("data", "descricao", "tipo", amount_field) for i in fields.get(name, [])]
+    confidence = sum(labels[i][1] for i in used) / len(used) if labels is not None else RULE_CONFIDENCE
+    return {
+        "date": date,
+        "description": text,
+        "amount": abs(amount),
+        "type": kind,
+        "confidence": round(confidence, 4),
+    }
+
+
+def assemble(words: List[Word], labels: Labels = None, carry_date: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Transactions of one page. Rows without a date inherit the previous one,
+    which is how column layouts print several entries of the same day; the
+    last date is returned so it can carry over to the next page.
+    """
+    transactions = []
+    last_date = carry_date
+    for fields in parse_rows(words, labels):
+        if "data" in fields:
+            last_date = parse_date(words[fields["data"][0]][0])
+        transaction = row_transaction(words, fields, labels, last_date)
+        if transaction:
+            transactions.append(transaction)
+    return transactions, last_date
+
+
+def _rule_field(text: str, box: Sequence[int], headers: Dict[str, float]) -> str:
+    if parse_date(text):
+        return "data"
+    if parse_amount(text) is not None:
+        if headers:
+            return min(headers, key=lambda key: abs(headers[key] - _center_x(box)))
+        return "valor"
+    if SIGN_RE.match(text):
+        return "tipo"
+    if DOCUMENT_RE.match(text):
+        return "docto"
+    return "descricao"
@@ -0,0 +1,113 @@
+"""
+Shared SQLite store for the per-user state of the AI services.
+
+The synced ledger (services/ledger.py), the duplicate index
+(services/dedup.py), the merchant index (services/merchants.py) and the
+anomaly baselines (services/anomaly.py) live in one SQLite file in WAL mode
+(AI_LEDGER_PATH). Every worker of the pre-fork runner and every restart
+sees the same state, so a response does not depend on which worker served
+it or on what that worker happened to see before.
+
+Each service registers its schema with the store; connections are opened
+lazily and never cross a fork. Writes go through write(), one
+BEGIN IMMEDIATE transaction that serializes writers across processes while
+readers keep going; a write() inside another one joins it, so a caller can
+make several services' updates atomic. In-memory bookkeeping that must
+only follow a commit goes through after_commit().
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+
+class Database:
+    def __init__(self, path: str):
+        self.path = path
+        self._schemas: List[str] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        # One connection per process, shared by the threadpool
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._after_commit: List[Callable[[], None]] = []
+
+    def register(self, schema: str):
+        """
+        Add a schema (CREATE ... IF NOT EXISTS statements) to the store.
+        """
+        with self._lock:
+            if schema in self._schemas:
+                return
+            self._schemas.append(schema)
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.executescript(schema)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork: reopen in each worker
+        if self._conn is None or self._pid != os.getpid():
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for schema in self._schemas:
+                conn.executescript(schema)
+            self._conn, self._pid, self._depth = conn, os.getpid(), 0
+            self._after_commit = []
+        return self._conn
+
+    def after_commit(self, callback: Callable[[], None]):
+        """
+        Run callback once the outermost write() in progress commits; it is
+        dropped if that transaction rolls back.
+        """
+        with self._lock:
+            if not self._depth:
+                raise RuntimeError("after_commit() outside of write()")
+            self._after_commit.append(callback)
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            yield self._connection()
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """
+        A write transaction, committed when the block exits normally and
+        rolled back when it raises.
+        """
+        with self._lock:
+            conn = self._connection()
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._depth -= 1
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+                callbacks = self._after_commit
+                self._after_commit = []
+                for callback in callbacks:
+                    callback()
+            finally:
+                self._depth = 0
+                self._after_commit = []
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "ledger.sqlite3")
+
+db = Database(os.getenv("AI_LEDGER_PATH", DEFAULT_PATH))
@@ -0,0 +1,190 @@
+# Gera anotações estruturadas direto dos PDFs, em paralelo
+#
+# Para cada PDF em datasets/pdf/ lê as palavras e posições da camada de
+# texto (pdf_layout.py), agrupa as palavras em lançamentos com a mesma
+# heurística de linhas usada pela API (api/services/statement.py) e grava
+# um registro por documento, com bbox real de cada campo.
+#
+# Saída em datasets/annotations/:
+#   records.jsonl       uma linha JSON compacta por documento
+#   records.index.json  {file_name: {"sha256", "offset", "length", "records"}}
+#
+# O índice permite ler um documento sem varrer o arquivo todo (seek no
+# offset) e pular PDFs que não mudaram desde a última execução.
+#
+# O parser de linhas é o mesmo módulo que a API usa em produção
+# (api/services/statement.py); a pasta api/ entra no PYTHONPATH, como na
+# imagem Docker e no pytest.ini.
+#
+# Uso:
+#   PYTHONPATH=api python src/build_annotations.py [--workers N] [--force]
+
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from extrato_dataset import FIELD_LABELS, file_sha256
+from pdf_layout import extract_pages, normalize_box
+
+PDF_DIR = './datasets/pdf/'
+ANNOTATIONS_DIR = './datasets/annotations/'
+RECORDS_FILE = 'records.jsonl'
+INDEX_FILE = 'records.index.json'
+
+
+def _union(boxes):
+    return [
+        round(min(b[0] for b in boxes), 1),
+        round(min(b[1] for b in boxes), 1),
+        round(max(b[2] for b in boxes), 1),
+        round(max(b[3] for b in boxes), 1),
+    ]
+
+
+def annotate_pdf(pdf_path):
+    """
+    Retorna o registro de um documento:
+        {"file_name", "sha256", "pages",
+         "records": [{"page", "date", "description", "amount", "type",
+                      "fields": {campo: {"value", "bbox"}}}]}
+    As bboxes estão em pontos do PDF, como as palavras de extract_pages.
+    """
+    # Só quem gera anotações precisa do parser; quem lê records.jsonl não
+    from services import statement
+
+    pages = extract_pages(pdf_path)
+    records = []
+    last_date = None
+    for page in pages:
+        raw = page['words']
+        words = [(w[0], normalize_box(w[1:], page['width'], page['height'])) for w in raw]
+        for fields in statement.parse_rows(words):
+            if 'data' in fields:
+                last_date = statement.parse_date(words[fields['data'][0]][0])
+            transaction = statement.row_transaction(words, fields, None, last_date)
+            if transaction is None:
+                continue
+            del transaction['confidence']
+            transaction['page'] = page['page']
+            transaction['fields'] = {
+                name: {
+                    'value': ' '.join(raw[i][0] for i in fields[name]),
+                    'bbox': _union([raw[i][1:] for i in fields[name]]),
+                }
+                for name in FIELD_LABELS if name in fields
+            }
+            records.append(transaction)
+
+    return {
+        'file_name': os.path.basename(pdf_path),
+        'sha256': file_sha256(pdf_path),
+        'pages': len(pages),
+        'records': records,
+    }
+
+
+def _annotate_line(pdf_path):
+    doc = annotate_pdf(pdf_path)
+    line = json.dumps(doc, ensure_ascii=False, separators=(',', ':')) + '\n'
+    return doc['file_name'], doc['sha256'], len(doc['records']), line.encode('utf-8')
+
+
+def load_index(annotations_dir=ANNOTATIONS_DIR):
+    path = os.path.join(annotations_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_document(annotations_dir, entry):
+    """
+    Lê um único documento do records.jsonl a partir da entrada do índice.
+    """
+    with open(os.path.join(annotations_dir, RECORDS_FILE), 'rb') as f:
+        f.seek(entry['offset'])
+        return json.loads(f.read(entry['length']))
+
+
+def iter_documents(annotations_dir=ANNOTATIONS_DIR):
+    """
+    Percorre todos os documentos em ordem, lendo o arquivo sequencialmente.
+    """
+    path = os.path.join(annotations_dir, RECORDS_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build(pdf_dir=PDF_DIR, annotations_dir=ANNOTATIONS_DIR, workers=None, force=False):
+    """
+    Atualiza records.jsonl e o índice. Documentos cujo sha256 não mudou são
+    copiados do arquivo anterior; os demais são processados em paralelo.
+    """
+    os.makedirs(annotations_dir, exist_ok=True)
+    records_path = os.path.join(annotations_dir, RECORDS_FILE)
+    old_index = {} if force else load_index(annotations_dir)
+
+    pdfs = sorted(glob.glob(os.path.join(pdf_dir, '*.pdf')))
+    reused, pending = {}, []
+    for path in pdfs:
+        name = os.path.basename(path)
+        entry = old_index.get(name)
+        if entry and os.path.exists(records_path) and entry['sha256'] == file_sha256(path):
+            reused[name] = entry
+        else:
+            pending.append(path)
+
+    started = time.perf_counter()
+    lines = {}
+    if pending:
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(pending) // (workers * 4))
+            for name, sha256, count, line in pool.map(_annotate_line, pending, chunksize=chunksize):
+                lines[name] = (sha256, count, line)
+    elapsed = time.perf_counter() - started
+
+    # Reescreve o arquivo inteiro em ordem de nome; entradas reaproveitadas
+    # são copiadas byte a byte do arquivo antigo
+    index = {}
+    tmp_path = records_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        old = open(records_path, 'rb') if reused else None
+        try:
+            for path in pdfs:
+                name = os.path.basename(path)
+                if name in reused:
+                    entry = reused[name]
+                    old.seek(entry['offset'])
+                    line = old.read(entry['length'])
+                    sha256, count = entry['sha256'], entry['records']
+                else:
+                    sha256, count, line = lines[name]
+                index[name] = {'sha256': sha256, 'offset': out.tell(), 'length': len(line), 'records': count}
+                out.write(line)
+        finally:
+            if old:
+                old.close()
+    os.replace(tmp_path, records_path)
+    with open(os.path.join(annotations_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+
+    total = sum(entry['records'] for entry in index.values())
+    rate = len(pending) / elapsed if elapsed and pending else 0
+    print(f'{len(index)} documentos ({len(pending)} processados, {len(reused)} sem alteração), '
+          f'{total} lançamentos, {rate:.1f} docs/s')
+    return index
+
+
+if __name__ == "__main__":
+    workers = None
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+    build(workers=workers, force='--force' in sys.argv)
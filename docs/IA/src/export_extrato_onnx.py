@@ -0,0 +1,145 @@
+# Exporta o melhor checkpoint do LayoutLMv3 para ONNX e gera uma versão
+# quantizada dinamicamente em int8 para inferência em CPU.
+#
+# Saída em models/layoutlmv3-onnx/:
+#   model.onnx       fp32 (referência para o benchmark)
+#   model.int8.onnx  pesos int8, usado pela rota /ocr/extract
+#   tokenizer.json   tokenizer do processor
+#   extractor.json   labels e parâmetros de pré-processamento
+#
+# Uso:
+#   python src/export_extrato_onnx.py [checkpoint] [saida]
+#   python src/export_extrato_onnx.py --tiny    # modelo pequeno aleatório (testes/benchmark)
+
+import json
+import os
+import sys
+
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
+
+CHECKPOINT_DIR = './models/layoutlmv3-checkpoints/best'
+OUTPUT_DIR = './models/layoutlmv3-onnx/'
+OPSET = 17
+
+
+def export(checkpoint_dir, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    processor = LayoutLMv3Processor.from_pretrained(checkpoint_dir, apply_ocr=False)
+    model = LayoutLMv3ForTokenClassification.from_pretrained(checkpoint_dir)
+    model.eval()
+
+    tokenizer = processor.tokenizer
+    image_processor = processor.image_processor
+    size = image_processor.size
+    image_size = [size, size] if isinstance(size, int) else [size['height'], size['width']]
+
+    # Entrada de exemplo; lote e sequência ficam dinâmicos
+    seq_len = 16
+    dummy = {
+        'input_ids': torch.full((2, seq_len), tokenizer.pad_token_id, dtype=torch.long),
+        'attention_mask': torch.ones((2, seq_len), dtype=torch.long),
+        'bbox': torch.zeros((2, seq_len, 4), dtype=torch.long),
+        'pixel_values': torch.zeros((2, 3, *image_size), dtype=torch.float32),
+    }
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+    torch.onnx.export(
+        model,
+        (),
+        fp32_path,
+        kwargs=dummy,
+        input_names=['input_ids', 'bbox', 'attention_mask', 'pixel_values'],
+        output_names=['logits'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'bbox': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'pixel_values': {0: 'batch'},
+            'logits': {0: 'batch', 1: 'sequence'},
+        },
+        opset_version=OPSET,
+        dynamo=False,
+    )
+    print(f'ONNX fp32: {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.1f} MB)')
+
+    int8_path = os.path.join(output_dir, 'model.int8.onnx')
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f'ONNX int8: {int8_path} ({os.path.getsize(int8_path) / 1e6:.1f} MB)')
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, 'tokenizer.json'))
+    config = {
+        'labels': [model.config.id2label[i] for i in range(model.config.num_labels)],
+        'max_length': min(512, model.config.max_position_embeddings - 2),
+        'pad_token_id': tokenizer.pad_token_id,
+        'image_size': image_size,
+        'image_mean': list(image_processor.image_mean),
+        'image_std': list(image_processor.image_std),
+        'source_checkpoint': os.path.abspath(checkpoint_dir),
+    }
+    with open(os.path.join(output_dir, 'extractor.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f'Artefatos salvos em {output_dir}')
+
+
+def build_tiny_checkpoint(output_dir, pdf_dir='./datasets/pdf/'):
+    """
+    Cria um LayoutLMv3 minúsculo com pesos aleatórios e um tokenizer BPE
+    treinado no texto dos PDFs locais. Não precisa de rede; serve para
+    testar o export, o runner e o benchmark.
+    """
+    import glob
+    import tempfile
+
+    import pymupdf
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import (
+        LayoutLMv3Config,
+        LayoutLMv3ImageProcessor,
+        LayoutLMv3TokenizerFast,
+    )
+
+    from extrato_dataset import ID2LABEL, LABEL2ID, LABELS
+
+    texts = []
+    for path in sorted(glob.glob(os.path.join(pdf_dir, '*.pdf'))):
+        with pymupdf.open(path) as doc:
+            texts.extend(page.get_text() for page in doc)
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts or ['extrato'], vocab_size=1000,
+                            special_tokens=['<s>', '<pad>', '</s>', '<unk>', '<mask>'])
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab_path, merges_path = bpe.save_model(tmp)
+        tokenizer = LayoutLMv3TokenizerFast(vocab=vocab_path, merges=merges_path)
+    processor = LayoutLMv3Processor(LayoutLMv3ImageProcessor(apply_ocr=False), tokenizer)
+
+    config = LayoutLMv3Config(
+        vocab_size=len(tokenizer),
+        hidden_size=96,
+        coordinate_size=16,
+        shape_size=16,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=192,
+        # Como no layoutlmv3-base: janelas de 512 tokens + 2 posições de padding
+        max_position_embeddings=514,
+        num_labels=len(LABELS),
+        id2label=ID2LABEL,
+        label2id=LABEL2ID,
+    )
+    torch.manual_seed(0)
+    LayoutLMv3ForTokenClassification(config).save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+    return output_dir
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if '--tiny' in sys.argv:
+        checkpoint = build_tiny_checkpoint('./models/layoutlmv3-tiny/')
+        output = args[0] if args else './models/layoutlmv3-tiny-onnx/'
+    else:
+        checkpoint = args[0] if args else CHECKPOINT_DIR
+        output = args[1] if len(args) > 1 else OUTPUT_DIR
+    export(checkpoint, output)
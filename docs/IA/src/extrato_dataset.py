@@ -0,0 +1,365 @@
+# Construção offline do dataset de extratos para o LayoutLMv3
+#
+# Para cada PDF em datasets/pdf/ procura a anotação correspondente em
+# datasets/annotations/, extrai palavras e caixas da camada de texto,
+# rotula as palavras (BIO) e tokeniza com o processor UMA única vez.
+#
+# O resultado fica em cache no disco, em arquivos .npy abertos com
+# memory-map, organizado assim:
+#
+#   datasets/cache/<chave do processor>/<hash do documento>/{input_ids,...}.npy
+#   datasets/cache/<chave do processor>/manifest.json
+#
+# A chave do processor muda quando o modelo, a versão do transformers, o
+# max_length ou a lista de labels mudam; o hash do documento muda quando o
+# PDF ou os campos anotados mudam. Só documentos novos/alterados são reprocessados.
+
+import hashlib
+import json
+import os
+import shutil
+import unicodedata
+
+import numpy as np
+
+from pdf_layout import extract_pages, normalize_box
+
+CACHE_FORMAT = 1
+
+FIELD_LABELS = ['data', 'descricao', 'valor', 'tipo', 'docto', 'credito', 'debito', 'saldo']
+LABELS = ['O'] + [f'{prefix}-{field.upper()}' for field in FIELD_LABELS for prefix in ('B', 'I')]
+LABEL2ID = {label: i for i, label in enumerate(LABELS)}
+ID2LABEL = {i: label for label, i in LABEL2ID.items()}
+
+ARRAYS = ('input_ids', 'attention_mask', 'bbox', 'labels', 'pixel_values')
+
+
+def file_sha256(*paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def processor_key(model_name, max_length, stride):
+    import transformers
+
+    spec = {
+        'format': CACHE_FORMAT,
+        'model': model_name,
+        'transformers': transformers.__version__,
+        'max_length': max_length,
+        'stride': stride,
+        'labels': LABELS,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _norm(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def load_annotations(annotations_dir):
+    """
+    Mapeia file_name do PDF -> lista de campos {"label", "value", "bbox", "page"}.
+    Lê os registros gerados por build_annotations.py (records.jsonl) e os
+    .json avulsos (anotação manual) e junta os dois com merge_annotations.
+    """
+    from build_annotations import INDEX_FILE, iter_documents
+
+    annotations = {}
+    for doc in iter_documents(annotations_dir):
+        annotations[doc['file_name']] = [
+            {'label': label, 'value': field['value'], 'bbox': field['bbox'], 'page': record['page']}
+            for record in doc['records']
+            for label, field in record['fields'].items()
+        ]
+
+    for name in sorted(os.listdir(annotations_dir)):
+        if not name.endswith('.json') or name == INDEX_FILE:
+            continue
+        with open(os.path.join(annotations_dir, name), 'r', encoding='utf-8') as f:
+            ann = json.load(f)
+        annotations[ann['file_name']] = merge_annotations(annotations.get(ann['file_name'], []), ann['fields'])
+    return annotations
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_annotations(generated, manual):
+    """
+    Junta a anotação manual de um PDF aos campos gerados. Os .json manuais
+    costumam cobrir só alguns lançamentos, sem bbox ([0,0,0,0]), enquanto
+    os gerados cobrem o documento inteiro com bbox real. Por isso:
+      - sem campos gerados, vale a anotação manual;
+      - se a manual tiver mais lançamentos (campos "data") que os gerados,
+        ela é a anotação completa e vale inteira;
+      - senão valem os gerados, e só os campos manuais com bbox real entram,
+        como correção dos campos gerados do mesmo rótulo que eles cobrem.
+    """
+    records = sum(1 for f in generated if f['label'] == 'data')
+    if not generated or sum(1 for f in manual if f['label'] == 'data') > records:
+        return list(manual)
+
+    merged = list(generated)
+    for field in manual:
+        bbox = field.get('bbox') or [0, 0, 0, 0]
+        if not any(bbox):
+            continue
+        merged = [
+            f for f in merged
+            if not (
+                f['label'] == field['label']
+                and f.get('page') == field.get('page', f.get('page'))
+                and _overlaps(f['bbox'], bbox)
+            )
+        ]
+        merged.append(field)
+    return merged
+
+
+def label_words(words, fields):
+    """
+    Atribui rótulos BIO às palavras da página procurando cada valor anotado,
+    em ordem, na sequência de palavras. Campos com bbox real (diferente de
+    [0,0,0,0]) são casados pela posição.
+    """
+    tags = ['O'] * len(words)
+    normalized = [_norm(w[0]) for w in words]
+    cursor = 0
+    for field in fields:
+        label = field['label'].upper()
+        if field['label'] not in FIELD_LABELS or not field['value'].strip():
+            continue
+
+        bbox = field.get('bbox') or [0, 0, 0, 0]
+        if any(bbox):
+            span = [
+                i for i, w in enumerate(words)
+                if bbox[0] <= (w[1] + w[3]) / 2 <= bbox[2] and bbox[1] <= (w[2] + w[4]) / 2 <= bbox[3]
+            ]
+        else:
+            span = _find_span(normalized, _norm(field['value']).split(), cursor)
+            if span is None:
+                span = _find_span(normalized, _norm(field['value']).split(), 0)
+            if span is None:
+                continue
+            cursor = span[-1] + 1
+
+        for n, i in enumerate(span):
+            if tags[i] == 'O':
+                tags[i] = f"{'B' if n == 0 else 'I'}-{label}"
+    return tags
+
+
+def _find_span(normalized, target, start):
+    if not target:
+        return None
+    n = len(target)
+    for i in range(start, len(normalized) - n + 1):
+        if normalized[i:i + n] == target:
+            return list(range(i, i + n))
+    return None
+
+
+def encode_document(processor, pdf_path, fields, max_length, stride):
+    """
+    Tokeniza todas as páginas do PDF; retorna dict de arrays numpy com uma
+    linha por janela de max_length tokens.
+    """
+    rows = {name: [] for name in ARRAYS}
+    for page in extract_pages(pdf_path, render_dpi=72):
+        if not page['words']:
+            continue
+        words = [w[0] for w in page['words']]
+        boxes = [normalize_box(w[1:], page['width'], page['height']) for w in page['words']]
+        # Campos gerados por build_annotations.py dizem a página; os manuais não
+        page_fields = [f for f in fields if f.get('page', page['page']) == page['page']]
+        tags = [LABEL2ID[t] for t in label_words(page['words'], page_fields)]
+
+        encoding = processor(
+            page['image'],
+            words,
+            boxes=boxes,
+            word_labels=tags,
+            truncation=True,
+            padding='max_length',
+            max_length=max_length,
+            stride=stride,
+            return_overflowing_tokens=True,
+            return_offsets_mapping=True,
+            return_tensors='np',
+        )
+        windows = len(encoding['input_ids'])
+        for name in ('input_ids', 'attention_mask', 'bbox', 'labels'):
+            rows[name].extend(encoding[name][i] for i in range(windows))
+        pixel_values = np.asarray(encoding['pixel_values'])
+        if len(pixel_values) != windows:
+            pixel_values = pixel_values[encoding['overflow_to_sample_mapping']]
+        rows['pixel_values'].extend(pixel_values.astype(np.float16))
+
+    if not rows['input_ids']:
+        return None
+    arrays = {name: np.stack(values) for name, values in rows.items()}
+    arrays['input_ids'] = arrays['input_ids'].astype(np.int32)
+    arrays['attention_mask'] = arrays['attention_mask'].astype(np.int8)
+    arrays['bbox'] = arrays['bbox'].astype(np.int16)
+    arrays['labels'] = arrays['labels'].astype(np.int16)
+    arrays['lengths'] = arrays['attention_mask'].sum(axis=1).astype(np.int32)
+    return arrays
+
+
+def _write_entry(entry_dir, arrays):
+    tmp_dir = entry_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def build_dataset(pdf_dir, annotations_dir, cache_dir, model_name, processor=None, max_length=512, stride=128):
+    """
+    Atualiza o cache e retorna o manifest {file_name: {"key", "samples"}}.
+    O processor só é carregado se algum documento precisar ser (re)processado.
+    """
+    key_dir = os.path.join(cache_dir, processor_key(model_name, max_length, stride))
+    os.makedirs(key_dir, exist_ok=True)
+    manifest_path = os.path.join(key_dir, 'manifest.json')
+    old_manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old_manifest = json.load(f)
+
+    manifest = {}
+    reprocessed = 0
+    for file_name, fields in load_annotations(annotations_dir).items():
+        pdf_path = os.path.join(pdf_dir, file_name)
+        if not os.path.exists(pdf_path):
+            continue
+        fields_hash = hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+        doc_key = hashlib.sha256((file_sha256(pdf_path) + fields_hash).encode()).hexdigest()[:24]
+        entry_dir = os.path.join(key_dir, doc_key)
+
+        cached = old_manifest.get(file_name)
+        if cached and cached['key'] == doc_key and os.path.isdir(entry_dir):
+            manifest[file_name] = cached
+            continue
+
+        if processor is None:
+            from transformers import LayoutLMv3Processor
+            processor = LayoutLMv3Processor.from_pretrained(model_name, apply_ocr=False)
+
+        arrays = encode_document(processor, pdf_path, fields, max_length, stride)
+        if arrays is None:
+            print(f'Sem texto extraível, ignorando: {file_name}')
+            continue
+        _write_entry(entry_dir, arrays)
+        manifest[file_name] = {'key': doc_key, 'samples': int(len(arrays['input_ids']))}
+        reprocessed += 1
+        print(f'Processado: {file_name} ({len(arrays["input_ids"])} janelas)')
+
+    # Remove entradas de documentos apagados ou alterados
+    live = {entry['key'] for entry in manifest.values()}
+    for name in os.listdir(key_dir):
+        if name != 'manifest.json' and name not in live:
+            shutil.rmtree(os.path.join(key_dir, name), ignore_errors=True)
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    print(f'Cache em {key_dir}: {len(manifest)} documentos, {reprocessed} reprocessados')
+    return key_dir, manifest
+
+
+class CachedExtratoDataset:
+    """
+    Dataset (compatível com torch.utils.data.Dataset) que lê os tensores
+    direto dos .npy em memory-map, sem re-tokenizar. Cada item é cortado no
+    seu comprimento real; o padding é feito por lote no PaddingCollator.
+    """
+
+    def __init__(self, key_dir, entries):
+        self.arrays = []
+        self.index = []
+        lengths = []
+        for entry in entries:
+            entry_dir = os.path.join(key_dir, entry['key'])
+            arrays = {
+                name: np.load(os.path.join(entry_dir, f'{name}.npy'), mmap_mode='r')
+                for name in ARRAYS + ('lengths',)
+            }
+            self.index.extend((len(self.arrays), row) for row in range(len(arrays['input_ids'])))
+            lengths.extend(int(n) for n in arrays['lengths'])
+            self.arrays.append(arrays)
+        # Usado pelo LengthGroupedSampler sem precisar ler cada item
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        import torch
+
+        doc, row = self.index[i]
+        arrays = self.arrays[doc]
+        n = self.lengths[i]
+        return {
+            'input_ids': torch.from_numpy(arrays['input_ids'][row, :n].astype(np.int64)),
+            'attention_mask': torch.from_numpy(arrays['attention_mask'][row, :n].astype(np.int64)),
+            'bbox': torch.from_numpy(arrays['bbox'][row, :n].astype(np.int64)),
+            'labels': torch.from_numpy(arrays['labels'][row, :n].astype(np.int64)),
+            'pixel_values': torch.from_numpy(arrays['pixel_values'][row].astype(np.float32)),
+        }
+
+
+class PaddingCollator:
+    """
+    Padding dinâmico: completa cada lote só até o maior item dele
+    (arredondado para múltiplo de pad_to_multiple_of).
+    """
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        import torch
+
+        longest = max(len(f['input_ids']) for f in features)
+        if self.pad_to_multiple_of:
+            longest = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch = {
+            'input_ids': torch.full((len(features), longest), self.pad_token_id, dtype=torch.long),
+            'attention_mask': torch.zeros((len(features), longest), dtype=torch.long),
+            'bbox': torch.zeros((len(features), longest, 4), dtype=torch.long),
+            'labels': torch.full((len(features), longest), -100, dtype=torch.long),
+        }
+        for i, f in enumerate(features):
+            n = len(f['input_ids'])
+            for name in ('input_ids', 'attention_mask', 'bbox', 'labels'):
+                batch[name][i, :n] = f[name]
+        batch['pixel_values'] = torch.stack([f['pixel_values'] for f in features])
+        return batch
+
+
+def train_test_split(key_dir, manifest, test_fraction=0.2):
+    """
+    Divisão determinística por hash do documento: um documento nunca muda
+    de lado entre execuções enquanto não for alterado.
+    """
+    entries = sorted(manifest.values(), key=lambda e: e['key'])
+    buckets = max(2, round(1 / test_fraction))
+    test = [e for e in entries if int(e['key'][:8], 16) % buckets == 0]
+    train = [e for e in entries if int(e['key'][:8], 16) % buckets != 0]
+    if not test and len(train) > 1:
+        test = [train.pop()]
+    if not train and len(test) > 1:
+        train = [test.pop()]
+    return CachedExtratoDataset(key_dir, train), CachedExtratoDataset(key_dir, test)
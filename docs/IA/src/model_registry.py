@@ -0,0 +1,319 @@
+# Registro local de modelos, endereçado por conteúdo e verificado por sha256
+#
+# Substitui os antigos download_models*.py. Os arquivos dos modelos ficam
+# num store compartilhado, um blob por conteúdo:
+#
+#   models/store/blobs/<sha256[:2]>/<sha256>           conteúdo
+#   models/store/snapshots/<nome>/<revisão>/<arquivo>   links para os blobs
+#
+# e o manifest versionado no git (models/manifest.json) fixa, para cada
+# modelo, a revisão e a lista de arquivos com sha256 e tamanho. Arquivos
+# iguais em modelos diferentes (tokenizers, configs) ocupam um único blob, e
+# vários containers podem montar o mesmo store (volume) sem duplicar nada:
+# toda escrita é feita num arquivo temporário e publicada com os.replace.
+#
+# resolve(nome) devolve o diretório do snapshot, pronto para
+# from_pretrained(), verificando os blobs em paralelo. Com
+# AI_MODELS_OFFLINE=1 (ou HF_HUB_OFFLINE=1) nada é baixado: um blob
+# ausente ou corrompido é erro.
+#
+# Uso:
+#   python src/model_registry.py list
+#   python src/model_registry.py fetch [nome ...]       # baixa do HuggingFace o que faltar
+#   python src/model_registry.py add <nome> <dir> [revisão]
+#   python src/model_registry.py verify [nome ...]
+#   python src/model_registry.py gc                      # apaga blobs sem referência
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+STORE_DIR = os.getenv('AI_MODEL_STORE', './models/store/')
+MANIFEST_PATH = os.getenv('AI_MODEL_MANIFEST', './models/manifest.json')
+VERIFY_WORKERS = int(os.getenv('AI_MODEL_VERIFY_WORKERS', min(8, os.cpu_count() or 1)))
+CHUNK = 1 << 22
+
+# Modelos baixados por padrão (antes em download_models.py)
+DEFAULT_MODELS = ['microsoft/layoutlmv3-base']
+
+
+class ModelNotAvailable(RuntimeError):
+    pass
+
+
+class ChecksumMismatch(RuntimeError):
+    pass
+
+
+def offline():
+    return any(os.getenv(var, '').lower() in ('1', 'true', 'yes') for var in ('AI_MODELS_OFFLINE', 'HF_HUB_OFFLINE'))
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, store_dir=STORE_DIR, manifest_path=MANIFEST_PATH):
+        self.store_dir = store_dir
+        self.manifest_path = manifest_path
+        self._verified = set()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Manifest
+    # ------------------------------------------------------------------
+
+    def manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['models']
+
+    def _save_manifest(self, models):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'models': dict(sorted(models.items()))}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        os.replace(tmp, self.manifest_path)
+
+    def entry(self, name):
+        models = self.manifest()
+        if name not in models:
+            raise ModelNotAvailable(f'Modelo não registrado no manifest: {name}')
+        return models[name]
+
+    # ------------------------------------------------------------------
+    # Blobs
+    # ------------------------------------------------------------------
+
+    def blob_path(self, sha256):
+        return os.path.join(self.store_dir, 'blobs', sha256[:2], sha256)
+
+    def snapshot_dir(self, name, revision):
+        return os.path.join(self.store_dir, 'snapshots', name.replace('/', '--'), revision)
+
+    def put_blob(self, source_path):
+        """
+        Copia um arquivo para o store e retorna (sha256, tamanho). Se o blob
+        já existe (mesmo conteúdo em outro modelo/container), não copia.
+        """
+        sha256 = sha256_file(source_path)
+        target = self.blob_path(sha256)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+            os.close(fd)
+            shutil.copyfile(source_path, tmp)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, target)
+        return sha256, os.path.getsize(target)
+
+    def verify_blob(self, sha256, size):
+        """
+        Confere tamanho e sha256 de um blob. O hash de cada blob é calculado
+        uma vez por processo; um blob corrompido é apagado para ser baixado
+        de novo.
+        """
+        if sha256 in self._verified:
+            return
+        path = self.blob_path(sha256)
+        if not os.path.exists(path):
+            raise ModelNotAvailable(f'Blob ausente no store: {sha256}')
+        if os.path.getsize(path) != size or sha256_file(path) != sha256:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # store montado só para leitura
+            raise ChecksumMismatch(f'Blob corrompido: {sha256}')
+        with self._lock:
+            self._verified.add(sha256)
+
+    def verify(self, name, workers=VERIFY_WORKERS):
+        files = self.entry(name)['files']
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # hashlib libera o GIL em blocos grandes: os hashes rodam em paralelo
+            list(pool.map(lambda f: self.verify_blob(f['sha256'], f['size']), files))
+
+    # ------------------------------------------------------------------
+    # Registro e resolução
+    # ------------------------------------------------------------------
+
+    def add(self, name, source_dir, revision=None, source=None):
+        """
+        Registra um diretório local (modelo treinado, export ONNX, snapshot
+        baixado) no store e no manifest. A revisão padrão é o hash do
+        conteúdo, então registrar de novo o mesmo diretório não muda nada.
+        """
+        files = []
+        for root, _, names in os.walk(source_dir):
+            for file_name in sorted(names):
+                path = os.path.join(root, file_name)
+                relative = os.path.relpath(path, source_dir).replace(os.sep, '/')
+                if any(part.startswith('.') for part in relative.split('/')):
+                    continue
+                sha256, size = self.put_blob(path)
+                files.append({'path': relative, 'sha256': sha256, 'size': size})
+        files.sort(key=lambda f: f['path'])
+        if not files:
+            raise ModelNotAvailable(f'Nenhum arquivo em {source_dir}')
+
+        if revision is None:
+            digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+            revision = digest[:12]
+        models = self.manifest()
+        models[name] = {'revision': revision, 'source': source or 'local', 'files': files}
+        self._save_manifest(models)
+        return models[name]
+
+    def fetch(self, name, revision=None):
+        """
+        Baixa do HuggingFace Hub um modelo ainda não presente no store. Se
+        já está no manifest, baixa exatamente a revisão fixada (e só se
+        algum blob faltar) e exige que os hashes batam.
+        """
+        if offline():
+            raise ModelNotAvailable(f'Modo offline: {name} não pode ser baixado')
+        from huggingface_hub import HfApi, snapshot_download
+
+        pinned = self.manifest().get(name)
+        if pinned:
+            try:
+                self.verify(name)
+                return pinned
+            except (ModelNotAvailable, ChecksumMismatch):
+                pass
+            revision = pinned['revision']
+        info = HfApi().model_info(name, revision=revision)
+        os.makedirs(self.store_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.store_dir, prefix='.download-') as tmp:
+            snapshot_download(name, revision=info.sha, local_dir=tmp)
+            if pinned:
+                for f in pinned['files']:
+                    path = os.path.join(tmp, f['path'])
+                    if not os.path.exists(path) or sha256_file(path) != f['sha256']:
+                        raise ChecksumMismatch(f'{name}@{info.sha}: {f["path"]} não bate com o manifest')
+                    self.put_blob(path)
+                return pinned
+            return self.add(name, tmp, revision=info.sha, source='huggingface')
+
+    def resolve(self, name):
+        """
+        Diretório local do modelo (snapshot com links para os blobs).
+        Blobs ausentes são baixados, a menos que o modo offline esteja ativo.
+        """
+        entry = self.entry(name)
+        snapshot = self.snapshot_dir(name, entry['revision'])
+        try:
+            self.verify(name)
+        except (ModelNotAvailable, ChecksumMismatch):
+            if offline():
+                raise
+            self.fetch(name)
+            self.verify(name)
+            # Hardlinks do snapshot antigo ainda apontam para o blob corrompido
+            shutil.rmtree(snapshot, ignore_errors=True)
+
+        if not os.path.exists(os.path.join(snapshot, '.complete')):
+            tmp = snapshot + f'.tmp-{os.getpid()}'
+            shutil.rmtree(tmp, ignore_errors=True)
+            for f in entry['files']:
+                target = os.path.join(tmp, f['path'])
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                _link(self.blob_path(f['sha256']), target)
+            open(os.path.join(tmp, '.complete'), 'w').close()
+            try:
+                os.rename(tmp, snapshot)
+            except OSError:
+                # Outro processo/container publicou o mesmo snapshot primeiro
+                shutil.rmtree(tmp, ignore_errors=True)
+        return snapshot
+
+    def resolve_many(self, names, workers=VERIFY_WORKERS):
+        """
+        Resolve vários modelos em paralelo; retorna {nome: diretório}.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(names, pool.map(self.resolve, names)))
+
+    def gc(self):
+        """
+        Apaga blobs e snapshots que o manifest não referencia mais.
+        """
+        models = self.manifest()
+        live = {f['sha256'] for entry in models.values() for f in entry['files']}
+        removed = 0
+        blobs_dir = os.path.join(self.store_dir, 'blobs')
+        for root, _, names in os.walk(blobs_dir):
+            for blob in names:
+                if blob not in live:
+                    os.remove(os.path.join(root, blob))
+                    removed += 1
+        live_snapshots = {os.path.normpath(self.snapshot_dir(n, e['revision'])) for n, e in models.items()}
+        snapshots_dir = os.path.join(self.store_dir, 'snapshots')
+        if os.path.isdir(snapshots_dir):
+            for model_dir in os.listdir(snapshots_dir):
+                for revision in os.listdir(os.path.join(snapshots_dir, model_dir)):
+                    path = os.path.normpath(os.path.join(snapshots_dir, model_dir, revision))
+                    if path not in live_snapshots:
+                        shutil.rmtree(path, ignore_errors=True)
+        return removed
+
+
+def _link(blob, target):
+    # Hardlink quando o store está no mesmo sistema de arquivos; senão symlink
+    try:
+        os.link(blob, target)
+    except OSError:
+        os.symlink(os.path.abspath(blob), target)
+
+
+registry = ModelRegistry()
+
+
+def resolve(name):
+    """
+    Diretório do modelo se ele estiver no manifest; senão devolve o próprio
+    nome, para o from_pretrained() seguir o caminho normal do HuggingFace.
+    No modo offline um modelo fora do manifest é erro: o HuggingFace não
+    pode ser consultado.
+    """
+    if name in registry.manifest():
+        return registry.resolve(name)
+    if offline():
+        raise ModelNotAvailable(f'Modo offline: {name} não está no manifest')
+    return name
+
+
+if __name__ == "__main__":
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ('list', [])
+    if command == 'list':
+        for name, entry in registry.manifest().items():
+            size = sum(f['size'] for f in entry['files'])
+            print(f"{name:<45} {entry['revision'][:12]:<14} {len(entry['files']):>4} arquivos {size / 1e6:>10.1f} MB")
+    elif command == 'fetch':
+        names = args or list(registry.manifest()) or DEFAULT_MODELS
+        for name in names:
+            print(f'Baixando modelo: {name}')
+            registry.fetch(name)
+        registry.resolve_many(names)
+    elif command == 'add':
+        entry = registry.add(args[0], args[1], revision=args[2] if len(args) > 2 else None)
+        print(f"{args[0]} registrado na revisão {entry['revision']} ({len(entry['files'])} arquivos)")
+    elif command == 'verify':
+        for name, path in registry.resolve_many(args or list(registry.manifest())).items():
+            print(f'OK {name} -> {path}')
+    elif command == 'gc':
+        print(f'{registry.gc()} blobs removidos')
+    else:
+        sys.exit(f'Comando desconhecido: {command}')
@@ -0,0 +1,52 @@
+# Extração de palavras e posições da camada de texto dos PDFs
+# Usa PyMuPDF: lê as coordenadas reais de cada palavra (sem OCR) e,
+# opcionalmente, renderiza a página como imagem para o LayoutLMv3
+
+import pymupdf
+
+
+def extract_pages(pdf_path, render_dpi=None):
+    """
+    Retorna uma lista de páginas no formato:
+        {"page": n, "width": w, "height": h,
+         "words": [(texto, x0, y0, x1, y1), ...],
+         "image": PIL.Image ou None}
+    As coordenadas estão em pontos do PDF (origem no canto superior esquerdo).
+    """
+    pages = []
+    with pymupdf.open(pdf_path) as doc:
+        for page in doc:
+            words = [
+                (w[4], w[0], w[1], w[2], w[3])
+                for w in page.get_text('words', sort=True)
+                if w[4].strip()
+            ]
+            image = render_page(page, render_dpi) if render_dpi else None
+            pages.append({
+                "page": page.number,
+                "width": page.rect.width,
+                "height": page.rect.height,
+                "words": words,
+                "image": image,
+            })
+    return pages
+
+
+def render_page(page, dpi):
+    from PIL import Image
+
+    pix = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csRGB, alpha=False)
+    return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+
+def normalize_box(box, width, height):
+    """
+    Converte (x0, y0, x1, y1) em pontos para a escala 0-1000 usada pelo LayoutLM.
+    """
+    x0, y0, x1, y1 = box
+    return [
+        max(0, min(1000, int(1000 * x0 / width))),
+        max(0, min(1000, int(1000 * y0 / height))),
+        max(0, min(1000, int(1000 * x1 / width))),
+        max(0, min(1000, int(1000 * y1 / height))),
+    ]
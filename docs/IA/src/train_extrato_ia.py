@@ -1,80 +1,179 @@
 # Script de treinamento para extração de informações de extratos bancários
 # Utiliza LayoutLMv3 (HuggingFace) e detecta GPU automaticamente
 # Salva checkpoints e permite retomar de onde parou
-# Treina até atingir performance mínima ou limite de epochs
+# Treina até atingir performance mínima ou até o F1 parar de melhorar
+# Os dados vêm de datasets/pdf + datasets/annotations, pré-processados uma
+# única vez e lidos do cache em disco (ver extrato_dataset.py)
+#
+# Otimizado para máquinas só com CPU: uma única chamada a trainer.train(),
+# padding dinâmico com lotes agrupados por comprimento, acumulação de
+# gradiente, DataLoader com vários workers e número de threads ajustado.
 
 import os
+import time
+
+import numpy as np
 import torch
-from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor, Trainer, TrainingArguments
-from datasets import load_dataset, DatasetDict
-from pathlib import Path
+from seqeval.metrics import f1_score, precision_score, recall_score
+from transformers import (
+    EarlyStoppingCallback,
+    LayoutLMv3ForTokenClassification,
+    LayoutLMv3Processor,
+    Trainer,
+    TrainerCallback,
+    TrainingArguments,
+)
+from transformers.trainer_pt_utils import LengthGroupedSampler
+from transformers.trainer_utils import get_last_checkpoint
+
+from extrato_dataset import LABELS, ID2LABEL, LABEL2ID, PaddingCollator, build_dataset, train_test_split
+from model_registry import resolve
 
 # Configurações
 DATASET_DIR = './datasets/pdf/'
 ANNOTATIONS_DIR = './datasets/annotations/'
+CACHE_DIR = './datasets/cache/'
 MODEL_DIR = './models/layoutlmv3-checkpoints/'
 MIN_F1 = 0.90  # performance mínima para parar
 MAX_EPOCHS = 20
 BATCH_SIZE = 2
+GRADIENT_ACCUMULATION = int(os.getenv('GRADIENT_ACCUMULATION', 8))  # lote efetivo = 16
+EARLY_STOPPING_PATIENCE = 3  # epochs sem melhora no F1
+DATALOADER_WORKERS = int(os.getenv('DATALOADER_WORKERS', min(4, max(1, (os.cpu_count() or 1) // 4))))
+TORCH_THREADS = int(os.getenv('TORCH_THREADS', max(1, (os.cpu_count() or 1) - DATALOADER_WORKERS)))
 
 # Detecta GPU
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 print(f'Usando dispositivo: {device}')
 
-# Baixa modelo pré-treinado
-model_name = 'microsoft/layoutlmv3-base'
-processor = LayoutLMv3Processor.from_pretrained(model_name)
-model = LayoutLMv3ForTokenClassification.from_pretrained(model_name, num_labels=5)  # Ajuste o num_labels conforme suas classes
+if device == 'cpu':
+    # Threads de intra-op para as operações da rede; os workers do DataLoader
+    # ficam com os núcleos restantes
+    torch.set_num_threads(TORCH_THREADS)
+    torch.set_num_interop_threads(1)
+    print(f'Threads: {TORCH_THREADS} (torch) + {DATALOADER_WORKERS} (DataLoader)')
+
+# Modelo pré-treinado: vem do store local quando está no manifest
+# (models/manifest.json, ver model_registry.py), senão do HuggingFace
+model_name = resolve('microsoft/layoutlmv3-base')
+processor = LayoutLMv3Processor.from_pretrained(model_name, apply_ocr=False)
+model = LayoutLMv3ForTokenClassification.from_pretrained(
+    model_name,
+    num_labels=len(LABELS),
+    id2label=ID2LABEL,
+    label2id=LABEL2ID,
+)
 model.to(device)
 
-# Carrega dataset anotado (exemplo: HuggingFace Datasets ou custom)
-def load_custom_dataset():
-    # Aqui você pode adaptar para ler seus PDFs/textos e anotações
-    # Exemplo: usar datasets.load_dataset ou criar DatasetDict manualmente
-    # Para protótipo, use um dataset público ou crie um mock
-    return load_dataset('nielsr/funsd')  # FUNSD é para formulários, mas serve de exemplo
+# Carrega o dataset anotado a partir do cache (só reprocessa PDFs novos/alterados)
+key_dir, manifest = build_dataset(DATASET_DIR, ANNOTATIONS_DIR, CACHE_DIR, model_name, processor=processor)
+train_dataset, eval_dataset = train_test_split(key_dir, manifest)
+print(f'Amostras de treino: {len(train_dataset)} | avaliação: {len(eval_dataset)}')
+
+
+def compute_metrics(eval_pred):
+    """
+    F1/precisão/recall por entidade (seqeval), ignorando tokens -100.
+    """
+    logits, labels = eval_pred
+    predictions = np.argmax(logits, axis=-1)
+    true_tags, pred_tags = [], []
+    for pred_row, label_row in zip(predictions, labels):
+        mask = label_row != -100
+        true_tags.append([ID2LABEL[int(i)] for i in label_row[mask]])
+        pred_tags.append([ID2LABEL[int(i)] for i in pred_row[:len(label_row)][mask]])
+    return {
+        'precision': precision_score(true_tags, pred_tags, zero_division=0),
+        'recall': recall_score(true_tags, pred_tags, zero_division=0),
+        'f1': f1_score(true_tags, pred_tags, zero_division=0),
+    }
+
+
+class LengthGroupedTrainer(Trainer):
+    """
+    Agrupa amostras de comprimento parecido no mesmo lote usando os
+    comprimentos já salvos no cache (sem ler cada item do disco).
+    """
+
+    def _get_train_sampler(self, *args, **kwargs):
+        return LengthGroupedSampler(
+            self.args.train_batch_size * self.args.gradient_accumulation_steps,
+            lengths=self.train_dataset.lengths,
+        )
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Registra o tempo de cada epoch e as amostras/segundo.
+    """
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        elapsed = time.perf_counter() - self.epoch_start
+        samples = len(train_dataset)
+        print(f'Epoch {state.epoch:.0f}: {elapsed:.1f}s, {samples / elapsed:.2f} amostras/s')
+
+
+class MinF1Callback(TrainerCallback):
+    """
+    Para o treino assim que o F1 de avaliação atinge MIN_F1.
+    """
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        f1 = (metrics or {}).get('eval_f1', 0)
+        print(f'Epoch {state.epoch:.0f} - F1: {f1:.4f}')
+        if f1 >= MIN_F1:
+            print('Performance mínima atingida, parando treinamento.')
+            control.should_training_stop = True
 
-dataset = load_custom_dataset()
 
 # Argumentos de treino
 training_args = TrainingArguments(
     output_dir=MODEL_DIR,
     per_device_train_batch_size=BATCH_SIZE,
     per_device_eval_batch_size=BATCH_SIZE,
+    gradient_accumulation_steps=GRADIENT_ACCUMULATION,
     num_train_epochs=MAX_EPOCHS,
-    evaluation_strategy='epoch',
+    eval_strategy='epoch',
     save_strategy='epoch',
     load_best_model_at_end=True,
+    metric_for_best_model='f1',
+    greater_is_better=True,
     save_total_limit=3,
-    logging_dir='./logs',
     logging_steps=10,
+    report_to='none',
     fp16=torch.cuda.is_available(),
-    resume_from_checkpoint=True if os.path.exists(MODEL_DIR) else False,
+    use_cpu=device == 'cpu',
+    dataloader_num_workers=DATALOADER_WORKERS,
+    dataloader_persistent_workers=DATALOADER_WORKERS > 0,
+    remove_unused_columns=False,
 )
 
 # Trainer
-trainer = Trainer(
+trainer = LengthGroupedTrainer(
     model=model,
     args=training_args,
-    train_dataset=dataset['train'],
-    eval_dataset=dataset['test'],
-    tokenizer=processor,
+    train_dataset=train_dataset,
+    eval_dataset=eval_dataset,
+    data_collator=PaddingCollator(processor.tokenizer.pad_token_id),
+    compute_metrics=compute_metrics,
+    callbacks=[
+        EarlyStoppingCallback(early_stopping_patience=EARLY_STOPPING_PATIENCE),
+        MinF1Callback(),
+        ThroughputCallback(),
+    ],
 )
 
-# Loop de treino com autoavaliação
-best_f1 = 0
-for epoch in range(MAX_EPOCHS):
-    print(f'Iniciando epoch {epoch+1}/{MAX_EPOCHS}')
-    trainer.train(resume_from_checkpoint=True)
-    metrics = trainer.evaluate()
-    f1 = metrics.get('eval_f1', 0)
-    print(f'Epoch {epoch+1} - F1: {f1}')
-    if f1 > best_f1:
-        best_f1 = f1
-    if f1 >= MIN_F1:
-        print('Performance mínima atingida, parando treinamento.')
-        break
-    # Salva checkpoint
-    trainer.save_model(os.path.join(MODEL_DIR, f'checkpoint-epoch{epoch+1}'))
-
-print('Treinamento finalizado. Melhor F1:', best_f1)
+# Um único treino; retoma do último checkpoint se existir
+last_checkpoint = get_last_checkpoint(MODEL_DIR) if os.path.isdir(MODEL_DIR) else None
+if last_checkpoint:
+    print(f'Retomando de {last_checkpoint}')
+result = trainer.train(resume_from_checkpoint=last_checkpoint)
+print(f"Treino: {result.metrics['train_runtime']:.1f}s, "
+      f"{result.metrics['train_samples_per_second']:.2f} amostras/s")
+
+trainer.save_model(os.path.join(MODEL_DIR, 'best'))
+processor.save_pretrained(os.path.join(MODEL_DIR, 'best'))
+print('Treinamento finalizado. Melhor F1:', trainer.state.best_metric)
@@ -0,0 +1,12 @@
+"""
+The services keep their state in the SQLite file named by AI_LEDGER_PATH,
+opened when services/storage.py is imported: point it at a throwaway
+directory before any test module imports a service, so the suite never
+touches api/data/.
+"""
+
+import os
+import tempfile
+
+_store = tempfile.TemporaryDirectory(prefix="ai-ledger-")
+os.environ["AI_LEDGER_PATH"] = os.path.join(_store.name, "ledger.sqlite3")
@@ -0,0 +1,145 @@
+"""
+Admission control: a user's token bucket turns a burst into 429 with
+Retry-After, the fair queue lets another user's request overtake a
+backlog, and a request that is refused or gives up in the queue gets its
+tokens back and does not push back the user's next turn. The limits are
+one worker's share of the server's.
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from services import admission
+from services.admission import AdmissionController
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def tokens(controller, user_id):
+    return controller.buckets[user_id].tokens
+
+
+def test_bucket_refuses_a_burst_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(capacity=100, user_rate=1, user_burst=3)
+        for _ in range(3):
+            async with controller.admit("u1", 1):
+                pass
+        with pytest.raises(HTTPException) as refused:
+            await controller.acquire("u1", 1)
+        async with controller.admit("u2", 1):  # other users keep their own bucket
+            pass
+        return controller, refused.value
+
+    controller, refused = run(scenario())
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "1"
+    assert controller.rejected["rate_limited"] == 1
+
+
+def test_request_larger_than_the_burst_still_runs():
+    async def scenario():
+        controller = AdmissionController(capacity=100, user_rate=1, user_burst=3)
+        async with controller.admit("u1", 50):
+            return tokens(controller, "u1")
+
+    assert run(scenario()) == 0
+
+
+def test_fair_queue_lets_another_user_overtake_a_backlog():
+    async def scenario():
+        controller = AdmissionController(capacity=1, user_rate=100, user_burst=100, max_wait=10)
+        order = []
+
+        async def job(user_id, name):
+            async with controller.admit(user_id, 1):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await controller.acquire("heavy", 1)  # holds the only slot
+        tasks = [asyncio.create_task(job("heavy", f"heavy-{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("light", "light")))
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 4
+        controller.release(1)
+        await asyncio.gather(*tasks)
+        return order, controller
+
+    order, controller = run(scenario())
+    assert order == ["light", "heavy-0", "heavy-1", "heavy-2"]
+    assert controller.in_use == 0 and controller.stats()["queued"] == 0
+
+
+def test_overload_is_refused_up_front_and_refunded():
+    async def scenario():
+        controller = AdmissionController(capacity=1, user_rate=1, user_burst=10, max_wait=0.5)
+        await controller.acquire("u1", 1)
+        queued = asyncio.create_task(controller.acquire("u2", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as refused:
+            await controller.acquire("u3", 1)  # u2's turn alone is estimated at 1 s
+        left, finish = tokens(controller, "u3"), controller.last_finish.get("u3")
+        controller.release(1)
+        await queued
+        controller.release(1)
+        return controller, refused.value, left, finish
+
+    controller, refused, left, finish = run(scenario())
+    assert refused.status_code == 503
+    assert int(refused.headers["Retry-After"]) >= 1
+    assert left == 10 and finish is None
+    assert controller.rejected["overloaded"] == 1
+
+
+def test_timed_out_request_is_refunded_and_forgotten():
+    async def scenario():
+        controller = AdmissionController(capacity=1, user_rate=1, user_burst=10, max_wait=0.05)
+        await controller.acquire("u1", 1)
+        with pytest.raises(HTTPException) as refused:
+            await controller.acquire("u2", 2)
+        controller.release(1)
+        return controller, refused.value
+
+    controller, refused = run(scenario())
+    assert refused.status_code == 503
+    assert tokens(controller, "u2") == 10
+    assert "u2" not in controller.last_finish
+    assert controller.in_use == 0
+
+
+def test_cancelled_waiter_gives_its_turn_back():
+    async def scenario():
+        controller = AdmissionController(capacity=1, user_rate=100, user_burst=100, max_wait=10)
+        await controller.acquire("u1", 1)
+        waiter = asyncio.create_task(controller.acquire("u2", 1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.release(1)
+        return controller
+
+    controller = run(scenario())
+    assert "u2" not in controller.last_finish
+    assert controller.in_use == 0
+
+
+def test_limits_are_split_among_workers(monkeypatch):
+    monkeypatch.setenv("AI_ADMISSION_CAPACITY", "16")
+    monkeypatch.setenv("AI_ADMISSION_USER_RATE", "4")
+    monkeypatch.setenv("AI_ADMISSION_USER_BURST", "40")
+    monkeypatch.setenv("AI_API_WORKERS", "2")
+
+    controller = admission.build_controller(4)
+    assert (controller.capacity, controller.user_rate, controller.user_burst) == (4, 1, 10)
+    controller = admission.build_controller()
+    assert (controller.capacity, controller.user_rate, controller.user_burst) == (8, 2, 20)
+
+    monkeypatch.setattr(admission, "controller", admission.controller)
+    admission.configure(8)
+    assert admission.controller.capacity == 2
@@ -0,0 +1,87 @@
+"""
+Streaming anomaly baselines: the running mean, deviation and P² 95th
+percentile follow the exact values over the same stream, debits and
+credits never share a baseline, and a baseline rebuilt from the ledger is
+the one the stream would have built.
+"""
+
+import numpy as np
+import pytest
+
+from services import storage
+from services.anomaly import AnomalyDetector
+
+
+@pytest.fixture
+def detector(tmp_path):
+    return AnomalyDetector(storage.Database(str(tmp_path / "state.sqlite3")), z_threshold=3.0, min_samples=8)
+
+
+@pytest.mark.parametrize("draw", [
+    lambda rng, size: rng.uniform(10, 200, size),
+    lambda rng, size: rng.lognormal(4, 0.8, size),
+    lambda rng, size: np.sort(rng.uniform(10, 200, size)),  # ascending, the worst order for the markers
+])
+def test_p2_sketch_tracks_the_95th_percentile(detector, draw):
+    amounts = draw(np.random.default_rng(7), 5000)
+    detector.observe("u1", (("Alimentação", -amount) for amount in amounts))
+
+    debit = detector.summary("u1", "Alimentação")["debit"]
+    assert debit["count"] == len(amounts)
+    assert debit["mean"] == pytest.approx(amounts.mean(), abs=0.01)
+    assert debit["std"] == pytest.approx(amounts.std(ddof=1), abs=0.01)
+    assert debit["p95"] == pytest.approx(np.percentile(amounts, 95), rel=0.03)
+
+
+def test_p2_sketch_is_exact_on_a_few_samples(detector):
+    detector.observe("u1", [("Lazer", -30.0), ("Lazer", -10.0), ("Lazer", -20.0)])
+    assert detector.summary("u1", "Lazer")["debit"]["p95"] == 30.0
+
+
+def test_observed_in_batches_or_one_by_one_is_the_same(detector):
+    amounts = np.random.default_rng(3).lognormal(3, 1, 300)
+    detector.observe("batched", (("Transporte", -amount) for amount in amounts))
+    for start in range(0, len(amounts), 7):
+        detector.observe("stepwise", (("Transporte", -amount) for amount in amounts[start:start + 7]))
+    assert detector.summary("batched", "Transporte") == detector.summary("stepwise", "Transporte")
+
+
+def test_outliers_are_flagged_against_their_direction(detector):
+    rng = np.random.default_rng(11)
+    detector.observe("u1", (("Transporte", -amount) for amount in rng.normal(25, 5, 200)))
+    detector.observe("u1", [("Transporte", 400.0)] * 8)  # refunds: a baseline of their own
+
+    ordinary, outlier, refund = detector.score_many(
+        "u1", [("Transporte", -30.0), ("Transporte", -400.0), ("Transporte", 400.0)]
+    )
+    assert not ordinary["flagged"]
+    assert outlier["flagged"] and "95th percentile" in outlier["reason"]
+    assert not refund["flagged"]
+    assert detector.summary("u1", "Transporte")["credit"]["count"] == 8
+
+
+def test_nothing_is_scored_before_min_samples(detector):
+    detector.observe("u1", [("Moradia", -1500.0)] * 7)
+    assert detector.score("u1", "Moradia", -90000.0) == {"flagged": False, "score": 0.0, "reason": None}
+    assert detector.score("u1", "Saúde", -90000.0)["flagged"] is False
+
+
+def test_rebuild_matches_the_stream(detector):
+    items = [("Alimentação", -amount) for amount in np.random.default_rng(5).uniform(5, 80, 100)]
+    detector.observe("u1", items[:50])
+    detector.observe("u1", [("Alimentação", -999.0)])  # later deleted by the backend
+    detector.observe("u1", items[50:])
+    detector.observe("u2", items)
+
+    detector.rebuild("u1", items)
+    assert detector.summary("u1", "Alimentação") == detector.summary("u2", "Alimentação")
+
+
+def test_rolled_back_observation_leaves_no_baseline(detector):
+    with pytest.raises(RuntimeError):
+        with detector.db.write():
+            detector.observe("u1", [("Lazer", -10.0)] * 10)
+            raise RuntimeError("ledger batch failed")
+
+    assert detector.summary("u1", "Lazer") == {"credit": None, "debit": None}
+    assert detector.stats()["observed"] == 0
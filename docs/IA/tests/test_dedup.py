@@ -0,0 +1,88 @@
+"""
+Duplicate detection across imports: re-importing a statement flags every
+row exactly once per occurrence, a refund never matches the charge it
+reverses, near-duplicates need the same amount and digits, and rows synced
+from the ledger follow the backend's updates and deletes.
+"""
+
+import pytest
+
+from services import storage
+from services.dedup import FUZZY_CAP, DedupIndex
+
+STATEMENT = [
+    ("2025-03-05", -5.0, "Compra com Cartão 05/03 08:12 PADARIA PAO QUENTE"),
+    ("2025-03-05", -5.0, "Compra com Cartão 05/03 08:12 PADARIA PAO QUENTE"),  # a second, real coffee
+    ("2025-03-06", -120.0, "PIX ENVIADO JOAO SILVA"),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DedupIndex(storage.Database(str(tmp_path / "state.sqlite3")), fuzzy_days=1, fuzzy_threshold=0.6)
+
+
+def statuses(flags):
+    return [flag["status"] for flag in flags]
+
+
+def test_identical_rows_of_one_import_stay_distinct(index):
+    assert statuses(index.check("u1", STATEMENT)) == [None, None, None]
+
+    flags = index.check("u1", STATEMENT)
+    assert statuses(flags) == ["exact", "exact", "exact"]
+    assert flags[0] == {"status": "exact", "score": 1.0, "matched_date": "2025-03-05"}
+    # A third coffee on the same statement was not seen before
+    assert statuses(index.check("u1", STATEMENT[:1] * 3)) == ["exact", "exact", None]
+
+
+def test_dates_and_descriptions_are_normalized(index):
+    index.check("u1", STATEMENT[2:])
+    assert statuses(index.check("u1", [("06/03/2025", -120.0, "pix enviado  joão silva!")])) == ["exact"]
+
+
+def test_refund_does_not_match_the_charge(index):
+    index.check("u1", [("2025-03-06", -120.0, "ESTORNO LOJA CENTRO")])
+
+    assert statuses(index.check("u1", [("2025-03-06", 120.0, "ESTORNO LOJA CENTRO")])) == [None]
+    assert statuses(index.check("u1", [("2025-03-07", 120.0, "ESTORNO LOJA CENTRO")])) == [None]
+
+
+def test_reprinted_row_is_a_fuzzy_match(index):
+    index.check("u1", [("2025-03-05", -89.9, "COMPRA CARTAO SUPERMERCADO BOM PRECO")])
+
+    flags = index.check("u1", [("2025-03-05", -89.9, "Compra Cartão - Supermercado Bom Preço Ltda")], record=False)
+    assert statuses(flags) == ["fuzzy"]
+    assert 0.6 <= flags[0]["score"] <= FUZZY_CAP
+    # Same text, other amount: not the same transaction
+    assert statuses(index.check("u1", [("2025-03-05", -98.9, "COMPRA CARTAO SUPERMERCADO BOM PRECO LTDA")])) == [None]
+
+
+def test_digits_tell_look_alikes_apart(index):
+    index.check("u1", [("2025-03-05", -30.0, "PIX ENVIADO DOC 123456 MARIA")])
+
+    assert statuses(index.check("u1", [("2025-03-05", -30.0, "PIX ENVIADO DOC 654321 MARIA")], record=False)) == [None]
+    # The next day only a shared reference ties the rows
+    assert statuses(index.check("u1", [("2025-03-06", -30.0, "Pix enviado doc 123456 Maria S")], record=False)) == ["fuzzy"]
+    assert statuses(index.check("u1", [("2025-03-06", -30.0, "PIX ENVIADO MARIA")], record=False)) == [None]
+
+
+def test_check_without_record_leaves_the_index_alone(index):
+    index.check("u1", STATEMENT, record=False)
+    assert statuses(index.check("u1", STATEMENT)) == [None, None, None]
+    assert statuses(index.check("u2", STATEMENT)) == [None, None, None]
+
+
+def test_synced_rows_follow_updates_and_deletes(index):
+    index.check("u1", STATEMENT[2:])  # imported before the backend synced it
+    index.sync("u1", [("t1", "2025-03-06", -120.0, "PIX ENVIADO JOAO SILVA"), ("t2", "2025-03-07", -8.0, "CAFE")])
+    # The sync took over the imported entry instead of adding a second one
+    assert statuses(index.check("u1", STATEMENT[2:] * 2, record=False)) == ["exact", None]
+
+    index.sync("u1", [("t2", "2025-03-07", -9.0, "CAFE")], removed=["t1"])
+    assert statuses(index.check("u1", [
+        ("2025-03-06", -120.0, "PIX ENVIADO JOAO SILVA"),
+        ("2025-03-07", -8.0, "CAFE"),
+        ("2025-03-07", -9.0, "CAFE"),
+    ], record=False)) == [None, None, "exact"]
+    assert index.stats()["synced"] == 3
@@ -0,0 +1,79 @@
+"""
+The exported ONNX model must give the same logits as the PyTorch checkpoint
+it came from, on the inputs services/extractor.py actually builds.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("pymupdf")
+
+from transformers import LayoutLMv3ForTokenClassification
+
+import export_extrato_onnx
+from services import documents, extractor
+
+PDF_DIR = os.path.join(os.path.dirname(__file__), "..", "datasets", "pdf")
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    root = tmp_path_factory.mktemp("tiny")
+    checkpoint = export_extrato_onnx.build_tiny_checkpoint(str(root / "checkpoint"), pdf_dir=PDF_DIR)
+    export_extrato_onnx.export(checkpoint, str(root / "onnx"))
+    return checkpoint, str(root / "onnx")
+
+
+@pytest.fixture(scope="module")
+def pages():
+    path = sorted(f for f in os.listdir(PDF_DIR) if f.endswith(".pdf"))[0]
+    with open(os.path.join(PDF_DIR, path), "rb") as f:
+        return documents.pdf_pages(f.read(), documents.RENDER_DPI)
+
+
+def test_onnx_logits_match_torch(tiny_model, pages):
+    checkpoint, onnx_dir = tiny_model
+    model = LayoutLMv3ForTokenClassification.from_pretrained(checkpoint).eval()
+    engine = extractor.LayoutExtractor(onnx_dir, model_file="model.onnx")
+
+    windows = [w for index, page in enumerate(pages) for w in engine._windows(index, page)]
+    pixel_values = {index: engine._pixel_values(page.image) for index, page in enumerate(pages)}
+    assert windows
+
+    for window, onnx_logits in zip(windows, engine._run_batch(windows, pixel_values)):
+        page, ids, boxes, _ = window
+        with torch.no_grad():
+            torch_logits = model(
+                input_ids=torch.tensor([ids]),
+                bbox=torch.tensor([boxes]),
+                attention_mask=torch.ones((1, len(ids)), dtype=torch.long),
+                pixel_values=torch.from_numpy(pixel_values[page][None]),
+            ).logits[0].numpy()
+        np.testing.assert_allclose(onnx_logits, torch_logits, atol=1e-4, rtol=1e-3)
+
+
+def test_int8_labels_mostly_agree_with_fp32(tiny_model, pages):
+    _, onnx_dir = tiny_model
+    fp32 = extractor.LayoutExtractor(onnx_dir, model_file="model.onnx").predict(pages)
+    int8 = extractor.LayoutExtractor(onnx_dir, model_file="model.int8.onnx").predict(pages)
+    labels = [(a[0], b[0]) for page_a, page_b in zip(fp32, int8) for a, b in zip(page_a, page_b)]
+    assert sum(a == b for a, b in labels) / len(labels) > 0.9
+
+
+def test_tiny_checkpoint_takes_full_training_windows(tiny_model):
+    checkpoint, _ = tiny_model
+    model = LayoutLMv3ForTokenClassification.from_pretrained(checkpoint).eval()
+    size = model.config.input_size
+    with torch.no_grad():
+        logits = model(
+            input_ids=torch.full((1, 512), 5, dtype=torch.long),
+            bbox=torch.zeros((1, 512, 4), dtype=torch.long),
+            attention_mask=torch.ones((1, 512), dtype=torch.long),
+            pixel_values=torch.zeros((1, 3, size, size)),
+        ).logits
+    assert logits.shape[:2] == (1, 512)
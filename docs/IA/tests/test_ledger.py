@@ -0,0 +1,144 @@
+"""
+Delta sync into the local ledger: a batch applies only on top of the stored
+watermark, the lost-response replay of the last batch is acknowledged
+without applying it twice, anything else gets the current watermark back
+(409 on /ingest), and nothing is kept or counted when the transaction rolls
+back. The /ingest routes only answer the backend.
+"""
+
+import pytest
+
+from services import storage
+from services.ledger import Ledger, WatermarkMismatch
+
+TOKEN = "test-service-token"
+
+FIRST = [
+    ("t1", "2025-03-01", -42.5, "PIX ENVIADO MERCADO", "Alimentação"),
+    ("t2", "2025-03-02", 3000.0, "SALARIO", "Renda"),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Ledger(storage.Database(str(tmp_path / "state.sqlite3")))
+
+
+def test_batches_apply_on_top_of_the_watermark(store):
+    result = store.apply("u1", 0, 10, FIRST, [])
+    assert (result["watermark"], result["rows"], result["replayed"]) == (10, 2, False)
+    assert sorted(result["inserted"]) == ["t1", "t2"]
+
+    changed = ("t1", "2025-03-01", -45.0, "PIX ENVIADO MERCADO", "Alimentação")
+    result = store.apply("u1", 10, 11, [changed], ["t2", "missing"])
+    assert (result["inserted"], result["updated"], result["deleted"]) == ([], ["t1"], ["t2"])
+    assert list(store.rows("u1")) == [changed]
+    assert store.watermark("u1") == {"user_id": "u1", "watermark": 11, "rows": 1}
+
+
+def test_resent_last_batch_is_acknowledged_once(store):
+    store.apply("u1", 0, 10, FIRST, [])
+
+    result = store.apply("u1", 0, 10, FIRST, [])
+    assert result["replayed"] is True
+    assert (result["watermark"], result["rows"]) == (10, 2)
+    assert store.stats()["batches"] == 1
+    assert store.stats()["replayed"] == 1
+
+
+@pytest.mark.parametrize("base, watermark, upserts", [
+    (5, 10, FIRST),                                                       # other base
+    (0, 10, FIRST[:1]),                                                   # other content
+    (0, 12, FIRST),                                                       # other target
+    (12, 13, FIRST),                                                      # from the future
+])
+def test_other_batches_not_on_the_watermark_are_refused(store, base, watermark, upserts):
+    store.apply("u1", 0, 10, FIRST, [])
+
+    with pytest.raises(WatermarkMismatch) as refused:
+        store.apply("u1", base, watermark, upserts, [])
+    assert refused.value.current == 10
+    assert store.watermark("u1")["watermark"] == 10
+    assert store.stats()["rejected"] == 1
+
+
+def test_replay_is_only_of_the_last_batch(store):
+    store.apply("u1", 0, 10, FIRST, [])
+    store.apply("u1", 10, 11, [], ["t2"])
+
+    with pytest.raises(WatermarkMismatch):
+        store.apply("u1", 0, 10, FIRST, [])
+
+
+def test_rolled_back_batch_leaves_nothing(store):
+    with pytest.raises(RuntimeError):
+        with store.db.write():
+            store.apply("u1", 0, 10, FIRST, [])
+            raise RuntimeError("later step of the ingest transaction failed")
+
+    assert store.watermark("u1")["watermark"] == 0
+    assert list(store.rows("u1")) == []
+    assert store.stats()["batches"] == store.stats()["upserts"] == 0
+    assert store.apply("u1", 0, 10, FIRST, [])["replayed"] is False
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from routes import ingest
+
+    monkeypatch.setenv("AI_SERVICE_TOKEN", TOKEN)
+    app = FastAPI()
+    app.include_router(ingest.router, prefix="/ingest")
+    return TestClient(app)
+
+
+def batch(user_id, base, watermark, upserts=(), deletes=()):
+    return {
+        "user_id": user_id,
+        "base_watermark": base,
+        "watermark": watermark,
+        "upserts": [
+            {"id": row_id, "date": row_date, "amount": amount, "description": description, "category": category}
+            for row_id, row_date, amount, description, category in upserts
+        ],
+        "deletes": list(deletes),
+    }
+
+
+def test_ingest_routes_require_the_service_token(client, monkeypatch):
+    for method, path in [("post", "/ingest/batch"), ("get", "/ingest/u1/watermark"), ("delete", "/ingest/u1")]:
+        kwargs = {"json": batch("u1", 0, 1)} if method == "post" else {}
+        response = getattr(client, method)(path, **kwargs)
+        assert response.status_code == 401, path
+        assert response.headers["www-authenticate"] == "Bearer"
+        response = getattr(client, method)(path, headers={"Authorization": "Bearer wrong"}, **kwargs)
+        assert response.status_code == 401, path
+
+    monkeypatch.delenv("AI_SERVICE_TOKEN")
+    response = client.get("/ingest/u1/watermark", headers={"Authorization": f"Bearer {TOKEN}"})
+    assert response.status_code == 403
+
+
+def test_ingest_resumes_from_the_returned_watermark(client):
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    client.delete("/ingest/route-user", headers=headers)
+
+    response = client.post("/ingest/batch", json=batch("route-user", 0, 10, FIRST), headers=headers)
+    assert response.status_code == 200
+    assert (response.json()["inserted"], response.json()["replayed"]) == (2, False)
+    response = client.post("/ingest/batch", json=batch("route-user", 0, 10, FIRST), headers=headers)
+    assert (response.status_code, response.json()["replayed"]) == (200, True)
+
+    response = client.post("/ingest/batch", json=batch("route-user", 0, 10, FIRST[:1]), headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["watermark"] == 10
+    assert client.get("/ingest/route-user/watermark", headers=headers).json() == {
+        "user_id": "route-user", "watermark": 10, "rows": 2,
+    }
+
+    assert client.delete("/ingest/route-user", headers=headers).json()["watermark"] == 0
+    response = client.post("/ingest/batch", json=batch("route-user", 0, 1, FIRST), headers=headers)
+    assert (response.status_code, response.json()["rows"]) == (200, 2)
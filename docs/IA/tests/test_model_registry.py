@@ -0,0 +1,144 @@
+"""
+The model registry against a local directory, without network: what is
+registered is what resolve() hands to from_pretrained(), corrupted blobs are
+caught, offline mode never reaches the HuggingFace Hub and gc only drops
+what the manifest no longer references.
+"""
+
+import json
+import os
+
+import pytest
+
+import model_registry
+from model_registry import ChecksumMismatch, ModelNotAvailable, ModelRegistry
+
+FILES = {
+    "config.json": b'{"model_type": "layoutlmv3"}',
+    "tokenizer/vocab.json": b'{"[PAD]": 0, "extrato": 1}',
+    "model.onnx": os.urandom(4096),
+}
+
+
+def write_model(root, files):
+    for relative, content in files.items():
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return str(root)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path / "store"), str(tmp_path / "manifest.json"))
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = write_model(tmp_path / "source", FILES)
+    (tmp_path / "source" / ".cache").mkdir()
+    (tmp_path / "source" / ".cache" / "lock").write_bytes(b"")
+    return root
+
+
+@pytest.fixture(autouse=True)
+def online(monkeypatch):
+    monkeypatch.delenv("AI_MODELS_OFFLINE", raising=False)
+    monkeypatch.delenv("HF_HUB_OFFLINE", raising=False)
+
+
+def test_add_pins_every_file(registry, source):
+    entry = registry.add("local/extrato", source)
+
+    assert [f["path"] for f in entry["files"]] == sorted(FILES)  # hidden files are skipped
+    for f in entry["files"]:
+        assert f["size"] == len(FILES[f["path"]])
+        assert model_registry.sha256_file(registry.blob_path(f["sha256"])) == f["sha256"]
+    with open(registry.manifest_path, encoding="utf-8") as f:
+        assert json.load(f)["models"] == {"local/extrato": entry}
+    assert registry.add("local/extrato", source)["revision"] == entry["revision"]
+
+
+def test_identical_files_share_one_blob(registry, source, tmp_path):
+    registry.add("local/extrato", source)
+    other = write_model(tmp_path / "other", {"tokenizer/vocab.json": FILES["tokenizer/vocab.json"], "head.bin": b"x"})
+    registry.add("local/other", other)
+
+    blobs = [name for _, _, names in os.walk(os.path.join(registry.store_dir, "blobs")) for name in names]
+    assert len(blobs) == len(FILES) + 1
+    assert sorted(registry.manifest()) == ["local/extrato", "local/other"]
+
+
+def test_resolve_exposes_the_registered_files(registry, source):
+    registry.add("local/extrato", source)
+    snapshot = registry.resolve("local/extrato")
+
+    for relative, content in FILES.items():
+        with open(os.path.join(snapshot, relative), "rb") as f:
+            assert f.read() == content
+    assert registry.resolve("local/extrato") == snapshot
+
+
+def test_corrupted_blob_is_detected_and_dropped(registry, source):
+    entry = registry.add("local/extrato", source)
+    blob = registry.blob_path(next(f["sha256"] for f in entry["files"] if f["path"] == "model.onnx"))
+    os.chmod(blob, 0o644)
+    with open(blob, "r+b") as f:
+        f.write(b"\0" * 16)  # same size, different content
+
+    fresh = ModelRegistry(registry.store_dir, registry.manifest_path)  # nothing verified yet in this process
+    with pytest.raises(ChecksumMismatch):
+        fresh.verify("local/extrato")
+    assert not os.path.exists(blob)
+    with pytest.raises(ModelNotAvailable):
+        fresh.verify("local/extrato")
+
+
+def test_offline_resolve_never_fetches(registry, source, monkeypatch):
+    entry = registry.add("local/extrato", source)
+    monkeypatch.setenv("AI_MODELS_OFFLINE", "1")
+    monkeypatch.setattr(registry, "fetch", lambda *args, **kwargs: pytest.fail("fetch called offline"))
+
+    assert os.path.isdir(registry.resolve("local/extrato"))
+
+    os.remove(registry.blob_path(entry["files"][0]["sha256"]))
+    fresh = ModelRegistry(registry.store_dir, registry.manifest_path)
+    monkeypatch.setattr(fresh, "fetch", lambda *args, **kwargs: pytest.fail("fetch called offline"))
+    with pytest.raises(ModelNotAvailable):
+        fresh.resolve("local/extrato")
+
+
+def test_offline_fetch_is_refused(registry, monkeypatch):
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    with pytest.raises(ModelNotAvailable):
+        registry.fetch("microsoft/layoutlmv3-base")
+
+
+def test_module_resolve_of_unmanifested_model(registry, monkeypatch):
+    monkeypatch.setattr(model_registry, "registry", registry)
+
+    assert model_registry.resolve("microsoft/layoutlmv3-base") == "microsoft/layoutlmv3-base"
+    monkeypatch.setenv("AI_MODELS_OFFLINE", "1")
+    with pytest.raises(ModelNotAvailable):
+        model_registry.resolve("microsoft/layoutlmv3-base")
+
+
+def test_gc_drops_only_unreferenced_blobs(registry, source, tmp_path):
+    kept = registry.add("local/extrato", source)
+    other = write_model(tmp_path / "other", {"tokenizer/vocab.json": FILES["tokenizer/vocab.json"], "head.bin": b"x"})
+    dropped = registry.add("local/other", other)
+    kept_snapshot = registry.resolve("local/extrato")
+    dropped_snapshot = registry.resolve("local/other")
+
+    models = registry.manifest()
+    del models["local/other"]
+    registry._save_manifest(models)
+
+    assert registry.gc() == 1  # head.bin; the shared vocab stays
+    assert not os.path.exists(dropped_snapshot)
+    assert os.path.isdir(kept_snapshot)
+    shared = next(f["sha256"] for f in dropped["files"] if f["path"] == "tokenizer/vocab.json")
+    assert os.path.exists(registry.blob_path(shared))
+    fresh = ModelRegistry(registry.store_dir, registry.manifest_path)
+    fresh.verify("local/extrato")
+    assert fresh.manifest() == {"local/extrato": kept}
@@ -0,0 +1,89 @@
+"""
+Content negotiation of the row-heavy routes: the best acceptable type we
+can encode wins, a type excluded with q=0 is never picked - not even
+through a wildcard - and nothing acceptable is a 406.
+"""
+
+import json
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from services import negotiation
+from services.negotiation import ARROW, COLUMNS_JSON, JSON, MSGPACK, NDJSON
+
+BODY = {
+    "total": 2,
+    "transactions": [{"id": 1, "category": {"name": "Lazer"}}, {"id": 2, "category": {"name": "Saúde"}}],
+}
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, JSON),
+    ("", JSON),
+    ("*/*", JSON),
+    ("application/x-ndjson", NDJSON),
+    ("text/html, application/x-ndjson;q=0.5, application/json;q=0.9", JSON),
+    ("application/x-ndjson, application/json", NDJSON),  # equal q: header order
+    ("application/jsonlines", NDJSON),
+    ("APPLICATION/VND.WILLFINANCE.COLUMNS+JSON", COLUMNS_JSON),
+    ("application/json;q=0, */*", NDJSON),
+    ("application/json;q=0, application/x-ndjson;q=0, application/*;q=0.1", COLUMNS_JSON),
+    ("application/json;q=abc, application/x-ndjson;q=0.1", NDJSON),  # a malformed q counts as 0
+])
+def test_negotiate(header, expected):
+    assert negotiation.negotiate(header) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "text/html",
+    "application/json;q=0",
+    "*/*;q=0",
+    ",".join(f"{media};q=0" for media in negotiation.ENCODERS) + ", */*",
+])
+def test_nothing_acceptable_is_406(header):
+    with pytest.raises(HTTPException) as refused:
+        negotiation.negotiate(header)
+    assert refused.value.status_code == 406
+    assert JSON in refused.value.detail["supported"]
+
+
+def test_optional_formats_only_when_installed():
+    if negotiation.msgpack is None:
+        with pytest.raises(HTTPException):
+            negotiation.negotiate("application/msgpack")
+    else:
+        assert negotiation.negotiate("application/x-msgpack") == MSGPACK
+    if negotiation.pa is not None:
+        assert negotiation.negotiate("application/vnd.apache.arrow.file") == ARROW
+
+
+def request(accept=None):
+    headers = [(b"accept", accept.encode())] if accept else []
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers})
+
+
+def test_render_moves_metadata_out_of_the_rows():
+    response = negotiation.render(request("application/x-ndjson"), BODY, "transactions")
+    assert response.media_type == NDJSON
+    assert response.headers["vary"] == "Accept"
+    assert json.loads(response.headers[negotiation.META_HEADER]) == {"total": 2}
+    assert [json.loads(line) for line in response.body.splitlines()] == BODY["transactions"]
+
+    response = negotiation.render(request(), BODY, "transactions", media=COLUMNS_JSON)
+    assert json.loads(response.body) == {
+        "meta": {"total": 2},
+        "columns": {"id": [1, 2], "category.name": ["Lazer", "Saúde"]},
+    }
+
+
+def test_binary_formats_round_trip():
+    if negotiation.msgpack is not None:
+        response = negotiation.render(request(MSGPACK), BODY, "transactions")
+        assert negotiation.msgpack.unpackb(response.body) == BODY
+    if negotiation.pa is not None:
+        response = negotiation.render(request(ARROW), BODY, "transactions")
+        table = negotiation.pa.ipc.open_stream(response.body).read_all()
+        assert table.column("category.name").to_pylist() == ["Lazer", "Saúde"]
+        assert json.loads(table.schema.metadata[b"meta"]) == {"total": 2}
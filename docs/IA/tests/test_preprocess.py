@@ -0,0 +1,64 @@
+"""
+Row segmentation of scanned pages: a transaction's date, history, detail
+line and amount - staggered over two or three lines - must reach OCR as
+one region.
+"""
+
+import os
+
+import pytest
+
+from services import preprocess
+
+PDF_DIR = os.path.join(os.path.dirname(__file__), "..", "datasets", "pdf")
+
+
+def test_rows_are_anchored_on_the_date_column():
+    fragments = [
+        [100, 100, 400, 140],    # Dia / Histórico / Valor header
+        [2200, 100, 2350, 140],
+        [100, 200, 300, 240],    # 05/03/2025
+        [400, 200, 900, 240],    # Compra com Cartão
+        [400, 250, 1100, 290],   # 02/03 14:13 LOJAO DA CONSTRUC
+        [2200, 230, 2380, 270],  # 8,00 (-)
+        [100, 320, 300, 360],    # 05/03/2025
+        [400, 320, 800, 360],    # Pix - Enviado
+        [2200, 350, 2380, 390],  # 20,00 (-)
+        [400, 1500, 700, 1540],  # stray text far below the last row
+    ]
+    assert preprocess.text_rows(fragments) == [
+        [100, 100, 2350, 140],
+        [100, 200, 2380, 290],
+        [100, 320, 2380, 390],
+        [400, 1500, 700, 1540],
+    ]
+
+
+def test_no_fragments_no_rows():
+    assert preprocess.text_rows([]) == []
+
+
+def test_each_statement_row_is_one_region():
+    pytest.importorskip("cv2")
+    pymupdf = pytest.importorskip("pymupdf")
+    from PIL import Image
+
+    from services import documents, statement
+
+    path = os.path.join(PDF_DIR, sorted(f for f in os.listdir(PDF_DIR) if f.endswith(".pdf"))[0])
+    with open(path, "rb") as f:
+        words = documents.pdf_pages(f.read())[0].words
+    with pymupdf.open(path) as doc:
+        pix = doc[0].get_pixmap(dpi=150, colorspace=pymupdf.csGRAY, alpha=False)
+    prepared = preprocess.prepare(Image.frombytes("L", (pix.width, pix.height), pix.samples), 150)
+    height, width = prepared.binary.shape
+
+    def region_of(box):
+        x, y = (box[0] + box[2]) / 2000 * width, (box[1] + box[3]) / 2000 * height
+        return next(i for i, (rx, ry, rw, rh) in enumerate(prepared.regions) if rx <= x < rx + rw and ry <= y < ry + rh)
+
+    rows = [fields for fields in statement.parse_rows(words) if "data" in fields and "valor" in fields]
+    assert len(rows) >= 15
+    for fields in rows:
+        indices = [i for field in ("data", "descricao", "valor", "tipo") for i in fields.get(field, [])]
+        assert len({region_of(words[i][1]) for i in indices}) == 1, [words[i][0] for i in indices]
@@ -0,0 +1,122 @@
+"""
+Request coalescing: concurrent calls with one key share one computation
+and its result or exception, a caller going away does not cancel it for
+the others, and finished results are only reused inside the window.
+"""
+
+import asyncio
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Counted:
+    def __init__(self, result=None, error=None, delay=0.01):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        group = SingleFlight()
+        fn = Counted(result={"Lazer": {"2025-03": 10.0}})
+        results = await asyncio.gather(*(group.do(("history", "u1", 6), fn) for _ in range(5)))
+        other = await group.do(("history", "u2", 6), fn)
+        return group, fn, results, other
+
+    group, fn, results, other = run(scenario())
+    assert fn.calls == 2
+    assert all(result is results[0] for result in results)
+    assert other == results[0]
+    assert group.stats() == {"calls": 6, "shared": 4, "executed": 2, "in_flight": 0}
+
+
+def test_waiters_share_the_exception_and_the_key_is_freed():
+    async def scenario():
+        group = SingleFlight(window=60)
+        fn = Counted(error=ValueError("ledger unavailable"))
+        results = await asyncio.gather(*(group.do(("k", "u1"), fn) for _ in range(3)), return_exceptions=True)
+        fn.error, fn.result = None, "ok"
+        return fn, results, await group.do(("k", "u1"), fn)
+
+    fn, results, retried = run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert (fn.calls, retried) == (2, "ok")  # a failure is never cached
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def scenario():
+        group = SingleFlight()
+        fn = Counted(result=42, delay=0.05)
+        first = asyncio.create_task(group.do(("k", "u1"), fn))
+        second = asyncio.create_task(group.do(("k", "u1"), fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return fn, await second
+
+    fn, result = run(scenario())
+    assert (fn.calls, result) == (1, 42)
+
+
+def test_results_are_reused_only_inside_the_window():
+    async def scenario():
+        fn = Counted(result=1, delay=0)
+        without, within = SingleFlight(window=0), SingleFlight(window=60)
+        for group in (without, within):
+            await group.do(("k", "u1"), fn)
+            await group.do(("k", "u1"), fn)
+        calls_before_forget = fn.calls
+        within.forget("u1")
+        await within.do(("k", "u1"), fn)
+        return calls_before_forget, fn.calls
+
+    assert run(scenario()) == (3, 4)
+
+
+def test_disabled_group_runs_every_call():
+    async def scenario():
+        fn = Counted(result=1)
+        await asyncio.gather(*(SingleFlight(enabled=False).do(("k", "u1"), fn) for _ in range(3)))
+        return fn.calls
+
+    assert run(scenario()) == 3
+
+
+def test_coalesce_keys_on_the_route_arguments():
+    async def scenario():
+        group = SingleFlight()
+        calls = []
+
+        @group.coalesce("expenses")
+        async def expenses(user_id: str, months: int = 6, categories: list = ()):
+            calls.append((user_id, months))
+            await asyncio.sleep(0.01)
+            return {"user_id": user_id, "months": months}
+
+        await asyncio.gather(
+            expenses(user_id="u1", months=6, categories=["Lazer"]),
+            expenses(user_id="u1", months=6, categories=["Lazer"]),
+            expenses(user_id="u1", months=3, categories=["Lazer"]),
+            expenses(user_id="u2", months=6, categories=["Lazer"]),
+        )
+        return calls, expenses
+
+    calls, expenses = run(scenario())
+    assert sorted(calls) == [("u1", 3), ("u1", 6), ("u2", 6)]
+    assert expenses.__name__ == "expenses"